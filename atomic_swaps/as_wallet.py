@@ -12,7 +12,35 @@ def build_spend_bundle(coin, solution, sign_f):
     signature = signature_for_solution(solution, sign_f)
     return SpendBundle([coin_solution], signature)
 
-from puzzles.p2_delegated_puzzle import puzzle_for_pk
+from puzzles.p2_delegated_puzzle import puzzle_hash_for_pk
+from puzzles.puzzle_template import PuzzleTemplate
+
+
+def as_puzzle_source():
+    payout_receiver = f"(c (q 0x{ConditionOpcode.CREATE_COIN.hex()}) (c (q {{as_payout_puzzlehash_receiver}}) (c (q {{as_amount}}) (q ()))))"
+    payout_sender = f"(c (q 0x{ConditionOpcode.CREATE_COIN.hex()}) (c (q {{as_payout_puzzlehash_sender}}) (c (q {{as_amount}}) (q ()))))"
+    aggsig_receiver = f"(c (q 0x{ConditionOpcode.AGG_SIG.hex()}) (c (q {{as_pubkey_receiver}}) (c (sha256tree (a)) (q ()))))"
+    aggsig_sender = f"(c (q 0x{ConditionOpcode.AGG_SIG.hex()}) (c (q {{as_pubkey_sender}}) (c (sha256tree (a)) (q ()))))"
+    receiver_puz = ("((c (i (= (sha256 (f (r (a)))) (q {as_secret_hash})) (q (c " + aggsig_receiver + " (c " + payout_receiver + " (q ())))) (q (x (q 'invalid secret')))) (a))) ) ")
+    timelock = f"(c (q 0x{ConditionOpcode.ASSERT_BLOCK_INDEX_EXCEEDS.hex()}) (c (q {{as_timelock_block}}) (q ()))) "
+    sender_puz = "(c " + aggsig_sender + " (c " + timelock + " (c " + payout_sender + " (q ()))))"
+    as_puz_sender = "((c (i (= (f (a)) (q 77777)) (q " + sender_puz + ") (q (x (q 'not a valid option'))) ) (a)))"
+    return "((c (i (= (f (a)) (q 33333)) (q " + receiver_puz + " (q " + as_puz_sender + ")) (a)))"
+
+
+AS_TEMPLATE = PuzzleTemplate(as_puzzle_source())
+
+
+def as_puzzle_parameters(as_pubkey_sender, as_pubkey_receiver, as_amount, as_timelock_block, as_secret_hash):
+    return dict(
+        as_pubkey_sender=as_pubkey_sender,
+        as_pubkey_receiver=as_pubkey_receiver,
+        as_payout_puzzlehash_sender=puzzle_hash_for_pk(as_pubkey_sender),
+        as_payout_puzzlehash_receiver=puzzle_hash_for_pk(as_pubkey_receiver),
+        as_amount=as_amount,
+        as_timelock_block=as_timelock_block,
+        as_secret_hash=as_secret_hash,
+    )
 
 
 # ASWallet is subclass of Wallet
@@ -64,25 +92,12 @@ class ASWallet(Wallet):
         return secret_hash
 
     def as_make_puzzle(self, as_pubkey_sender, as_pubkey_receiver, as_amount, as_timelock_block, as_secret_hash):
-        as_pubkey_sender_cl = f"0x{as_pubkey_sender.hex()}"
-        as_pubkey_receiver_cl = f"0x{as_pubkey_receiver.hex()}"
-        as_payout_puzzlehash_receiver = ProgramHash(puzzle_for_pk(as_pubkey_receiver))
-        as_payout_puzzlehash_sender = ProgramHash(puzzle_for_pk(as_pubkey_sender))
-        payout_receiver = f"(c (q 0x{ConditionOpcode.CREATE_COIN.hex()}) (c (q 0x{as_payout_puzzlehash_receiver.hex()}) (c (q {as_amount}) (q ()))))"
-        payout_sender = f"(c (q 0x{ConditionOpcode.CREATE_COIN.hex()}) (c (q 0x{as_payout_puzzlehash_sender.hex()}) (c (q {as_amount}) (q ()))))"
-        aggsig_receiver = f"(c (q 0x{ConditionOpcode.AGG_SIG.hex()}) (c (q {as_pubkey_receiver_cl}) (c (sha256tree (a)) (q ()))))"
-        aggsig_sender = f"(c (q 0x{ConditionOpcode.AGG_SIG.hex()}) (c (q {as_pubkey_sender_cl}) (c (sha256tree (a)) (q ()))))"
-        receiver_puz = (f"((c (i (= (sha256 (f (r (a)))) (q {as_secret_hash})) (q (c " + aggsig_receiver + " (c " + payout_receiver + " (q ())))) (q (x (q 'invalid secret')))) (a))) ) ")
-        timelock = f"(c (q 0x{ConditionOpcode.ASSERT_BLOCK_INDEX_EXCEEDS.hex()}) (c (q {as_timelock_block}) (q ()))) "
-        sender_puz = "(c " + aggsig_sender + " (c " + timelock + " (c " + payout_sender + " (q ()))))"
-        as_puz_sender = "((c (i (= (f (a)) (q 77777)) (q " + sender_puz + ") (q (x (q 'not a valid option'))) ) (a)))"
-        as_puz = "((c (i (= (f (a)) (q 33333)) (q " + receiver_puz + " (q " + as_puz_sender + ")) (a)))"
-        return Program(binutils.assemble(as_puz))
+        return AS_TEMPLATE.puzzle(**as_puzzle_parameters(
+            as_pubkey_sender, as_pubkey_receiver, as_amount, as_timelock_block, as_secret_hash))
 
     def as_get_new_puzzlehash(self, as_pubkey_sender, as_pubkey_receiver, as_amount, as_timelock_block, as_secret_hash):
-        as_puz = self.as_make_puzzle(as_pubkey_sender, as_pubkey_receiver, as_amount, as_timelock_block, as_secret_hash)
-        as_puzzlehash = ProgramHash(as_puz)
-        return as_puzzlehash
+        return AS_TEMPLATE.puzzle_hash(**as_puzzle_parameters(
+            as_pubkey_sender, as_pubkey_receiver, as_amount, as_timelock_block, as_secret_hash))
 
     # 33333 is the receiver solution code prefix
     def as_make_solution_receiver(self, as_sec_to_try):
@@ -2,12 +2,11 @@ import asyncio
 import os
 from atomic_swaps.as_wallet import ASWallet
 from chiasim.clients.ledger_sim import connect_to_ledger_sim
-from chiasim.wallet.deltas import additions_for_body, removals_for_body
-from chiasim.hashable import Coin
-from chiasim.hashable.Body import BodyList
 from utilities.decorations import print_leaf, divider, prompt, start_list, close_list, selectable, informative
 from clvm_tools import binutils
 from utilities.puzzle_utilities import pubkey_format, secret_hash_format, puzzlehash_from_string
+from utilities.block_sync import BlockSync
+from utilities.preimage_cache import CachedLedgerAPI, PreimageCache
 
 
 # prints wallet details, allows wallet name edit, generates new pubkeys and new puzzlehashes
@@ -629,7 +628,7 @@ async def init_swap_start(wallet, ledger_api, as_contacts):
 
 
 # finishes creating the swap initiator's swap
-async def init_swap_finish(wallet, ledger_api, most_recent_header, as_contacts, puzzlehash_outgoing, tip_index):
+async def init_swap_finish(wallet, ledger_api, block_sync, as_contacts, puzzlehash_outgoing, tip_index):
     for swap in wallet.as_swap_list:
         if puzzlehash_outgoing.hex() == str(swap["outgoing puzzlehash"]):
             swap_index = wallet.as_swap_list.index(swap)
@@ -641,7 +640,7 @@ async def init_swap_finish(wallet, ledger_api, most_recent_header, as_contacts,
     print("Waiting for your incoming coin to appear on the blockchain . . .")
     check = False
     while not check:
-        await get_update(wallet, ledger_api, most_recent_header, as_contacts)
+        await get_update(wallet, block_sync, as_contacts)
         tip = await ledger_api.get_tip()
         for coin in wallet.as_pending_utxos:
             if puzzlehash_incoming == coin.puzzle_hash.hex():
@@ -859,7 +858,7 @@ async def set_parameters_add(wallet, ledger_api, as_contacts):
 # creates the swap adder's swap
 # sets parameters
 # creates swap adder's outgoing coin
-async def add_swap(wallet, ledger_api, most_recent_header, as_contacts):
+async def add_swap(wallet, ledger_api, block_sync, as_contacts):
     print()
     print(divider)
     print(f" {informative} Add Atomic Swap {informative}")
@@ -890,7 +889,7 @@ async def add_swap(wallet, ledger_api, most_recent_header, as_contacts):
     print()
     print("Waiting for your incoming coin to appear on the blockchain . . .")
     while not check:
-        await get_update(wallet, ledger_api, most_recent_header, as_contacts)
+        await get_update(wallet, block_sync, as_contacts)
         tip = await ledger_api.get_tip()
         for coin in wallet.as_pending_utxos:
             if puzzlehash_incoming == coin.puzzle_hash.hex():
@@ -1079,33 +1078,25 @@ def spend_coin(wallet, as_contacts):
     return spend_bundle
 
               
-async def get_update(wallet, ledger_api, most_recent_header, as_contacts):
-    if most_recent_header is None:
-        r = await ledger_api.get_all_blocks()
-    else:
-        r = await ledger_api.get_recent_blocks(most_recent_header=most_recent_header)
-    update_list = BodyList.from_bytes(r)
-    for body in update_list:
-        additions = list(additions_for_body(body))
-        removals = removals_for_body(body)
-        removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
+async def get_update(wallet, block_sync, as_contacts):
+    async for index, header, additions, removals in block_sync.new_blocks():
         if wallet.as_swap_list != []:
-            wallet.pull_preimage(body, removals)
+            wallet.pull_preimage(await block_sync.body(header), removals)
         remove_swap_instances(wallet, as_contacts, removals)
         wallet.notify(additions, removals)
 
 
-async def update_ledger(wallet, ledger_api, most_recent_header, as_contacts):
+async def update_ledger(wallet, block_sync, as_contacts):
     print()
     print(divider)
     print(f" {informative} Get Update {informative}")
-    await get_update(wallet, ledger_api, most_recent_header, as_contacts)
+    await get_update(wallet, block_sync, as_contacts)
     print()
     print("Update complete.")
     print(divider)
 
 
-async def farm_block(wallet, ledger_api, as_contacts):
+async def farm_block(wallet, block_sync, as_contacts):
     print()
     print(divider)
     print(f" {informative} Commit Block {informative}")
@@ -1113,25 +1104,21 @@ async def farm_block(wallet, ledger_api, as_contacts):
     print("You have received a block reward.")
     coinbase_puzzle_hash = wallet.get_new_puzzlehash()
     fees_puzzle_hash = wallet.get_new_puzzlehash()
-    r = await ledger_api.next_block(coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
-    body = r["body"]
-    most_recent_header = r['header']
-    additions = list(additions_for_body(body))
-    removals = removals_for_body(body)
-    removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
-    remove_swap_instances(wallet, as_contacts, removals)
-    wallet.notify(additions, removals)
+    r = await block_sync.ledger_api().next_block(
+        coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
+    block_sync.add_block(r['header'], r['body'])
+    await get_update(wallet, block_sync, as_contacts)
     del wallet.overlook[:]
     print(divider)
-    return most_recent_header
+    return block_sync.checkpoint()
 
 
 async def main_loop():
-    ledger_api = await connect_to_ledger_sim("localhost", 9868)
+    ledger_api = CachedLedgerAPI(await connect_to_ledger_sim("localhost", 9868), PreimageCache())
     selection = ""
     wallet = ASWallet()
     as_contacts = {}
-    most_recent_header = None
+    block_sync = BlockSync(ledger_api)
     print_leaf()
     print()
     print("Welcome to your Chia Atomic Swap Wallet.")
@@ -1179,21 +1166,21 @@ async def main_loop():
             spend_bundle, puzzlehash_outgoing, tip = await init_swap_start(wallet, ledger_api, as_contacts)
             if spend_bundle is not None:
                 await ledger_api.push_tx(tx=spend_bundle)
-                await farm_block(wallet, ledger_api, as_contacts)
-                await init_swap_finish(wallet, ledger_api, most_recent_header, as_contacts, puzzlehash_outgoing, tip["tip_index"])
+                await farm_block(wallet, block_sync, as_contacts)
+                await init_swap_finish(wallet, ledger_api, block_sync, as_contacts, puzzlehash_outgoing, tip["tip_index"])
         elif selection == "8":
-            spend_bundle = await add_swap(wallet, ledger_api, most_recent_header, as_contacts)
+            spend_bundle = await add_swap(wallet, ledger_api, block_sync, as_contacts)
             if spend_bundle is not None:
                 await ledger_api.push_tx(tx=spend_bundle)
-                await farm_block(wallet, ledger_api, as_contacts)
+                await farm_block(wallet, block_sync, as_contacts)
         elif selection == "9":
             spend_bundle = spend_coin(wallet, as_contacts)
             if spend_bundle is not None:
                 await ledger_api.push_tx(tx=spend_bundle)
         elif selection == "10":
-            await update_ledger(wallet, ledger_api, most_recent_header, as_contacts)
+            await update_ledger(wallet, block_sync, as_contacts)
         elif selection == "11":
-            most_recent_header = await farm_block(wallet, ledger_api, as_contacts)
+            await farm_block(wallet, block_sync, as_contacts)
 
 
 def main():
@@ -4,11 +4,12 @@ from chiasim.hashable import Program, ProgramHash, CoinSolution, SpendBundle, BL
 from chiasim.hashable.Coin import Coin
 from chiasim.hashable.CoinSolution import CoinSolutionList
 from clvm_tools import binutils
-from .ap_wallet_a_functions import ap_make_puzzle, ap_make_aggregation_puzzle
+from .ap_wallet_a_functions import ap_make_puzzle, ap_make_aggregation_puzzle, ap_get_new_puzzlehash
 from utilities.puzzle_utilities import puzzlehash_from_string
+from utilities.signing_pool import SIGN_SOLUTION_HASH
 from chiasim.validation.Conditions import ConditionOpcode
 
-from puzzles.p2_delegated_puzzle import puzzle_for_pk
+from puzzles.p2_delegated_puzzle import puzzle_hash_for_pk
 
 
 class APWallet(Wallet):
@@ -54,15 +55,20 @@ class APWallet(Wallet):
     def get_keys(self, hash, a_pubkey_used=None, b_pubkey_used=None):
         for child in reversed(range(self.next_address)):
             pubkey = self.extended_secret_key.public_child(child)
-            if hash == ProgramHash(puzzle_for_pk(bytes(pubkey))):
+            if hash == puzzle_hash_for_pk(bytes(pubkey)):
                 return (pubkey, self.extended_secret_key.private_child(child))
             if a_pubkey_used is not None and b_pubkey_used is None:
-                if hash == ProgramHash(ap_make_puzzle(a_pubkey_used, bytes(pubkey))):
+                if hash == ap_get_new_puzzlehash(a_pubkey_used, bytes(pubkey)):
                     return (pubkey, self.extended_secret_key.private_child(child))
             elif a_pubkey_used is None and b_pubkey_used is not None:
-                if hash == ProgramHash(ap_make_puzzle(bytes(pubkey), b_pubkey_used)):
+                if hash == ap_get_new_puzzlehash(bytes(pubkey), b_pubkey_used):
                     return (pubkey, self.extended_secret_key.private_child(child))
 
+    def clear_coins(self):
+        super().clear_coins()
+        self.aggregation_coins = set()
+        self.temp_coin = None
+
     def notify(self, additions, deletions):
         super().notify(additions, deletions)
         self.my_utxos = self.temp_utxos
@@ -146,13 +152,12 @@ class APWallet(Wallet):
     # this is for sending a locked coin
     # Wallet B must sign the whole transaction, and the appropriate puzhash signature from A must be included
     def ap_sign_transaction(self, spends: (Program, [CoinSolution]), signatures_from_a):
-        sigs = []
+        jobs = []
         for puzzle, solution in spends:
             pubkey, secretkey = self.get_keys(
                 solution.coin.puzzle_hash, self.a_pubkey)
-            signature = secretkey.sign(
-                ProgramHash(Program(solution.solution)))
-            sigs.append(signature)
+            jobs.append((SIGN_SOLUTION_HASH, puzzle, solution.solution, self.child_for_pubkey(pubkey)))
+        sigs = self.signing_pool.sign(jobs)
         for s in signatures_from_a:
             sigs.append(s)
         aggsig = BLSSignature.aggregate(sigs)
@@ -1,6 +1,7 @@
 from chiasim.hashable import Program, ProgramHash
 from clvm_tools import binutils
 from utilities.puzzle_utilities import pubkey_format
+from puzzles.puzzle_template import PuzzleTemplate
 from chiasim.validation.Conditions import ConditionOpcode
 
 
@@ -23,17 +24,13 @@ def merge_two_lists(list1=None, list2=None):
     return ret
 
 
-# this creates our authorised payee puzzle
-def ap_make_puzzle(a_pubkey_serialized, b_pubkey_serialized):
-    a_pubkey = pubkey_format(a_pubkey_serialized)
-    b_pubkey = pubkey_format(b_pubkey_serialized)
-
+def ap_puzzle_source():
     # Mode one is for spending to one of the approved destinations
     # Solution contains (option 1 flag, new puzzle, new solution, my_primary_input, wallet_puzzle_hash)
 
-    aggsig_entire_solution = f"(c (q 0x{ConditionOpcode.AGG_SIG.hex()}) (c (q {b_pubkey}) (c (sha256tree (a)) (q ()))))"
+    aggsig_entire_solution = f"(c (q 0x{ConditionOpcode.AGG_SIG.hex()}) (c (q {{b_pubkey}}) (c (sha256tree (a)) (q ()))))"
     create_outputs = f"((c (f (r (a))) (f (r (r (a))))))"
-    aggsig_outputs = f"((c (q ((c (f (a)) (a)))) (c (q ((c (i (f (r (a))) (q ((c (i (= (f (f (f (r (a))))) (q 0x{ConditionOpcode.CREATE_COIN.hex()})) (q ((c (f (a)) (c (f (a)) (c (r (f (r (a)))) (c (c (c (q 0x{ConditionOpcode.AGG_SIG.hex()}) (c (q {a_pubkey}) (c (f (r (f (f (r (a)))))) (q ())))) (f (r (r (a))))) (q ()))))))) (q ((c (f (a)) (c (f (a)) (c (r (f (r (a)))) (c (f (r (r (a)))) (q ())))))))) (a)))) (q (f (r (r (a)))))) (a)))) (c {create_outputs} (c {create_outputs} (q ()))))))"
+    aggsig_outputs = f"((c (q ((c (f (a)) (a)))) (c (q ((c (i (f (r (a))) (q ((c (i (= (f (f (f (r (a))))) (q 0x{ConditionOpcode.CREATE_COIN.hex()})) (q ((c (f (a)) (c (f (a)) (c (r (f (r (a)))) (c (c (c (q 0x{ConditionOpcode.AGG_SIG.hex()}) (c (q {{a_pubkey}}) (c (f (r (f (f (r (a)))))) (q ())))) (f (r (r (a))))) (q ()))))))) (q ((c (f (a)) (c (f (a)) (c (r (f (r (a)))) (c (f (r (r (a)))) (q ())))))))) (a)))) (q (f (r (r (a)))))) (a)))) (c {create_outputs} (c {create_outputs} (q ()))))))"
     sum_outputs = f"((c (q ((c (f (a)) (a)))) (c (q ((c (i (f (r (a))) (q ((c (i (= (f (f (f (r (a))))) (q 0x{ConditionOpcode.CREATE_COIN.hex()})) (q (+ (f (r (r (f (f (r (a))))))) ((c (f (a)) (c (f (a)) (c (r (f (r (a)))) (q ()))))))) (q (+ (q ()) ((c (f (a)) (c (f (a)) (c (r (f (r (a)))) (q ())))))))) (a)))) (q (q ()))) (a)))) (c {create_outputs} (q ())))))"
     mode_one_me_string = f"(c (q 0x{ConditionOpcode.ASSERT_MY_COIN_ID.hex()}) (c (sha256 (f (r (r (r (a))))) (f (r (r (r (r (a)))))) {sum_outputs}) (q ())))"
     mode_one = f"(c {aggsig_entire_solution} (c {mode_one_me_string} {aggsig_outputs}))"
@@ -48,8 +45,17 @@ def ap_make_puzzle(a_pubkey_serialized, b_pubkey_serialized):
     mode_two = f"(c {mode_two_me_string} (c {aggsig_entire_solution} \
          (c {create_lock} (c {create_consolidated} (q ())))))"
 
-    puz = f"((c (i (= (f (a)) (q 1)) (q {mode_one}) (q {mode_two})) (a)))"
-    return Program(binutils.assemble(puz))
+    return f"((c (i (= (f (a)) (q 1)) (q {mode_one}) (q {mode_two})) (a)))"
+
+
+AP_TEMPLATE = PuzzleTemplate(ap_puzzle_source())
+
+
+# this creates our authorised payee puzzle
+def ap_make_puzzle(a_pubkey_serialized, b_pubkey_serialized):
+    a_pubkey = pubkey_format(a_pubkey_serialized)
+    b_pubkey = pubkey_format(b_pubkey_serialized)
+    return AP_TEMPLATE.puzzle(a_pubkey=a_pubkey, b_pubkey=b_pubkey)
 
 
 def ap_make_aggregation_puzzle(wallet_puzzle):
@@ -66,7 +72,9 @@ def ap_make_aggregation_puzzle(wallet_puzzle):
 
 # returns the ProgramHash of a new puzzle
 def ap_get_new_puzzlehash(a_pubkey_serialized, b_pubkey_serialized):
-    return ProgramHash(ap_make_puzzle(a_pubkey_serialized, b_pubkey_serialized))
+    a_pubkey = pubkey_format(a_pubkey_serialized)
+    b_pubkey = pubkey_format(b_pubkey_serialized)
+    return AP_TEMPLATE.puzzle_hash(a_pubkey=a_pubkey, b_pubkey=b_pubkey)
 
 
 def ap_get_aggregation_puzzlehash(wallet_puzzle):
@@ -3,9 +3,8 @@ from authorised_payees.ap_wallet import APWallet
 from authorised_payees.ap_wallet_a_functions import ap_get_aggregation_puzzlehash
 from utilities.decorations import print_leaf, divider, prompt, start_list, close_list, selectable, informative
 from chiasim.clients.ledger_sim import connect_to_ledger_sim
-from chiasim.wallet.deltas import additions_for_body, removals_for_body
-from chiasim.hashable import Coin
-from chiasim.hashable.Body import BodyList
+from utilities.block_sync import BlockSync
+from utilities.preimage_cache import CachedLedgerAPI, PreimageCache
 from utilities.puzzle_utilities import pubkey_format, puzzlehash_from_string, BLSSignature_from_string
 from binascii import hexlify
 
@@ -96,36 +95,23 @@ def make_payment(wallet, approved_puzhash_sig_pairs):
     return wallet.ap_generate_signed_transaction([(puzzlehash, amount)], [approved_puzhash_sig_pairs[choice][1]])
 
 
-async def new_block(wallet, ledger_api):
+async def new_block(wallet, block_sync):
     coinbase_puzzle_hash = APWallet().get_new_puzzlehash()
     fees_puzzle_hash = APWallet().get_new_puzzlehash()
-    r = await ledger_api.next_block(coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
-    body = r["body"]
-    most_recent_header = r['header']
-    additions = list(additions_for_body(body))
-    removals = removals_for_body(body)
-    removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
-    wallet.notify(additions, removals)
-    return most_recent_header
-
-
-async def update_ledger(wallet, ledger_api, most_recent_header):
-    if most_recent_header is None:
-        r = await ledger_api.get_all_blocks()
-    else:
-        r = await ledger_api.get_recent_blocks(most_recent_header=most_recent_header)
-    update_list = BodyList.from_bytes(r)
-    for body in update_list:
-        additions = list(additions_for_body(body))
-        print(additions)
-        removals = removals_for_body(body)
-        removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
+    r = await block_sync.ledger_api().next_block(
+        coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
+    block_sync.add_block(r['header'], r['body'])
+    return await update_ledger(wallet, block_sync)
+
+
+async def update_ledger(wallet, block_sync):
+    ledger_api = block_sync.ledger_api()
+    async for index, header, additions, removals in block_sync.new_blocks():
         spend_bundle_list = wallet.notify(additions, removals)
-        #breakpoint()
         if spend_bundle_list is not None:
             for spend_bundle in spend_bundle_list:
-                #breakpoint()
                 _ = await ledger_api.push_tx(tx=spend_bundle)
+    return block_sync.checkpoint()
 
 
 def ap_settings(wallet, approved_puzhash_sig_pairs):
@@ -150,11 +136,11 @@ def ap_settings(wallet, approved_puzhash_sig_pairs):
 
 
 async def main_loop():
-    ledger_api = await connect_to_ledger_sim("localhost", 9868)
+    ledger_api = CachedLedgerAPI(await connect_to_ledger_sim("localhost", 9868), PreimageCache())
     selection = ""
     wallet = APWallet()
     approved_puzhash_sig_pairs = {}  # 'name': (puzhash, signature)
-    most_recent_header = None
+    block_sync = BlockSync(ledger_api, on_reorg=wallet.clear_coins)
     print(divider)
     print_leaf()
     print(divider)
@@ -203,9 +189,9 @@ async def main_loop():
         elif selection == "3":
             view_contacts(approved_puzhash_sig_pairs)
         elif selection == "4":
-            await update_ledger(wallet, ledger_api, most_recent_header)
+            await update_ledger(wallet, block_sync)
         elif selection == "5":
-            most_recent_header = await new_block(wallet, ledger_api)
+            await new_block(wallet, block_sync)
         elif selection == "6":
             print_my_details(wallet)
         elif selection == "7":
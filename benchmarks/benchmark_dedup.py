@@ -0,0 +1,60 @@
+"""
+Measure the memory Wallet.notify keeps for deduplication over a long
+synthetic chain, against a dict of every coin ever seen.
+
+Run with:
+
+    $ python -m benchmarks.benchmark_dedup [coin_count] [coins_per_block]
+"""
+
+import sys
+import time
+import tracemalloc
+from os import urandom
+
+from chiasim.hashable import Coin
+
+from standard_wallet.wallet import Wallet
+
+
+def blocks(wallet_puzzle_hashes, coin_count, coins_per_block):
+    """
+    Yield lists of additions, with one coin in every coins_per_block
+    belonging to the wallet.
+    """
+    other_puzzle_hash = urandom(32)
+    for start in range(0, coin_count, coins_per_block):
+        additions = [Coin(urandom(32), other_puzzle_hash, 1)
+                     for _ in range(min(coins_per_block, coin_count - start) - 1)]
+        additions.append(Coin(urandom(32), wallet_puzzle_hashes[start % len(wallet_puzzle_hashes)], 1))
+        yield additions
+
+
+def measure(coin_count, coins_per_block, unbounded):
+    wallet = Wallet()
+    puzzle_hashes = [wallet.get_new_puzzlehash() for _ in range(100)]
+    all_additions = {}
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.time()
+    for additions in blocks(puzzle_hashes, coin_count, coins_per_block):
+        if unbounded:
+            for coin in additions:
+                all_additions[coin.name()] = coin
+        wallet.notify(additions, [])
+    elapsed = time.time() - start
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained, elapsed, len(wallet.my_utxos)
+
+
+def main(coin_count=1000000, coins_per_block=1000):
+    for unbounded in (False, True):
+        retained, elapsed, utxo_count = measure(coin_count, coins_per_block, unbounded)
+        label = "all coins dict" if unbounded else "height window"
+        print(f"{label}: {coin_count} coins in {elapsed:.1f}s, "
+              f"{retained / 1e6:.1f}MB retained, {utxo_count} utxos")
+
+
+if __name__ == "__main__":
+    main(*[int(_) for _ in sys.argv[1:]])
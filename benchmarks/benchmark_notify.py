@@ -0,0 +1,53 @@
+"""
+Measure Wallet.notify throughput for a wallet that has already handed out
+a large number of addresses.
+
+Run with:
+
+    $ python -m benchmarks.benchmark_notify [address_count] [coin_count]
+"""
+
+import sys
+import time
+from os import urandom
+
+from chiasim.hashable import Coin
+
+from standard_wallet.wallet import Wallet
+
+
+def make_coins(puzzle_hashes, count):
+    coins = []
+    for _ in range(count):
+        puzzle_hash = puzzle_hashes[_ % len(puzzle_hashes)]
+        coins.append(Coin(urandom(32), puzzle_hash, _ + 1))
+    return coins
+
+
+def main(address_count=10000, coin_count=10000):
+    wallet = Wallet()
+
+    start = time.time()
+    puzzle_hashes = [wallet.get_new_puzzlehash() for _ in range(address_count)]
+    elapsed = time.time() - start
+    print(f"issued {address_count} addresses in {elapsed:.2f}s")
+
+    start = time.time()
+    wallet.update_puzzle_hash_index()
+    elapsed = time.time() - start
+    print(f"indexed {address_count} addresses in {elapsed:.2f}s")
+
+    # half of the coins are ours, half belong to somebody else
+    mine = make_coins(puzzle_hashes, coin_count // 2)
+    theirs = make_coins([urandom(32) for _ in range(100)], coin_count - len(mine))
+
+    start = time.time()
+    wallet.notify(mine + theirs, [])
+    elapsed = time.time() - start
+    print(f"notify: {coin_count} additions in {elapsed:.2f}s "
+          f"({coin_count / elapsed:.0f} coins/s)")
+    assert len(wallet.my_utxos) == len(mine)
+
+
+if __name__ == "__main__":
+    main(*[int(_) for _ in sys.argv[1:]])
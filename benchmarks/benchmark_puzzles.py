@@ -0,0 +1,261 @@
+"""
+Profile each puzzle family: how long building a puzzle and hashing it
+take, how big it is serialized, what running it with a typical solution
+costs in clvm and in wall time, how long conditions_for_solution takes on
+the spend and how long the wallet's signing takes.
+
+Nothing talks to a ledger. Results are written as JSON so they can be kept
+and compared between runs.
+
+Run with:
+
+    $ python -m benchmarks.benchmark_puzzles run [-n count] [-o results.json] [case ...]
+    $ python -m benchmarks.benchmark_puzzles compare old.json new.json [-t threshold]
+
+compare prints every metric that got worse, timings by more than threshold
+(a fraction, 0.1 by default) and sizes and costs by anything at all, and
+exits with status 1 if there are any.
+"""
+
+import argparse
+import hashlib
+import json
+import platform
+import sys
+import time
+from fractions import Fraction
+from os import urandom
+
+import clvm
+
+from chiasim.hashable import Program, ProgramHash
+from chiasim.utils.run_program import run_program
+from chiasim.validation.Conditions import make_create_coin_condition
+from chiasim.validation.consensus import conditions_for_solution
+
+from atomic_swaps.as_wallet import AS_TEMPLATE, ASWallet, as_puzzle_parameters
+from authorised_payees.ap_wallet import APWallet
+from authorised_payees.ap_wallet_a_functions import ap_make_puzzle
+from custody_wallet.custody_wallet import CPWallet
+from puzzles import (
+    p2_conditions, p2_delegated_conditions, p2_delegated_puzzle, p2_delegated_puzzle_or_hidden_puzzle,
+    p2_m_of_n_delegate_direct, p2_puzzle_hash,
+)
+from rate_limit.rl_wallet import RLWallet
+from recoverable_wallet.recoverable_wallet import ESCROW_TEMPLATES, PUZZLE_TEMPLATE, DurationType, make_solution
+from utilities.keys import HIERARCHICAL_PRIVATE_KEY, public_key_bytes_for_index
+from utilities.signing_pool import SIGN_CONDITIONS, SIGN_SOLUTION_HASH, signatures_for_spend
+
+
+# metrics compare treats as exact, the rest are timings
+EXACT_METRICS = ["puzzle_size", "solution_size", "cost", "signature_count"]
+TIMED_METRICS = ["construct_us", "hash_us", "run_us", "conditions_us", "sign_us"]
+
+
+class PuzzleCase:
+    """
+    make_puzzle builds the puzzle from scratch, the way a wallet does for a
+    new address. solution is a typical solution for it, and sign_mode is how
+    the wallet signs the spend, or None if nothing needs signing.
+    """
+
+    def __init__(self, name, make_puzzle, solution, sign_mode=None):
+        self.name = name
+        self.make_puzzle = make_puzzle
+        self.solution = Program.to(solution)
+        self.sign_mode = sign_mode
+
+
+def payment_conditions(count=2):
+    return [make_create_coin_condition(urandom(32), 1000 + _) for _ in range(count)]
+
+
+def delegated_solution(conditions):
+    return [p2_conditions.puzzle_for_conditions(conditions), []]
+
+
+def puzzle_cases():
+    pk = public_key_bytes_for_index(0)
+    other_pk = public_key_bytes_for_index(1)
+    conditions = payment_conditions()
+
+    yield PuzzleCase("p2_conditions", lambda: p2_conditions.puzzle_for_conditions(conditions), [])
+
+    yield PuzzleCase("p2_delegated_puzzle", lambda: p2_delegated_puzzle.puzzle_for_pk(pk),
+                     delegated_solution(conditions), SIGN_CONDITIONS)
+
+    yield PuzzleCase("p2_delegated_conditions", lambda: p2_delegated_conditions.puzzle_for_pk(pk),
+                     conditions, SIGN_CONDITIONS)
+
+    inner_puzzle = p2_delegated_puzzle.puzzle_for_pk(pk)
+    yield PuzzleCase("p2_puzzle_hash", lambda: p2_puzzle_hash.puzzle_for_puzzle_hash(ProgramHash(inner_puzzle)),
+                     [inner_puzzle, delegated_solution(conditions)], SIGN_CONDITIONS)
+
+    pks = [public_key_bytes_for_index(_) for _ in range(5)]
+    yield PuzzleCase("m_of_n", lambda: p2_m_of_n_delegate_direct.puzzle_for_m_of_public_key_list(3, pks),
+                     [[1, [], [], 1, 1], p2_conditions.puzzle_for_conditions(conditions), []], SIGN_CONDITIONS)
+
+    synthetic_pk = p2_delegated_puzzle_or_hidden_puzzle.calculate_synthetic_public_key(
+        pk, p2_delegated_puzzle_or_hidden_puzzle.DEFAULT_HIDDEN_PUZZLE)
+    yield PuzzleCase("hidden_puzzle",
+                     lambda: p2_delegated_puzzle_or_hidden_puzzle.puzzle_for_public_key_and_hidden_puzzle(pk),
+                     [[], p2_conditions.puzzle_for_conditions(conditions), []], SIGN_CONDITIONS)
+    yield PuzzleCase("hidden_puzzle_synthetic",
+                     lambda: p2_delegated_puzzle_or_hidden_puzzle.puzzle_for_synthetic_public_key(synthetic_pk),
+                     [[], p2_conditions.puzzle_for_conditions(conditions), []], SIGN_CONDITIONS)
+
+    my_primary_input, my_puzzle_hash = urandom(32), urandom(32)
+    outputs = [(urandom(32), 1000), (urandom(32), 2000)]
+    yield PuzzleCase("authorised_payee", lambda: ap_make_puzzle(pk, other_pk),
+                     APWallet().ap_make_solution_mode_1(outputs, my_primary_input, my_puzzle_hash),
+                     SIGN_SOLUTION_HASH)
+
+    secret = urandom(32)
+    secret_hash = "0x%s" % hashlib.sha256(secret).hexdigest()
+    swap_parameters = as_puzzle_parameters(pk, other_pk, 1000, 20, secret_hash)
+    yield PuzzleCase("atomic_swap", lambda: AS_TEMPLATE.puzzle(**swap_parameters),
+                     ASWallet().as_make_solution_receiver("0x%s" % secret.hex()), SIGN_CONDITIONS)
+
+    rl_wallet = RLWallet()
+    rl_wallet.interval, rl_wallet.limit = 5, 10
+    origin_id = urandom(32)
+    rl_solution = rl_wallet.solution_for_rl(origin_id.hex(), urandom(32).hex(), 5000, urandom(32).hex(), 100,
+                                            urandom(32).hex(), 5000)
+    yield PuzzleCase("rate_limit", lambda: rl_wallet.rl_puzzle_for_pk(pk, 10, 5, origin_id, other_pk),
+                     rl_solution, SIGN_SOLUTION_HASH)
+
+    cp_wallet = CPWallet()
+    yield PuzzleCase("custody", lambda: cp_wallet.cp_puzzle(pk, other_pk, 1577836800000),
+                     cp_wallet.solution_for_cp_solo(outputs), SIGN_SOLUTION_HASH)
+
+    stake_factor = Fraction(11, 10)
+    escrow_template = ESCROW_TEMPLATES[DurationType.BLOCKS]
+    yield PuzzleCase("recoverable", lambda: PUZZLE_TEMPLATE.puzzle(
+        pubkey=pk,
+        escrow_puzzlehash=escrow_template.puzzle_hash(recovery_pubkey=other_pk, pubkey=pk, duration=20),
+        stake_factor_numerator=stake_factor.numerator,
+        stake_factor_denominator=stake_factor.denominator,
+    ), make_solution(urandom(32), urandom(32), 1000, stake_factor,
+                     primaries=[dict(puzzlehash=_, amount=amount) for _, amount in outputs]), SIGN_CONDITIONS)
+
+    yield PuzzleCase("recoverable_escrow",
+                     lambda: escrow_template.puzzle(recovery_pubkey=other_pk, pubkey=pk, duration=20),
+                     [p2_conditions.puzzle_for_conditions(conditions), [], 0], SIGN_CONDITIONS)
+
+
+def measure(f, count):
+    """
+    Return f's result and its mean wall time in microseconds over count calls.
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        r = f()
+    return r, (time.perf_counter() - start) * 1e6 / count
+
+
+def profile_case(case, count, secretkey):
+    result = {}
+    puzzle, result["construct_us"] = measure(case.make_puzzle, count)
+    _, result["hash_us"] = measure(lambda: ProgramHash(puzzle), count)
+    result["puzzle_size"] = len(bytes(Program(puzzle)))
+    result["solution_size"] = len(bytes(case.solution))
+    try:
+        (cost, _), result["run_us"] = measure(lambda: run_program(puzzle, case.solution), count)
+        result["cost"] = cost
+        spend = clvm.to_sexp_f([puzzle, case.solution])
+        _, result["conditions_us"] = measure(lambda: conditions_for_solution(spend), count)
+        if case.sign_mode is not None:
+            signatures, result["sign_us"] = measure(
+                lambda: signatures_for_spend(secretkey, case.sign_mode, puzzle, case.solution), count)
+            result["signature_count"] = len(signatures)
+    except Exception as ex:
+        result["error"] = "%s: %s" % (type(ex).__name__, ex)
+    return result
+
+
+def run(count=100, names=None):
+    secretkey = HIERARCHICAL_PRIVATE_KEY.private_child(0)
+    results = {}
+    for case in puzzle_cases():
+        if names and case.name not in names:
+            continue
+        case.make_puzzle()  # compile templates and load clvm outside the timings
+        results[case.name] = profile_case(case, count, secretkey)
+    return dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        time=time.time(),
+        count=count,
+        results=results,
+    )
+
+
+def compare(old, new, threshold=0.1):
+    """
+    Return a list of (case, metric, old_value, new_value) for every metric
+    that got worse from the old run to the new.
+    """
+    regressions = []
+    for name, new_result in sorted(new["results"].items()):
+        old_result = old["results"].get(name)
+        if old_result is None:
+            continue
+        if "error" in new_result and "error" not in old_result:
+            regressions.append((name, "error", None, new_result["error"]))
+        for metric in EXACT_METRICS + TIMED_METRICS:
+            if metric not in old_result or metric not in new_result:
+                continue
+            limit = old_result[metric] * (1 + threshold) if metric in TIMED_METRICS else old_result[metric]
+            if new_result[metric] > limit:
+                regressions.append((name, metric, old_result[metric], new_result[metric]))
+    return regressions
+
+
+def print_results(report):
+    columns = ["construct_us", "hash_us", "puzzle_size", "cost", "run_us", "conditions_us", "sign_us"]
+    print(f"{'':24}" + "".join(f"{_:>14}" for _ in columns))
+    for name, result in report["results"].items():
+        cells = []
+        for column in columns:
+            value = result.get(column)
+            cells.append(f"{'-':>14}" if value is None else f"{value:14.1f}" if isinstance(value, float)
+                         else f"{value:14}")
+        print(f"{name:24}" + "".join(cells))
+        if "error" in result:
+            print(f"{'':24}{result['error']}")
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Profile the puzzles and compare profiles.")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="profile the puzzles")
+    run_parser.add_argument("-n", "--count", type=int, default=100, help="iterations per timing")
+    run_parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    run_parser.add_argument("cases", nargs="*", help="only profile these cases")
+    compare_parser = subparsers.add_parser("compare", help="list regressions between two runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("-t", "--threshold", type=float, default=0.1,
+                                help="how much slower a timing may get, as a fraction")
+    args = parser.parse_args(args)
+
+    if args.command == "compare":
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        for name, metric, old_value, new_value in regressions:
+            print(f"{name:24} {metric:16} {old_value} -> {new_value}")
+        return 1 if regressions else 0
+
+    report = run(args.count if args.command == "run" else 100, args.cases if args.command == "run" else None)
+    print_results(report)
+    if args.command == "run" and args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Compare building puzzles and puzzle hashes from source strings with
+building them from pre-compiled puzzle templates.
+
+Run with:
+
+    $ python -m benchmarks.benchmark_templates [count]
+"""
+
+import sys
+import time
+from os import urandom
+
+from chiasim.hashable import ProgramHash
+
+from atomic_swaps.as_wallet import AS_TEMPLATE, as_puzzle_parameters
+from authorised_payees.ap_wallet_a_functions import AP_TEMPLATE
+from custody_wallet.custody_wallet import CPWallet
+from puzzles import p2_delegated_puzzle, p2_m_of_n_delegate_direct, p2_puzzle_hash
+from rate_limit.rl_wallet import RLWallet
+from recoverable_wallet.recoverable_wallet import PUZZLE_TEMPLATE as RECOVERABLE_TEMPLATE
+
+
+def template_cases():
+    """
+    Yield (name, template, make_values) for each templated puzzle.
+    """
+    yield "p2_delegated_puzzle", p2_delegated_puzzle.TEMPLATE, lambda: dict(public_key=urandom(48))
+    yield "p2_puzzle_hash", p2_puzzle_hash.TEMPLATE, lambda: dict(puzzle_hash=urandom(32))
+    yield "authorised payee", AP_TEMPLATE, lambda: dict(a_pubkey=urandom(48), b_pubkey=urandom(48))
+    yield "custody", CPWallet().cp_puzzle_template(), lambda: dict(
+        pubkey_my=urandom(48), pubkey_permission=urandom(48), unlock_time=1577836800000)
+    yield "rate limit", RLWallet().rl_puzzle_template(), lambda: dict(
+        pubkey=urandom(48), rate_amount=10, interval_time=5, origin_id=urandom(32), clawback_pk=urandom(48))
+    yield "m of n", p2_m_of_n_delegate_direct.TEMPLATE, lambda: dict(
+        m=3, public_key_list=[urandom(48) for _ in range(5)])
+    yield "recoverable", RECOVERABLE_TEMPLATE, lambda: dict(
+        pubkey=urandom(48), escrow_puzzlehash=urandom(32), stake_factor_numerator=11, stake_factor_denominator=10)
+    yield "atomic swap", AS_TEMPLATE, lambda: as_puzzle_parameters(
+        urandom(48), urandom(48), 1000, 20, "0x%s" % urandom(32).hex())
+
+
+def measure(f, values):
+    start = time.time()
+    for _ in values:
+        f(_)
+    return (time.time() - start) / len(values)
+
+
+def main(count=1000):
+    for name, template, make_values in template_cases():
+        values = [make_values() for _ in range(count)]
+        template.puzzle_hash(**values[0])  # compile outside the timings
+        timings = [
+            ("assemble + hash", lambda _: ProgramHash(template.assemble(**_))),
+            ("template puzzle", lambda _: template.puzzle(**_)),
+            ("template hash", lambda _: template.puzzle_hash(**_)),
+        ]
+        baseline = None
+        for label, f in timings:
+            elapsed = measure(f, values)
+            baseline = baseline or elapsed
+            print(f"{name:20} {label:16} {elapsed * 1e6:10.1f}us {baseline / elapsed:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(*[int(_) for _ in sys.argv[1:]])
@@ -1,5 +1,7 @@
 from chiasim.atoms import hexbytes
 from standard_wallet.wallet import *
+from standard_wallet.seen_coins import SeenCoins
+from utilities.signing_pool import SIGN_SOLUTION_HASH
 import clvm
 from chiasim.hashable import Program, ProgramHash, CoinSolution, SpendBundle, BLSSignature
 from binascii import hexlify
@@ -7,13 +9,16 @@ from chiasim.hashable.CoinSolution import CoinSolutionList
 from clvm_tools import binutils
 from chiasim.wallet.BLSPrivateKey import BLSPrivateKey
 from chiasim.validation.Conditions import ConditionOpcode
+from puzzles.puzzle_template import PuzzleTemplate
 
 # CPWallet is subclass of Wallet
 class CPWallet(Wallet):
+    cp_template = None
+
     def __init__(self):
         self.pubkey_orig = None
-        self.all_cp_additions = {}
-        self.all_cp_deletions = {}
+        self.seen_cp_additions = SeenCoins()
+        self.seen_cp_deletions = SeenCoins()
         self.pubkey_permission = None
         self.pubkey_approval = None
         self.unlock_time = 0
@@ -23,30 +28,41 @@ class CPWallet(Wallet):
         super().__init__()
         return
 
+    def clear_coins(self):
+        super().clear_coins()
+        self.seen_cp_additions = SeenCoins()
+        self.seen_cp_deletions = SeenCoins()
+        self.cp_balance = 0
+        self.cp_coin = None
+
     def notify(self, additions, deletions, index):
-        super().notify(additions, deletions)
+        super().notify(additions, deletions, index)
         self.cp_notify(additions, deletions, index)
 
     def cp_notify(self, additions, deletions, index):
         for coin in additions:
-            if coin.name() in self.all_cp_additions:
+            if coin.name() in self.seen_cp_additions:
+                continue
+            mine = self.can_generate_cp_puzzle_hash(coin.puzzle_hash)
+            if not self.seen_cp_additions.add(coin.name(), index, keep=mine):
                 continue
-            self.all_cp_additions[coin.name()] = coin
-            if self.can_generate_cp_puzzle_hash(coin.puzzle_hash):
+            if mine:
                 self.cp_balance += coin.amount
                 self.cp_coin = coin
         for coin in deletions:
-            if coin.name() in self.all_cp_deletions:
+            if coin.name() in self.seen_cp_deletions:
+                continue
+            mine = self.can_generate_cp_puzzle_hash(coin.puzzle_hash)
+            if not self.seen_cp_deletions.add(coin.name(), index, keep=mine):
                 continue
-            self.all_cp_deletions[coin.name()] = coin
-            if self.can_generate_cp_puzzle_hash(coin.puzzle_hash):
+            if mine:
                 self.cp_balance -= coin.amount
 
     def can_generate_cp_puzzle_hash(self, hash):
         if self.pubkey_permission is None:
             return None
-        return any(map(lambda child: hash == ProgramHash(self.cp_puzzle(
-            hexbytes(self.extended_secret_key.public_child(child)), self.pubkey_permission, self.unlock_time)),
+        return any(map(lambda child: hash == self.cp_puzzle_hash(
+            hexbytes(self.extended_secret_key.public_child(child)), self.pubkey_permission, self.unlock_time),
                        reversed(range(self.next_address))))
 
     def merge_two_lists(self, list1=None, list2=None):
@@ -55,20 +71,33 @@ class CPWallet(Wallet):
         ret = f"((c (q ((c (f (a)) (a)))) (c (q ((c (i ((c (i (f (r (a))) (q (q ())) (q (q 1))) (a))) (q (f (c (f (r (r (a)))) (q ())))) (q ((c (f (a)) (c (f (a)) (c (r (f (r (a)))) (c (c (f (f (r (a)))) (f (r (r (a))))) (q ())))))))) (a)))) (c {list1} (c {list2} (q ()))))))"
         return ret
 
-    def cp_puzzle(self, pubkey_my, pubkey_permission, unlock_time):
+    def cp_puzzle_source(self):
         opcode_aggsig = hexlify(ConditionOpcode.AGG_SIG).decode('ascii')
         opcode_time_exceeds = hexlify(ConditionOpcode.ASSERT_TIME_EXCEEDS).decode('ascii')
 
-        TIME_EXCEEDS = f"(c (q 0x{opcode_time_exceeds}) (c (q {unlock_time}) (q ())))"
-        AGGSIG_ME = f"(c (q 0x{opcode_aggsig}) (c (q 0x{pubkey_my}) (c (sha256tree (a)) (q ()))))"
-        AGGSIG_PERMISSION = f"(c (q 0x{opcode_aggsig}) (c (q 0x{pubkey_permission}) (c (sha256tree (a)) (q ()))))"
+        TIME_EXCEEDS = f"(c (q 0x{opcode_time_exceeds}) (c (q {{unlock_time}}) (q ())))"
+        AGGSIG_ME = f"(c (q 0x{opcode_aggsig}) (c (q {{pubkey_my}}) (c (sha256tree (a)) (q ()))))"
+        AGGSIG_PERMISSION = f"(c (q 0x{opcode_aggsig}) (c (q {{pubkey_permission}}) (c (sha256tree (a)) (q ()))))"
         SOLO_PUZZLE_CONDITIONS = f"(c {TIME_EXCEEDS} (c {AGGSIG_ME} (q ())))"
         SOLUTION_OUTPUTS = f"(f (r (a)))"
         SOLO_PUZZLE = self.merge_two_lists(SOLO_PUZZLE_CONDITIONS, SOLUTION_OUTPUTS)
         PERMISSION_PUZZLE_CONDITIONS = f"(c {AGGSIG_PERMISSION} (c {AGGSIG_ME} (q ())))"
         PERMISSION_PUZZLE = self.merge_two_lists(PERMISSION_PUZZLE_CONDITIONS, SOLUTION_OUTPUTS)
         WHOLE_PUZZLE = f"(i (= (f (a)) (q 1)) {SOLO_PUZZLE} {PERMISSION_PUZZLE})"
-        return Program(binutils.assemble(WHOLE_PUZZLE))
+        return WHOLE_PUZZLE
+
+    def cp_puzzle_template(self):
+        if CPWallet.cp_template is None:
+            CPWallet.cp_template = PuzzleTemplate(self.cp_puzzle_source())
+        return CPWallet.cp_template
+
+    def cp_puzzle(self, pubkey_my, pubkey_permission, unlock_time):
+        return self.cp_puzzle_template().puzzle(
+            pubkey_my=pubkey_my, pubkey_permission=pubkey_permission, unlock_time=unlock_time)
+
+    def cp_puzzle_hash(self, pubkey_my, pubkey_permission, unlock_time):
+        return self.cp_puzzle_template().puzzle_hash(
+            pubkey_my=pubkey_my, pubkey_permission=pubkey_permission, unlock_time=unlock_time)
 
     def solution_for_cp_solo(self, puzzlehash_amount_list=[]):
         opcode_create = hexlify(ConditionOpcode.CREATE_COIN).decode('ascii')
@@ -92,8 +121,7 @@ class CPWallet(Wallet):
             return s
         for child in reversed(range(self.next_address)):
             pubkey = self.extended_secret_key.public_child(child)
-            if hash == ProgramHash(
-                    self.cp_puzzle(hexbytes(pubkey), self.pubkey_permission, self.unlock_time)):
+            if hash == self.cp_puzzle_hash(hexbytes(pubkey), self.pubkey_permission, self.unlock_time):
                 return pubkey, self.extended_secret_key.private_child(child)
 
     def get_keys_pk(self, approval_pubkey):
@@ -143,13 +171,12 @@ class CPWallet(Wallet):
         return signature
 
     def cp_sign_transaction(self, spends: (Program, [CoinSolution]), approval=None):
-        sigs = []
+        jobs = []
         for puzzle, solution in spends:
             pubkey, secretkey = self.get_keys(
                 solution.coin.puzzle_hash)
-            signature = secretkey.sign(
-                ProgramHash(Program(solution.solution)))
-            sigs.append(signature)
+            jobs.append((SIGN_SOLUTION_HASH, puzzle, solution.solution, self.child_for_pubkey(pubkey)))
+        sigs = self.signing_pool.sign(jobs)
         if approval is not None:
             app = BLSSignature(approval)
             sigs.append(app)
@@ -1,13 +1,12 @@
 import asyncio
 from custody_wallet.custody_wallet import CPWallet
 from chiasim.clients.ledger_sim import connect_to_ledger_sim
-from chiasim.wallet.deltas import additions_for_body, removals_for_body
-from chiasim.hashable import Coin
-from chiasim.hashable.Body import BodyList
 from utilities.decorations import print_leaf, divider, prompt
 from chiasim.hashable import ProgramHash
 from binascii import hexlify
 from chiasim.atoms import hexbytes, uint64
+from utilities.block_sync import BlockSync
+from utilities.preimage_cache import CachedLedgerAPI, PreimageCache
 
 
 def get_int(message):
@@ -45,7 +44,7 @@ async def approve_transaction(wallet):
     print(f"Authorizing pubkey: {wallet.pubkey_approval}")
     print("Enter new that need's a approval:")
     newpubkey = input("Enter pubkey for new custody: ")
-    puzzlehash = ProgramHash(wallet.cp_puzzle(newpubkey, wallet.pubkey_approval, wallet.unlock_time))
+    puzzlehash = wallet.cp_puzzle_hash(newpubkey, wallet.pubkey_approval, wallet.unlock_time)
     amount = get_int("Enter amount: ")
     output = puzzlehash, amount
     outputs = [output]
@@ -75,7 +74,7 @@ async def create_custody(wallet, ledger_api):
         amount = get_int("Enter Chia amount to send to custody: ")
         wallet.unlock_time = unlock_time
 
-        puzzle_hash = ProgramHash(wallet.cp_puzzle(pubkey_custody, pubkey, unlock_time))
+        puzzle_hash = wallet.cp_puzzle_hash(pubkey_custody, pubkey, unlock_time)
         spend_bundle = wallet.generate_signed_transaction(amount, puzzle_hash)
         _ = await ledger_api.push_tx(tx=spend_bundle)
         return
@@ -94,7 +93,7 @@ async def move_custody(wallet, ledger_api):
     if unlock_time > current_time:
         new_pub = input("Enter pubkey of the new custodian wallet: ")
         print("Permission needed before moving funds: ")
-        puzzle_hash = ProgramHash(wallet.cp_puzzle(new_pub, pubkey_permission, unlock_time))
+        puzzle_hash = wallet.cp_puzzle_hash(new_pub, pubkey_permission, unlock_time)
         approval = input("\nAdd authorization: ")
         approval = bytes.fromhex(approval)
         spend_bundle = wallet.cp_generate_signed_transaction_with_approval(puzzle_hash, amount, approval)
@@ -109,46 +108,30 @@ async def move_custody(wallet, ledger_api):
         _ = await ledger_api.push_tx(tx=spend_bundle)
 
 
-async def update_ledger(wallet, ledger_api, most_recent_header):
-    if most_recent_header is None:
-        r = await ledger_api.get_all_blocks()
-    else:
-        r = await ledger_api.get_recent_blocks(most_recent_header=most_recent_header)
-    update_list = BodyList.from_bytes(r)
-    tip = await ledger_api.get_tip()
-    index = int(tip["tip_index"])
-    for body in update_list:
-        additions = list(additions_for_body(body))
-        removals = removals_for_body(body)
-        removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
+async def update_ledger(wallet, block_sync):
+    ledger_api = block_sync.ledger_api()
+    async for index, header, additions, removals in block_sync.new_blocks():
         spend_bundle_list = wallet.notify(additions, removals, index)
         if spend_bundle_list is not None:
             for spend_bundle in spend_bundle_list:
                 _ = await ledger_api.push_tx(tx=spend_bundle)
-
-    return most_recent_header
+    return block_sync.checkpoint()
 
 
-async def new_block(wallet, ledger_api):
+async def new_block(wallet, block_sync):
     coinbase_puzzle_hash = wallet.get_new_puzzlehash()
     fees_puzzle_hash = wallet.get_new_puzzlehash()
-    r = await ledger_api.next_block(coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
-    body = r["body"]
-    tip = await  ledger_api.get_tip()
-    index = tip["tip_index"]
-    most_recent_header = r['header']
-    additions = list(additions_for_body(body))
-    removals = removals_for_body(body)
-    removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
-    wallet.notify(additions, removals, index)
-    return most_recent_header
+    r = await block_sync.ledger_api().next_block(
+        coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
+    block_sync.add_block(r['header'], r['body'])
+    return await update_ledger(wallet, block_sync)
 
 
 async def main_loop():
-    ledger_api = await connect_to_ledger_sim("localhost", 9868)
+    ledger_api = CachedLedgerAPI(await connect_to_ledger_sim("localhost", 9868), PreimageCache())
     selection = ""
     wallet = CPWallet()
-    most_recent_header = None
+    block_sync = BlockSync(ledger_api, on_reorg=wallet.clear_coins)
     print_leaf()
     print()
     print("Welcome to your Chia Custody Wallet.")
@@ -184,9 +167,9 @@ async def main_loop():
         elif selection == "2":
             view_funds(wallet)
         elif selection == "3":
-            most_recent_header = await update_ledger(wallet, ledger_api, most_recent_header)
+            await update_ledger(wallet, block_sync)
         elif selection == "4":
-            most_recent_header = await new_block(wallet, ledger_api)
+            await new_block(wallet, block_sync)
         elif selection == "5":
             await create_custody(wallet, ledger_api)
         elif selection == "6":
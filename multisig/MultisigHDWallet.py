@@ -1,7 +1,36 @@
-from chiasim.hashable import ProgramHash
+import bisect
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
 from .address import address_for_puzzle_hash, puzzle_hash_for_address
 
-from puzzles.p2_m_of_n_delegate_direct import puzzle_for_m_of_public_key_list
+from puzzles.p2_m_of_n_delegate_direct import puzzle_hash_for_m_of_public_key_list
+from utilities.BLSHDKey import BLSPublicHDKey
+
+
+SERIAL_THRESHOLD = 16
+
+# how many indexes a search for a puzzle hash derives at a time
+SEARCH_BATCH_SIZE = 1000
+
+# the smallest number of unused addresses to look ahead of the highest used
+# one; the wallet looks further if it ever sees a larger gap between used ones
+GAP_LIMIT = 100
+
+
+# state of a worker process in the pool
+_worker_wallet = None
+
+
+def _init_worker(m, pub_hd_key_blobs):
+    global _worker_wallet
+    _worker_wallet = MultisigHDWallet(m, [BLSPublicHDKey.from_bytes(_) for _ in pub_hd_key_blobs])
+
+
+def _puzzle_hash_for_index(index):
+    return bytes(_worker_wallet.puzzle_hash_for_index(index))
 
 
 class MultisigHDWallet:
@@ -10,11 +39,21 @@ class MultisigHDWallet:
     wallet.
     """
 
-    def __init__(self, m, pub_hd_keys):
+    def __init__(self, m, pub_hd_keys, gap_limit=GAP_LIMIT):
         self._m = m
         self._pub_hd_keys = pub_hd_keys
         self._ph_to_index_cache = {}
         self._index_to_ph_cache = {}
+        self._index_to_pub_keys_cache = {}
+        self._store = None
+        self._unsaved = []
+        self._gap_limit = gap_limit
+        self._used_indexes = []
+        self._largest_gap = 0
+        self._unsaved_used_indexes = []
+        self._executor = None
+        self._executor_pool_size = None
+        self._executor_lock = threading.Lock()
 
     def m(self):
         return self._m
@@ -26,10 +65,12 @@ class MultisigHDWallet:
         """
         Return N public keys corresponding to the given index.
         """
-        pub_keys = []
-        for pub_hd_key in self._pub_hd_keys:
-            pub_keys.append(pub_hd_key.public_child(index))
-        return pub_keys
+        if index not in self._index_to_pub_keys_cache:
+            pub_keys = []
+            for pub_hd_key in self._pub_hd_keys:
+                pub_keys.append(pub_hd_key.public_child(index))
+            self._index_to_pub_keys_cache[index] = pub_keys
+        return list(self._index_to_pub_keys_cache[index])
 
     def puzzle_hash_for_index(self, index) -> bytes:
         """
@@ -37,11 +78,134 @@ class MultisigHDWallet:
         """
         if index not in self._index_to_ph_cache:
             pub_keys = self.pub_keys_for_index(index)
-            puzzle = puzzle_for_m_of_public_key_list(self._m, pub_keys)
-            puzzle_hash = ProgramHash(puzzle)
+            puzzle_hash = puzzle_hash_for_m_of_public_key_list(self._m, pub_keys)
+            self._add_puzzle_hashes([(index, puzzle_hash)])
+        return self._index_to_ph_cache[index]
+
+    def _add_puzzle_hashes(self, index_puzzle_hash_pairs, unsaved=True):
+        for index, puzzle_hash in index_puzzle_hash_pairs:
             self._index_to_ph_cache[index] = puzzle_hash
             self._ph_to_index_cache[puzzle_hash] = index
-        return self._index_to_ph_cache[index]
+        if unsaved and self._store is not None:
+            self._unsaved.extend(index_puzzle_hash_pairs)
+
+    def add_puzzle_hashes(self, index_puzzle_hash_pairs):
+        """
+        Record the (index, puzzle_hash) pairs compute_puzzle_hashes returned.
+        """
+        self._add_puzzle_hashes(index_puzzle_hash_pairs)
+
+    def missing_indexes(self, indexes):
+        """
+        Return the list of indexes whose puzzle hashes aren't known yet.
+        """
+        return [_ for _ in indexes if _ not in self._index_to_ph_cache]
+
+    def _get_executor(self, pool_size):
+        with self._executor_lock:
+            if self._executor is None:
+                pub_hd_key_blobs = [bytes(_) for _ in self._pub_hd_keys]
+                self._executor = ProcessPoolExecutor(max_workers=pool_size, initializer=_init_worker,
+                                                     initargs=(self._m, pub_hd_key_blobs))
+                self._executor_pool_size = pool_size
+            return self._executor
+
+    def compute_puzzle_hashes(self, indexes, pool_size=None, serial_threshold=SERIAL_THRESHOLD):
+        """
+        Return the list of puzzle hashes for indexes without recording them,
+        so it may run on another thread while the wallet is in use.
+
+        Batches of at least serial_threshold indexes are spread over
+        pool_size worker processes (None means one per cpu). The pool is
+        started by the first such batch and kept until close().
+        """
+        indexes = list(indexes)
+        if pool_size is None:
+            pool_size = os.cpu_count() or 1
+        if pool_size < 2 or len(indexes) < serial_threshold:
+            return [puzzle_hash_for_m_of_public_key_list(self._m, [_.public_child(index) for _ in self._pub_hd_keys])
+                    for index in indexes]
+        executor = self._get_executor(pool_size)
+        chunksize = max(1, len(indexes) // (self._executor_pool_size * 4))
+        return list(executor.map(_puzzle_hash_for_index, indexes, chunksize=chunksize))
+
+    def derive_puzzle_hashes(self, indexes, pool_size=None, serial_threshold=SERIAL_THRESHOLD):
+        """
+        Derive and record the puzzle hashes for whichever of indexes aren't
+        known yet, as compute_puzzle_hashes does. Return the list of
+        (index, puzzle_hash) derived.
+        """
+        missing = self.missing_indexes(indexes)
+        pairs = list(zip(missing, self.compute_puzzle_hashes(missing, pool_size, serial_threshold)))
+        self._add_puzzle_hashes(pairs)
+        return pairs
+
+    def close(self):
+        """
+        Shut down the pool of worker processes, if one was started.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def note_used_indexes(self, indexes):
+        """
+        Record that indexes have been used, by handing out their addresses
+        or by seeing coins for them. Return True if that moves the lookahead.
+        """
+        lookahead_count = self.lookahead_count()
+        for index in indexes:
+            position = bisect.bisect_left(self._used_indexes, index)
+            if position < len(self._used_indexes) and self._used_indexes[position] == index:
+                continue
+            previous = self._used_indexes[position - 1] if position > 0 else -1
+            self._largest_gap = max(self._largest_gap, index - previous - 1)
+            self._used_indexes.insert(position, index)
+            if self._store is not None:
+                self._unsaved_used_indexes.append(index)
+        return self.lookahead_count() != lookahead_count
+
+    def note_used_puzzle_hashes(self, puzzle_hashes):
+        """
+        Like note_used_indexes, for the puzzle hashes of indexes already derived.
+        """
+        return self.note_used_indexes(
+            self._ph_to_index_cache[_] for _ in puzzle_hashes if _ in self._ph_to_index_cache)
+
+    def highest_used_index(self):
+        return self._used_indexes[-1] if self._used_indexes else None
+
+    def gap_limit(self):
+        """
+        Return how many unused addresses to look ahead: at least the gap
+        limit the wallet was made with, or the largest gap seen.
+        """
+        return max(self._gap_limit, self._largest_gap)
+
+    def lookahead_count(self):
+        """
+        Return how many indexes, starting at 0, to watch for coins.
+        """
+        highest_used_index = self.highest_used_index()
+        used_count = 0 if highest_used_index is None else highest_used_index + 1
+        return used_count + self.gap_limit()
+
+    def set_puzzle_hash_store(self, store):
+        """
+        Load the puzzle hashes and used indexes kept in store, and keep the
+        ones found from now on there when save_puzzle_hashes is called.
+        """
+        self._store = store
+        pairs, used_indexes = store.load(self)
+        self._add_puzzle_hashes(pairs, unsaved=False)
+        self.note_used_indexes(used_indexes)
+        self._unsaved_used_indexes = []
+
+    def save_puzzle_hashes(self):
+        if self._store is not None and (self._unsaved or self._unsaved_used_indexes):
+            unsaved, self._unsaved = self._unsaved, []
+            unsaved_used_indexes, self._unsaved_used_indexes = self._unsaved_used_indexes, []
+            self._store.save(self, unsaved, unsaved_used_indexes)
 
     def address_for_index(self, index):
         """
@@ -49,29 +213,33 @@ class MultisigHDWallet:
         """
         return address_for_puzzle_hash(self.puzzle_hash_for_index(index))
 
-    def _index_for_puzzle_hash(self, puzzle_hash, search_limit) -> bytes:
+    def _index_for_puzzle_hash(self, puzzle_hash, search_limit):
         """
-        Search for the index corresponding to the given puzzle hash.
+        Derive indexes up to search_limit a batch at a time, on the pool
+        for big batches, until puzzle_hash turns up.
         """
-        index = 0
-        while index <= search_limit:
-            if self.puzzle_hash_for_index(index) == puzzle_hash:
-                return index
-            index += 1
+        for start in range(0, search_limit + 1, SEARCH_BATCH_SIZE):
+            self.derive_puzzle_hashes(range(start, min(search_limit + 1, start + SEARCH_BATCH_SIZE)))
+            if puzzle_hash in self._ph_to_index_cache:
+                break
 
-    def index_for_puzzle_hash(self, puzzle_hash, search_limit) -> bytes:
+    def index_for_puzzle_hash(self, puzzle_hash, search_limit=None):
         """
         Search for the index corresponding to the given puzzle hash
-        (using the cache for previously calculated subkeys).
+        (using the cache for previously calculated subkeys). The search
+        goes as far as the lookahead unless search_limit is given. Return
+        None if it isn't found.
         """
         if puzzle_hash not in self._ph_to_index_cache:
+            if search_limit is None:
+                search_limit = self.lookahead_count()
             self._index_for_puzzle_hash(puzzle_hash, search_limit)
-        return self._ph_to_index_cache[puzzle_hash]
+        return self._ph_to_index_cache.get(puzzle_hash)
 
-    def index_for_address(self, address, search_limit):
+    def index_for_address(self, address, search_limit=None):
         """
         Search for the index corresponding to the given address
-        (using the cache for previously calculated subkeys).
+        (using the cache for previously calculated subkeys), or None.
         """
         puzzle_hash = puzzle_hash_for_address(address)
         return self.index_for_puzzle_hash(puzzle_hash, search_limit)
@@ -0,0 +1,191 @@
+"""
+PST combiner
+
+Combine the outputs of many signers for a batch of PSTs at once. Signer
+outputs are lists of signatures, like generate_signature_pairs returns, or
+files with what the signer printed. Duplicate signatures are dropped, the
+rest are matched to the aggsig pairs of all the PSTs by lookup and
+verified, spread over a process pool for big batches, and each PST is
+finalized once with its verified signatures. A SignatureVerifier keeps its
+pool and remembers what it verified, so combining again as more signer
+outputs arrive only verifies the new signatures.
+
+Bare signatures, with no aggsig pair, are tried once the paired ones are
+verified, only against the missing aggsig pairs of coins still short of M
+signatures.
+
+Run with:
+
+    $ python -m multisig.combiner multisig-wallet.json pst_file [pst_file ...] -s signer_output [-s ...]
+
+where each pst file holds the hex the wallet printed.
+"""
+
+import argparse
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from chiasim.hashable import BLSSignature
+
+from .pst import PartiallySignedTransaction
+from .wallet import load_wallet, signatures_from_file, spend_bundle_for_sig_dict
+
+
+SERIAL_THRESHOLD = 16
+
+
+def _verify_serialized_job(job):
+    aggsig_pair_blob, sig_blob = job
+    aggsig_pair = BLSSignature.aggsig_pair.from_bytes(aggsig_pair_blob)
+    return BLSSignature.from_bytes(sig_blob).validate([aggsig_pair])
+
+
+class SignatureVerifier:
+    """
+    Verify (aggsig_pair, signature) jobs, each only once.
+
+    pool_size is the number of worker processes (None means one per cpu,
+    0 means always verify in process). Batches smaller than
+    serial_threshold are always verified in process.
+    """
+
+    def __init__(self, pool_size=None, serial_threshold=SERIAL_THRESHOLD):
+        if pool_size is None:
+            pool_size = os.cpu_count() or 1
+        self._pool_size = pool_size
+        self._serial_threshold = serial_threshold
+        self._executor = None
+        self._verified = {}  # {(aggsig_pair, signature): is_valid}
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._pool_size)
+        return self._executor
+
+    def _verify_new(self, jobs):
+        if self._pool_size < 2 or len(jobs) < self._serial_threshold:
+            return [sig.validate([aggsig_pair]) for aggsig_pair, sig in jobs]
+        serialized_jobs = [(bytes(aggsig_pair), bytes(sig)) for aggsig_pair, sig in jobs]
+        chunksize = max(1, len(serialized_jobs) // (self._pool_size * 4))
+        return list(self._get_executor().map(_verify_serialized_job, serialized_jobs, chunksize=chunksize))
+
+    def verify(self, jobs):
+        """
+        Return a list with whether each (aggsig_pair, signature) in jobs is
+        valid, only verifying the jobs this verifier hasn't seen.
+        """
+        jobs = list(jobs)
+        new_jobs = list(dict.fromkeys(_ for _ in jobs if _ not in self._verified))
+        self._verified.update(zip(new_jobs, self._verify_new(new_jobs)))
+        return [self._verified[_] for _ in jobs]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def verify_signatures(jobs, pool_size=None, serial_threshold=SERIAL_THRESHOLD):
+    """
+    Return a list with whether each (aggsig_pair, signature) in jobs is
+    valid. Batches of at least serial_threshold jobs are spread over
+    pool_size worker processes (None means one per cpu).
+    """
+    verifier = SignatureVerifier(pool_size, serial_threshold)
+    try:
+        return verifier.verify(jobs)
+    finally:
+        verifier.close()
+
+
+def signatures_for_outputs(signer_outputs):
+    """
+    Return the set of signatures in signer_outputs, each either a list of
+    signatures or the path of a file a signer's output was saved to.
+    """
+    sigs = set()
+    for output in signer_outputs:
+        if isinstance(output, (str, Path)):
+            output = signatures_from_file(output)
+        sigs.update(output)
+    return sigs
+
+
+def combine(wallet, psts, signer_outputs, pool_size=None, serial_threshold=SERIAL_THRESHOLD, verifier=None):
+    """
+    Return a list with a pair (SpendBundle or None, summary_list), as
+    finalize_pst returns, for each of psts, using the signatures in
+    signer_outputs. Pass a SignatureVerifier to keep its pool and what it
+    verified across calls; otherwise one is made for this call.
+    """
+    if verifier is None:
+        verifier = SignatureVerifier(pool_size, serial_threshold)
+        try:
+            return combine(wallet, psts, signer_outputs, verifier=verifier)
+        finally:
+            verifier.close()
+
+    all_aggsigs = set()
+    hkp_lists = []
+    for pst in psts:
+        for hkp_list in pst.hash_key_pairs():
+            all_aggsigs.update(hkp_list)
+            hkp_lists.append(hkp_list)
+
+    paired_jobs = []
+    bare_sigs = []
+    for sig in signatures_for_outputs(signer_outputs):
+        if isinstance(sig, tuple):
+            if sig[0] in all_aggsigs:
+                paired_jobs.append(sig)
+        else:
+            bare_sigs.append(sig)
+
+    sig_dict = {}
+    for (aggsig_pair, sig), is_valid in zip(paired_jobs, verifier.verify(paired_jobs)):
+        if is_valid:
+            sig_dict[aggsig_pair] = sig
+
+    if bare_sigs:
+        m = wallet.m()
+        missing = set()
+        for hkp_list in hkp_lists:
+            if sum(1 for _ in hkp_list if _ in sig_dict) < m:
+                missing.update(_ for _ in hkp_list if _ not in sig_dict)
+        bare_jobs = [(aggsig_pair, sig) for sig in bare_sigs for aggsig_pair in missing]
+        for (aggsig_pair, sig), is_valid in zip(bare_jobs, verifier.verify(bare_jobs)):
+            if is_valid:
+                sig_dict.setdefault(aggsig_pair, sig)
+
+    return [spend_bundle_for_sig_dict(wallet, pst, sig_dict) for pst in psts]
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Combine signer outputs and finalize PSTs.")
+    parser.add_argument("wallet", type=Path, help="the multisig wallet json")
+    parser.add_argument("psts", nargs="+", help="files with the hex of a PST")
+    parser.add_argument("-s", "--signatures", action="append", default=[], help="a file of signer output")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes verifying signatures")
+    args = parser.parse_args(args)
+
+    wallet = load_wallet(args.wallet)
+    psts = []
+    for path in args.psts:
+        with open(path) as f:
+            psts.append(PartiallySignedTransaction.from_bytes(bytes.fromhex(f.read().strip())))
+    unfinished = 0
+    for path, (spend_bundle, summary_list) in zip(args.psts, combine(wallet, psts, args.signatures, args.jobs)):
+        if spend_bundle is None:
+            unfinished += 1
+            for coin, hkp_list, sigs_to_use, m in summary_list:
+                print("%s: coin %s has %d of %d sigs" % (path, coin.name(), len(sigs_to_use), m))
+        else:
+            print("%s: spend bundle = %s" % (path, bytes(spend_bundle).hex()))
+    return 1 if unfinished else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
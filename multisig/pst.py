@@ -1,7 +1,42 @@
+"""
+Partially signed transactions
+
+A PST is an unfinalized SpendBundle as a dict, passed between the wallet
+and the signers as bytes, either cbor, which bytes(pst) returns, or a
+compact encoding, which to_bytes() returns. The compact encoding is
+
+    MAGIC, a version byte and a flags byte, then the payload, compressed
+    with zlib if the FLAG_ZLIB bit is set, which is three sections each
+    prefixed with its uint32 length (all big-endian):
+
+    the cbor encoding of everything but the coin solutions
+
+    the blob table, a uint32 count of blobs and then each blob prefixed
+    with its uint32 length
+
+    the coin solutions, a uint32 count and then each one as a record
+    prefixed with its uint32 length: the uint32 blob indexes of the first
+    of its solution (the puzzle reveal) and of the rest, then the coin
+
+Solutions are clvm pairs of a puzzle reveal and what the puzzle is solved
+with, and coins with the same puzzle hash, or spent the same way, share
+the blob for it. The first index is NO_BLOB if the solution isn't a pair,
+and then the second blob is the whole solution.
+"""
+
+import struct
+import zlib
+
+from collections.abc import Sequence
+
 import cbor
 
 from chiasim.atoms import hexbytes
 from chiasim.hashable import BLSSignature, CoinSolution, Program
+from chiasim.validation.consensus import (
+    conditions_dict_for_solution,
+    hash_key_pairs_for_conditions_dict,
+)
 
 
 def remap(s, f):
@@ -48,15 +83,218 @@ def cbor_struct_to_bytes(s):
     return remap(s, to_bytes)
 
 
+MAGIC = b"PST"
+VERSION = 1
+FLAG_ZLIB = 1
+
+# the largest compressed payload decompressed
+MAX_PST_SIZE = 64 * 1024 * 1024
+NO_BLOB = 0xffffffff
+
+CONS_BOX_MARKER = 0xff
+
+UINT32 = struct.Struct(">I")
+
+
+def serialized_end(blob, offset=0):
+    """
+    Return the offset just past the clvm object serialized at offset in
+    blob, without parsing it.
+    """
+    pending = 1
+    try:
+        while pending:
+            b = blob[offset]
+            offset += 1
+            pending -= 1
+            if b == CONS_BOX_MARKER:
+                pending += 2
+                continue
+            if b <= 0x80:
+                continue
+            bit_mask = 0x80
+            while b & bit_mask:
+                b &= 0xff ^ bit_mask
+                bit_mask >>= 1
+            size_byte_count = 7 - bit_mask.bit_length()
+            size = int.from_bytes(bytes([b]) + bytes(blob[offset:offset + size_byte_count]), "big")
+            offset += size_byte_count + size
+    except IndexError:
+        raise ValueError("bad encoding")
+    if offset > len(blob):
+        raise ValueError("bad encoding")
+    return offset
+
+
+def read_prefixed(view, offset):
+    """
+    Return (a memoryview of the length prefixed field at offset, the offset after it).
+    """
+    if offset + UINT32.size > len(view):
+        raise ValueError("truncated PST")
+    size, = UINT32.unpack_from(view, offset)
+    offset += UINT32.size
+    if offset + size > len(view):
+        raise ValueError("truncated PST")
+    return view[offset:offset + size], offset + size
+
+
+def prefixed(blob):
+    return UINT32.pack(len(blob)) + blob
+
+
+class CoinSolutionSection(Sequence):
+    """
+    The coin solutions of a compactly encoded PST, each only decoded the
+    first time it's looked at. view is a memoryview of the section, and
+    blobs the blob table as memoryviews.
+    """
+
+    def __init__(self, view, blobs):
+        count, = UINT32.unpack_from(view, 0)
+        self._records = []
+        offset = UINT32.size
+        for _ in range(count):
+            record, offset = read_prefixed(view, offset)
+            self._records.append(record)
+        self._blobs = blobs
+        self._coin_solutions = [None] * count
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[_] for _ in range(*index.indices(len(self)))]
+        coin_solution = self._coin_solutions[index]
+        if coin_solution is None:
+            record = self._records[index]
+            first_index, rest_index = struct.unpack_from(">II", record)
+            parts = [record[8:]]
+            if first_index != NO_BLOB:
+                parts += [bytes([CONS_BOX_MARKER]), self._blobs[first_index]]
+            parts.append(self._blobs[rest_index])
+            coin_solution = CoinSolution.from_bytes(b"".join(parts))
+            self._coin_solutions[index] = coin_solution
+        return coin_solution
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+
+def encode_coin_solutions(coin_solutions):
+    """
+    Return (blob table section, coin solution section) for coin_solutions.
+    """
+    blobs = []
+    blob_indexes = {}
+
+    def blob_index(blob):
+        if blob not in blob_indexes:
+            blob_indexes[blob] = len(blobs)
+            blobs.append(blob)
+        return blob_indexes[blob]
+
+    records = []
+    for coin_solution in coin_solutions:
+        solution = bytes(coin_solution.solution)
+        if solution[0] == CONS_BOX_MARKER:
+            split = serialized_end(solution, 1)
+            first_index = blob_index(solution[1:split])
+            rest_index = blob_index(solution[split:])
+        else:
+            first_index, rest_index = NO_BLOB, blob_index(solution)
+        records.append(struct.pack(">II", first_index, rest_index) + bytes(coin_solution.coin))
+    blob_section = UINT32.pack(len(blobs)) + b"".join(prefixed(_) for _ in blobs)
+    coin_solution_section = UINT32.pack(len(records)) + b"".join(prefixed(_) for _ in records)
+    return blob_section, coin_solution_section
+
+
 class PartiallySignedTransaction(dict):
     @classmethod
     def from_bytes(cls, blob):
-        pst = use_hexbytes(cbor.loads(blob))
+        """
+        Decode a PST in either the compact encoding or cbor.
+        """
+        view = memoryview(blob)
+        if bytes(view[:len(MAGIC)]) == MAGIC:
+            return cls.from_compact_bytes(view)
+        pst = use_hexbytes(cbor.loads(bytes(view)))
         return cls(transform_pst(pst))
 
+    @classmethod
+    def from_compact_bytes(cls, blob):
+        view = memoryview(blob)
+        if len(view) < len(MAGIC) + 2 or bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("not a compact PST")
+        version, flags = view[len(MAGIC)], view[len(MAGIC) + 1]
+        if version != VERSION:
+            raise ValueError("unknown PST version %d" % version)
+        view = view[len(MAGIC) + 2:]
+        if flags & FLAG_ZLIB:
+            decompressor = zlib.decompressobj()
+            payload = decompressor.decompress(view, MAX_PST_SIZE)
+            if decompressor.unconsumed_tail or not decompressor.eof:
+                raise ValueError("compressed PST is truncated or bigger than %d bytes" % MAX_PST_SIZE)
+            if decompressor.unused_data:
+                raise ValueError("data after the compressed PST")
+            view = memoryview(payload)
+        cbor_view, offset = read_prefixed(view, 0)
+        blob_view, offset = read_prefixed(view, offset)
+        coin_solution_view, offset = read_prefixed(view, offset)
+        blob_count, = UINT32.unpack_from(blob_view, 0)
+        blobs = []
+        blob_offset = UINT32.size
+        for _ in range(blob_count):
+            blob, blob_offset = read_prefixed(blob_view, blob_offset)
+            blobs.append(blob)
+        pst = transform_pst(use_hexbytes(cbor.loads(bytes(cbor_view))))
+        pst["coin_solutions"] = CoinSolutionSection(coin_solution_view, blobs)
+        return cls(pst)
+
+    def to_bytes(self, compress=False):
+        """
+        Return the compact encoding, compressed with zlib if compress is set.
+        """
+        others = {k: v for k, v in self.items() if k != "coin_solutions"}
+        blob_section, coin_solution_section = encode_coin_solutions(self.get("coin_solutions", []))
+        payload = b"".join(prefixed(_) for _ in [
+            cbor.dumps(cbor_struct_to_bytes(others)), blob_section, coin_solution_section])
+        flags = 0
+        if compress:
+            payload = zlib.compress(payload, 9)
+            flags |= FLAG_ZLIB
+        return MAGIC + bytes([VERSION, flags]) + payload
+
     def __bytes__(self):
-        cbor_obj = cbor_struct_to_bytes(self)
-        return cbor.dumps(cbor_obj)
+        return self.cbor_bytes()
+
+    def cbor_bytes(self):
+        """
+        Return the cbor encoding, for signers that only read that, as
+        bytes(pst) does.
+        """
+        pst = dict(self)
+        if "coin_solutions" in pst:
+            pst["coin_solutions"] = list(pst["coin_solutions"])
+        return cbor.dumps(cbor_struct_to_bytes(pst))
+
+    def hash_key_pairs(self):
+        """
+        Return a list with the aggsig pairs of each coin solution. The
+        maximal solutions are only run the first time, so don't change
+        coin_solutions after calling this.
+        """
+        hkp_lists = getattr(self, "_hkp_lists", None)
+        if hkp_lists is None:
+            hkp_lists = [
+                hash_key_pairs_for_conditions_dict(conditions_dict_for_solution(_.solution))
+                for _ in self.get("coin_solutions")
+            ]
+            self._hkp_lists = hkp_lists
+        return hkp_lists
 
 
 def xform_aggsig_sig_pair(pair):
@@ -0,0 +1,72 @@
+"""
+Derived puzzle hashes
+
+Deriving a puzzle hash for an index of an M of N wallet means deriving N
+child public keys and hashing the puzzle, so a PuzzleHashStore keeps the
+ones a MultisigHDWallet has derived in a SQLite database next to the
+wallet's json, and reopening the wallet loads them instead. It also keeps
+the indexes the wallet has seen used, which set how far it looks ahead.
+
+The store records a fingerprint of M and the public hd keys, and starts
+over if the wallet it's used with doesn't match.
+"""
+
+import hashlib
+import sqlite3
+
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)",
+    "CREATE TABLE IF NOT EXISTS puzzle_hashes (idx INTEGER PRIMARY KEY, puzzle_hash BLOB)",
+    "CREATE TABLE IF NOT EXISTS used_indexes (idx INTEGER PRIMARY KEY)",
+]
+
+
+def puzzle_hash_store_path(wallet_path):
+    return wallet_path.with_name("%s.puzzle_hashes" % wallet_path.name)
+
+
+def fingerprint_for_wallet(wallet):
+    blob = wallet.m().to_bytes(4, "big") + b"".join(bytes(_) for _ in wallet.pub_hd_keys())
+    return hashlib.sha256(blob).digest()
+
+
+class PuzzleHashStore:
+    def __init__(self, path):
+        self._db = sqlite3.connect(str(path))
+        with self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+
+    def close(self):
+        self._db.close()
+
+    def _check_fingerprint(self, wallet):
+        fingerprint = fingerprint_for_wallet(wallet)
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is not None and row[0] == fingerprint:
+            return
+        with self._db:
+            self._db.execute("DELETE FROM puzzle_hashes")
+            self._db.execute("DELETE FROM used_indexes")
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def load(self, wallet):
+        """
+        Return a pair (list of (index, puzzle_hash), list of used indexes)
+        stored for wallet.
+        """
+        self._check_fingerprint(wallet)
+        pairs = [(idx, puzzle_hash) for idx, puzzle_hash in
+                 self._db.execute("SELECT idx, puzzle_hash FROM puzzle_hashes")]
+        used_indexes = [_[0] for _ in self._db.execute("SELECT idx FROM used_indexes ORDER BY idx")]
+        return pairs, used_indexes
+
+    def save(self, wallet, index_puzzle_hash_pairs, used_indexes=()):
+        self._check_fingerprint(wallet)
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO puzzle_hashes (idx, puzzle_hash) VALUES (?, ?)",
+                [(index, bytes(puzzle_hash)) for index, puzzle_hash in index_puzzle_hash_pairs])
+            self._db.executemany(
+                "INSERT OR IGNORE INTO used_indexes (idx) VALUES (?)", [(_,) for _ in used_indexes])
@@ -1,19 +1,24 @@
+import argparse
 import hashlib
 import readline  # noqa
 import json
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from chiasim.validation.consensus import (
-    conditions_dict_for_solution,
-    hash_key_pairs_for_conditions_dict,
-)
+from chiasim.hashable import BLSSignature
 
 from utilities.BLSHDKey import BLSPrivateHDKey, fingerprint_for_pk
+from utilities.signing_pool import ChildKeyCache
 
 from .pst import PartiallySignedTransaction
 
 
+SERIAL_THRESHOLD = 16
+
+
 def create_private_wallet(path, entropy_f):
     """
     Invoke the entropy function and create a new private wallet as a json
@@ -42,33 +47,151 @@ def default_entropy():
     return os.urandom(1024)
 
 
-def generate_signatures(pst, private_wallet):
+def generate_signature_pairs(pst, private_wallet, keys=None):
     """
     For a given unfinalized SpendBundle, look at the hints to see if the given
     private wallet can generate any signatures, and generate them.
+
+    Return a list of (aggsig_pair, signature) so the wallet can match them
+    up without trying each signature against each pair.
+
+    keys is a ChildKeyCache for private_wallet, to share derived keys
+    between calls.
     """
-    hd_hints = pst.get("hd_hints")
-    sigs = {}
+    if keys is None:
+        keys = ChildKeyCache(private_wallet)
     private_fingerprint = private_wallet.fingerprint()
+    indexes = {
+        fp: hint.get("index") for fp, hint in pst.get("hd_hints").items()
+        if hint.get("hd_fingerprint") == private_fingerprint
+    }
+    sigs = {}
+    fingerprints = {}
 
-    for coin_solution in pst.get("coin_solutions"):
-        solution = coin_solution.solution
-        # run maximal_solution and get conditions
-        conditions_dict = conditions_dict_for_solution(solution)
-        # look for AGG_SIG conditions
-        hkp_list = hash_key_pairs_for_conditions_dict(conditions_dict)
+    for hkp_list in pst.hash_key_pairs():
         # see if we have enough info to build signatures
         for aggsig_pair in hkp_list:
-            pub_key = aggsig_pair.public_key
-            message_hash = aggsig_pair.message_hash
-            fp = fingerprint_for_pk(pub_key)
-            if fp in hd_hints:
-                hint = hd_hints[fp]
-                if private_fingerprint == hint.get("hd_fingerprint"):
-                    private_key = private_wallet.private_child(hint.get("index"))
-                    signature = private_key.sign(message_hash)
-                    sigs[aggsig_pair] = signature
-    return list(sigs.values())
+            if aggsig_pair in sigs:
+                continue
+            pub_key = bytes(aggsig_pair.public_key)
+            if pub_key not in fingerprints:
+                fingerprints[pub_key] = fingerprint_for_pk(pub_key)
+            index = indexes.get(fingerprints[pub_key])
+            if index is not None:
+                sigs[aggsig_pair] = keys.private_child(index).sign(aggsig_pair.message_hash)
+    return list(sigs.items())
+
+
+def generate_signatures(pst, private_wallet):
+    """
+    Like generate_signature_pairs, but just the signatures.
+    """
+    return [sig for aggsig_pair, sig in generate_signature_pairs(pst, private_wallet)]
+
+
+# state of a worker process in the pool
+_worker_private_wallet = None
+_worker_keys = None
+
+
+def _init_worker(private_wallet_blob):
+    global _worker_private_wallet, _worker_keys
+    _worker_private_wallet = BLSPrivateHDKey.from_bytes(private_wallet_blob)
+    _worker_keys = ChildKeyCache(_worker_private_wallet)
+
+
+def sign_serialized_pst(pst_blob):
+    """
+    Return the (aggsig_pair, signature) pairs for the PST in pst_blob as
+    bytes. This runs in the workers of a signing_executor.
+    """
+    pst = PartiallySignedTransaction.from_bytes(pst_blob)
+    return [(bytes(aggsig_pair), bytes(sig))
+            for aggsig_pair, sig in generate_signature_pairs(pst, _worker_private_wallet, _worker_keys)]
+
+
+def signing_executor(private_wallet, pool_size):
+    """
+    Return a process pool of pool_size workers that each keep
+    private_wallet and the keys derived from it, to run sign_serialized_pst.
+    """
+    return ProcessPoolExecutor(max_workers=pool_size, initializer=_init_worker, initargs=(bytes(private_wallet),))
+
+
+def sign_psts(psts, private_wallet, pool_size=None, serial_threshold=SERIAL_THRESHOLD):
+    """
+    Return a list with generate_signature_pairs(pst, private_wallet) for
+    each of psts. Derived keys are shared between the psts, and batches of
+    at least serial_threshold psts are spread over pool_size worker
+    processes (None means one per cpu), where the conditions are run.
+    """
+    psts = list(psts)
+    if pool_size is None:
+        pool_size = os.cpu_count() or 1
+    if pool_size < 2 or len(psts) < serial_threshold:
+        keys = ChildKeyCache(private_wallet)
+        return [generate_signature_pairs(_, private_wallet, keys) for _ in psts]
+    with signing_executor(private_wallet, pool_size) as executor:
+        chunksize = max(1, len(psts) // (pool_size * 4))
+        pair_blob_lists = list(executor.map(sign_serialized_pst, [bytes(_) for _ in psts], chunksize=chunksize))
+    return [
+        [(BLSSignature.aggsig_pair.from_bytes(pair_blob), BLSSignature.from_bytes(sig_blob))
+         for pair_blob, sig_blob in pair_blobs]
+        for pair_blobs in pair_blob_lists
+    ]
+
+
+def read_psts(source):
+    """
+    Yield (name, pst) for the psts in source: a directory of files each
+    holding the hex of a PST, named by file name, or a stream with the hex
+    of a PST on each line, named by line number.
+    """
+    if isinstance(source, (str, Path)):
+        for path in sorted(Path(source).iterdir()):
+            if path.is_file():
+                yield path.name, PartiallySignedTransaction.from_bytes(bytes.fromhex(path.read_text().strip()))
+        return
+    for line_number, line in enumerate(source, 1):
+        line = line.strip()
+        if line:
+            yield str(line_number), PartiallySignedTransaction.from_bytes(bytes.fromhex(line))
+
+
+def sign_batch(named_psts, private_wallet, out, pool_size=None, serial_threshold=SERIAL_THRESHOLD):
+    """
+    Sign (name, pst) pairs and write a json line to out for each pst, with
+    its name and its signatures as "aggsig_pair_hex:signature_hex".
+    Return a pair (signature count, seconds taken to sign).
+    """
+    named_psts = list(named_psts)
+    start = time.perf_counter()
+    pair_lists = sign_psts([_[1] for _ in named_psts], private_wallet, pool_size, serial_threshold)
+    elapsed = time.perf_counter() - start
+    for (name, pst), pairs in zip(named_psts, pair_lists):
+        signatures = ["%s:%s" % (bytes(aggsig_pair).hex(), bytes(sig).hex()) for aggsig_pair, sig in pairs]
+        out.write(json.dumps(dict(pst=name, signatures=signatures)) + "\n")
+    return sum(len(_) for _ in pair_lists), elapsed
+
+
+def batch_main(args):
+    parser = argparse.ArgumentParser(description="Sign a batch of PSTs.")
+    parser.add_argument("wallet", type=Path, help="the private wallet json")
+    parser.add_argument("source", help="a directory of PST files, or - for one PST hex per line on stdin")
+    parser.add_argument("-o", "--output", help="write the signatures here instead of stdout")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    args = parser.parse_args(args)
+
+    private_wallet = load_private_wallet(args.wallet)
+    named_psts = read_psts(sys.stdin if args.source == "-" else args.source)
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        signature_count, elapsed = sign_batch(named_psts, private_wallet, out, args.jobs)
+    finally:
+        if args.output:
+            out.close()
+    rate = signature_count / elapsed if elapsed > 0 else 0
+    print("%d signatures in %.3fs, %.1f signatures per second" % (signature_count, elapsed, rate), file=sys.stderr)
 
 
 def get_pst():
@@ -87,7 +210,7 @@ def get_pst():
         pst_hex = None
 
 
-def main():
+def interactive_main():
     wallet_name = input("wallet name> ")
     PATH = Path("private.%s.json" % wallet_name)
     if not PATH.exists():
@@ -97,10 +220,21 @@ def main():
 
     pst = get_pst()
     if pst:
-        sigs = generate_signatures(pst, private_wallet)
+        sig_pairs = generate_signature_pairs(pst, private_wallet)
         print("SIGNATURES:")
-        for sig in sigs:
-            print(bytes(sig).hex())
+        for aggsig_pair, sig in sig_pairs:
+            print("%s:%s" % (bytes(aggsig_pair).hex(), bytes(sig).hex()))
+
+
+def main(args=sys.argv[1:]):
+    """
+    Sign interactively, or with "batch" as the first argument, sign a
+    batch of PSTs as batch_main does.
+    """
+    if args[:1] == ["batch"]:
+        batch_main(args[1:])
+    else:
+        interactive_main()
 
 
 if __name__ == "__main__":
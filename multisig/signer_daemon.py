@@ -0,0 +1,201 @@
+"""
+Signer daemon
+
+A SignerDaemon keeps a private wallet loaded and listens on a Unix socket,
+so an automated pipeline can get signatures without starting a signer for
+each PST. Each request is a line with the hex of a PST, and each response
+a json line with the signatures as "aggsig_pair_hex:signature_hex", like
+the batch signer writes, or with an error. Requests are signed
+concurrently, also on the same connection, and each connection's
+responses come back in the order of its requests.
+
+PSTs are signed on a pool of worker processes that each keep their
+derived keys, or with pool_size 0 on a thread of the daemon's process.
+The socket is only accessible to the user running the daemon.
+
+Run with:
+
+    $ python -m multisig.signer_daemon private.wallet.json signer.sock [-j jobs]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from pathlib import Path
+
+from chiasim.hashable import BLSSignature
+
+from utilities.signing_pool import ChildKeyCache
+
+from .pst import PartiallySignedTransaction
+from .signer import generate_signature_pairs, load_private_wallet, sign_serialized_pst, signing_executor
+
+
+# the longest request or response line, as a PST for many coins is big
+LINE_LIMIT = 64 * 1024 * 1024
+
+# owner only
+SOCKET_MODE = 0o600
+SOCKET_UMASK = 0o077
+
+
+class SignerDaemon:
+    """
+    pool_size is the number of worker processes (None means one per cpu,
+    0 means sign on a thread of this process).
+    """
+
+    def __init__(self, private_wallet, pool_size=None):
+        if pool_size is None:
+            pool_size = os.cpu_count() or 1
+        self._private_wallet = private_wallet
+        self._keys = ChildKeyCache(private_wallet)
+        self._executor = None
+        if pool_size > 0:
+            self._executor = signing_executor(private_wallet, pool_size)
+        self._server = None
+        self._connections = set()
+
+    def _sign_in_process(self, pst_blob):
+        pst = PartiallySignedTransaction.from_bytes(pst_blob)
+        return [(bytes(aggsig_pair), bytes(sig))
+                for aggsig_pair, sig in generate_signature_pairs(pst, self._private_wallet, self._keys)]
+
+    async def sign(self, pst_blob):
+        """
+        Return the list of "aggsig_pair_hex:signature_hex" for the PST.
+        """
+        loop = asyncio.get_event_loop()
+        if self._executor is None:
+            # off the event loop, so the daemon keeps serving while it signs
+            pairs = await loop.run_in_executor(None, self._sign_in_process, pst_blob)
+        else:
+            pairs = await loop.run_in_executor(self._executor, sign_serialized_pst, pst_blob)
+        return ["%s:%s" % (pair_blob.hex(), sig_blob.hex()) for pair_blob, sig_blob in pairs]
+
+    async def handle_request(self, line):
+        try:
+            return dict(signatures=await self.sign(bytes.fromhex(line.decode().strip())))
+        except Exception as ex:
+            return dict(error="%s: %s" % (type(ex).__name__, ex))
+
+    async def handle_connection(self, reader, writer):
+        """
+        Start signing each request as soon as it's read, so the requests
+        on a connection are signed concurrently, and write the responses
+        in request order.
+        """
+        pending = asyncio.Queue()
+
+        async def write_responses():
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                writer.write(json.dumps(await task).encode() + b"\n")
+                await writer.drain()
+
+        writer_task = asyncio.ensure_future(write_responses())
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        try:
+            while not writer_task.done():
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(asyncio.ensure_future(self.handle_request(line)))
+            await pending.put(None)
+            await writer_task
+        except asyncio.CancelledError:
+            # the daemon is closing
+            pass
+        finally:
+            writer_task.cancel()
+            while not pending.empty():
+                task = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
+            writer.close()
+            self._connections.discard(connection)
+
+    async def start(self, path):
+        """
+        Start listening on the Unix socket at path. Only the daemon's user
+        may connect, since whoever connects gets signatures. The socket is
+        created with a restrictive umask, so it's never accessible to
+        others, not even before it's chmod'ed.
+        """
+        old_umask = os.umask(SOCKET_UMASK)
+        try:
+            self._server = await asyncio.start_unix_server(self.handle_connection, path=str(path), limit=LINE_LIMIT)
+        finally:
+            os.umask(old_umask)
+        os.chmod(str(path), SOCKET_MODE)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for connection in list(self._connections):
+            connection.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+async def request_signatures(path, psts):
+    """
+    Ask the daemon listening at path to sign psts over one connection, and
+    return a list with the (aggsig_pair, signature) pairs for each.
+    """
+    reader, writer = await asyncio.open_unix_connection(str(path), limit=LINE_LIMIT)
+    try:
+        for pst in psts:
+            writer.write(pst.to_bytes().hex().encode() + b"\n")
+        await writer.drain()
+        pair_lists = []
+        for pst in psts:
+            response = json.loads(await reader.readline())
+            if "error" in response:
+                raise ValueError(response["error"])
+            pairs = []
+            for s in response["signatures"]:
+                aggsig_pair_hex, sig_hex = s.split(":")
+                pairs.append((BLSSignature.aggsig_pair.from_bytes(bytes.fromhex(aggsig_pair_hex)),
+                              BLSSignature.from_bytes(bytes.fromhex(sig_hex))))
+            pair_lists.append(pairs)
+        return pair_lists
+    finally:
+        writer.close()
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Sign PSTs sent to a Unix socket.")
+    parser.add_argument("wallet", type=Path, help="the private wallet json")
+    parser.add_argument("socket", type=Path, help="path of the Unix socket to listen on")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    args = parser.parse_args(args)
+
+    private_wallet = load_private_wallet(args.wallet)
+    daemon = SignerDaemon(private_wallet, args.jobs)
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(daemon.start(args.socket))
+    print("public hd key is %s" % private_wallet.public_hd_key())
+    print("listening on %s" % args.socket)
+    try:
+        loop.run_until_complete(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(daemon.close())
+
+
+if __name__ == "__main__":
+    main()
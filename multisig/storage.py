@@ -1,16 +1,64 @@
-from chiasim.hashable import Body, Header, HeaderHash
-from chiasim.storage import RAM_DB
-from chiasim.validation.chainview import apply_deltas
-from chiasim.wallet.deltas import additions_for_body, removals_for_body
+"""
+Coin storage for the multisig wallet
 
+Storage keeps the coins with "interesting" puzzle hashes that a sync has
+seen, and when they were confirmed and spent, in a SQLite database at the
+path it's given, along with the hashes of the headers synced. Reopening it
+picks the sync up from the last header instead of replaying the chain.
 
-class Storage(RAM_DB):
+    coins    one row per coin, indexed on puzzle hash, confirmed block
+             index and spent block index (NULL until it's spent)
+    headers  the hash of each header synced, by block index
+
+It has the same interface as chiasim's RAM_DB, but only keeps preimages
+of coins.
+"""
+
+import inspect
+import sqlite3
+
+from chiasim.hashable import Coin, HeaderHash, Unspent
+
+from utilities.block_sync import BlockSync
+
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS coins (name BLOB PRIMARY KEY, coin BLOB, puzzle_hash BLOB,"
+    " confirmed_block_index INTEGER, spent_block_index INTEGER)",
+    "CREATE INDEX IF NOT EXISTS coins_puzzle_hash ON coins (puzzle_hash)",
+    "CREATE INDEX IF NOT EXISTS coins_confirmed ON coins (confirmed_block_index)",
+    "CREATE INDEX IF NOT EXISTS coins_spent ON coins (spent_block_index)",
+    "CREATE TABLE IF NOT EXISTS headers (block_index INTEGER PRIMARY KEY, header_hash BLOB)",
+]
+
+# the most puzzle hashes put in one query, under SQLite's limit on variables
+QUERY_CHUNK_SIZE = 500
+
+
+def coin_store_path(wallet_path):
+    return wallet_path.with_name("%s.coins" % wallet_path.name)
+
+
+def unspent_for_row(confirmed_block_index, spent_block_index):
+    return Unspent(confirmed_block_index, spent_block_index or 0)
+
+
+class Storage:
     def __init__(self, path, ledger_sim):
         self._path = path
         self._ledger_sim = ledger_sim
         self._interested_puzzled_hashes = set()
-        self._header_list = []
-        super(Storage, self).__init__()
+        self._on_interesting_coins = None
+        self._db = sqlite3.connect(str(path))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+        self._block_sync = BlockSync(ledger_sim, checkpoint=self.last_header(), removal_coins=False)
+
+    def close(self):
+        self._db.close()
 
     def add_interested_puzzle_hashes(self, puzzle_hashes):
         """
@@ -18,47 +66,143 @@ class Storage(RAM_DB):
         """
         self._interested_puzzled_hashes.update(puzzle_hashes)
 
+    def on_interesting_coins(self, f):
+        """
+        Call f(coins) during sync with each batch of new coins that have
+        interesting puzzle hashes. f may add more interesting puzzle hashes,
+        and the rest of the block's coins are checked against them too.
+        If f returns an awaitable, the sync waits for it.
+        """
+        self._on_interesting_coins = f
+
+    def last_header(self):
+        """
+        Return the hash of the last header synced, or None.
+        """
+        row = self._db.execute("SELECT header_hash FROM headers ORDER BY block_index DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+        return HeaderHash.from_bytes(row[0])
+
+    async def hash_preimage(self, hash):
+        row = self._db.execute("SELECT coin FROM coins WHERE name = ?", (bytes(hash),)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    async def add_preimage(self, blob):
+        coin = Coin.from_bytes(blob)
+        with self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO coins (name, coin, puzzle_hash) VALUES (?, ?, ?)",
+                (bytes(coin.name()), bytes(blob), bytes(coin.puzzle_hash)))
+
+    async def all_unspents(self):
+        for name, confirmed_block_index, spent_block_index in self._db.execute(
+                "SELECT name, confirmed_block_index, spent_block_index FROM coins"
+                " WHERE confirmed_block_index IS NOT NULL"):
+            yield name, unspent_for_row(confirmed_block_index, spent_block_index)
+
+    async def unspent_for_coin_name(self, coin_name):
+        row = self._db.execute(
+            "SELECT confirmed_block_index, spent_block_index FROM coins"
+            " WHERE name = ? AND confirmed_block_index IS NOT NULL", (bytes(coin_name),)).fetchone()
+        if row is None:
+            return None
+        return unspent_for_row(*row)
+
+    async def set_unspent_for_coin_name(self, coin_name, unspent):
+        with self._db:
+            self._db.execute(
+                "UPDATE coins SET confirmed_block_index = ?, spent_block_index = ? WHERE name = ?",
+                (unspent.confirmed_block_index, unspent.spent_block_index or None, bytes(coin_name)))
+
+    async def coins_and_unspents(self, unspent_only=False):
+        """
+        Yield (coin, unspent) for each coin, or each coin not spent yet, in
+        the order they were confirmed.
+        """
+        where = " AND spent_block_index IS NULL" if unspent_only else ""
+        for blob, confirmed_block_index, spent_block_index in self._db.execute(
+                "SELECT coin, confirmed_block_index, spent_block_index FROM coins"
+                " WHERE confirmed_block_index IS NOT NULL%s ORDER BY confirmed_block_index, rowid" % where):
+            yield Coin.from_bytes(blob), unspent_for_row(confirmed_block_index, spent_block_index)
+
+    async def unspent_coins_for_puzzle_hashes(self, puzzle_hashes):
+        """
+        Return the coins not spent yet with any of the given puzzle hashes.
+        """
+        puzzle_hashes = [bytes(_) for _ in puzzle_hashes]
+        coins = []
+        for start in range(0, len(puzzle_hashes), QUERY_CHUNK_SIZE):
+            chunk = puzzle_hashes[start:start + QUERY_CHUNK_SIZE]
+            coins.extend(Coin.from_bytes(_[0]) for _ in self._db.execute(
+                "SELECT coin FROM coins WHERE puzzle_hash IN (%s)"
+                " AND confirmed_block_index IS NOT NULL AND spent_block_index IS NULL" % ",".join("?" * len(chunk)),
+                chunk))
+        return coins
+
+    def _rollback_to_block(self, block_index):
+        with self._db:
+            self._db.execute("DELETE FROM coins WHERE confirmed_block_index > ?", (block_index,))
+            self._db.execute("UPDATE coins SET spent_block_index = NULL WHERE spent_block_index > ?", (block_index,))
+            self._db.execute("DELETE FROM headers WHERE block_index > ?", (block_index,))
+
+    async def rollback_to_block(self, block_index):
+        """
+        Forget the coins confirmed, the spends and the headers after
+        block_index. The next sync continues from there.
+        """
+        self._rollback_to_block(block_index)
+        self._block_sync = BlockSync(self._ledger_sim, checkpoint=self.last_header(), removal_coins=False)
+
+    async def _interesting_additions(self, additions):
+        interesting = []
+        while additions:
+            found = [_ for _ in additions if _.puzzle_hash in self._interested_puzzled_hashes]
+            if not found:
+                break
+            interesting.extend(found)
+            additions = [_ for _ in additions if _.puzzle_hash not in self._interested_puzzled_hashes]
+            if self._on_interesting_coins is None:
+                break
+            r = self._on_interesting_coins(found)
+            if inspect.isawaitable(r):
+                await r
+        return interesting
+
+    def _apply_block(self, block_index, header, additions, removals):
+        """
+        Record a block's interesting additions and the spends of coins
+        already kept, and its header, in a single transaction.
+        """
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO coins (name, coin, puzzle_hash, confirmed_block_index, spent_block_index)"
+                " VALUES (?, ?, ?, ?, NULL)",
+                [(bytes(_.name()), bytes(_), bytes(_.puzzle_hash), block_index) for _ in additions])
+            # removals are coin names, and the ones for coins that aren't kept update nothing
+            self._db.executemany(
+                "UPDATE coins SET spent_block_index = ? WHERE name = ? AND spent_block_index IS NULL",
+                [(block_index, bytes(_)) for _ in removals])
+            self._db.execute(
+                "INSERT OR REPLACE INTO headers (block_index, header_hash) VALUES (?, ?)",
+                (block_index, bytes(HeaderHash(header))))
+
     async def sync(self):
         """
         Get blocks from ledger sim and make a note of new and spent coins
         that are "interesting".
         """
-        headers = []
-        tip_dict = await self._ledger_sim.get_tip()
-        genesis_hash = tip_dict["genesis_hash"]
-        header_hash = tip_dict["tip_hash"]
-        header_index = tip_dict["tip_index"]
-        while True:
-            if header_hash == genesis_hash:
-                break
-            if len(self._header_list) >= header_index and header_hash == HeaderHash(
-                self._header_list[header_index - 1]
-            ):
-                break
-            preimage = await self._ledger_sim.hash_preimage(hash=header_hash)
-            header = Header.from_bytes(preimage)
-            headers.append(header)
-            header_hash = header.previous_hash
-            header_index -= 1
-        await self.rollback_to_block(header_index)
-        new_block_count = len(headers)
-        while headers:
-            header = headers.pop()
-            preimage = await self._ledger_sim.hash_preimage(hash=header.body_hash)
-            body = Body.from_bytes(preimage)
-            additions = [
-                _
-                for _ in additions_for_body(body)
-                if _.puzzle_hash in self._interested_puzzled_hashes
-            ]
-            removals = [
-                _
-                for _ in removals_for_body(body)
-                if _ in self._interested_puzzled_hashes
-            ]
-            await apply_deltas(header_index, additions, removals, self, self)
-            self._header_list.append(header)
-            header_index += 1
+        new_block_count = 0
+        async for index, header, additions, removals in self._block_sync.new_blocks():
+            header_index = index - 1
+            if new_block_count == 0:
+                # the first new block tells us where our chain and the ledger's diverge
+                self._rollback_to_block(header_index - 1)
+            additions = await self._interesting_additions(additions)
+            self._apply_block(header_index, header, additions, removals)
+            new_block_count += 1
         return new_block_count
 
     def ledger_sim(self):
@@ -1,5 +1,6 @@
 import asyncio
 import json
+import os
 import readline  # noqa
 from pathlib import Path
 
@@ -14,32 +15,21 @@ from chiasim.hashable import (
 from chiasim.validation import validate_spend_bundle_signature
 from chiasim.validation.Conditions import make_create_coin_condition
 
-from chiasim.validation.consensus import (
-    conditions_dict_for_solution,
-    hash_key_pairs_for_conditions_dict,
-)
-
 from puzzles.p2_m_of_n_delegate_direct import solution_for_delegated_puzzle
 from puzzles.p2_conditions import puzzle_for_conditions, solution_for_conditions
 
 
 from utilities.BLSHDKey import BLSPublicHDKey, fingerprint_for_pk
+from utilities.preimage_cache import CachedLedgerAPI, PreimageCache
 
 from .pst import PartiallySignedTransaction
-from .storage import Storage
+from .puzzle_hash_store import PuzzleHashStore, puzzle_hash_store_path
+from .storage import Storage, coin_store_path
 from .MultisigHDWallet import MultisigHDWallet
 
 
-# we hard-code a gap limit for now (ie. the number
-# of addresses allocated that haven't been referenced
-# in the blockchain)
-# Eventually, the wallet should keep track of the
-# maximum gap limit it's ever seen to minimize
-# unnecessary address generation.
-
-# TODO: fix this
-
-GAP_LIMIT = 100
+# how many indexes of the lookahead are derived and saved at a time
+LOOKAHEAD_CHUNK = 100
 
 
 def pubkey_for_str(s):
@@ -50,6 +40,36 @@ def pubkey_for_str(s):
     return None
 
 
+def signature_for_str(s):
+    """
+    Turn a string pasted from a signer into a signature. The signer prints
+    "aggsig_pair_hex:signature_hex", which gives a pair (aggsig_pair,
+    signature). A bare signature hex gives just the signature.
+    """
+    if ":" in s:
+        aggsig_pair_hex, sig_hex = s.split(":")
+        aggsig_pair = BLSSignature.aggsig_pair.from_bytes(bytes.fromhex(aggsig_pair_hex))
+        return (aggsig_pair, BLSSignature.from_bytes(bytes.fromhex(sig_hex)))
+    return BLSSignature.from_bytes(bytes.fromhex(s))
+
+
+def signatures_from_file(path):
+    """
+    Read the signatures a signer printed, one per line, from the file at
+    path. Blank lines and the "SIGNATURES:" heading are skipped. Lines
+    from a batch signer are json, with a list of signatures each.
+    """
+    sigs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("{"):
+                sigs.extend(signature_for_str(_) for _ in json.loads(line)["signatures"])
+            elif line and line != "SIGNATURES:":
+                sigs.append(signature_for_str(line))
+    return sigs
+
+
 def create_wallet(path, input=input):
     """
     UI to accept information necessary to create an M of N wallet.
@@ -93,10 +113,87 @@ def load_wallet(path) -> MultisigHDWallet:
     pub_hd_keys_bytes = [bytes.fromhex(_) for _ in d["public_hd_keys"]]
     pub_hd_keys = [BLSPublicHDKey.from_bytes(_) for _ in pub_hd_keys_bytes]
     wallet = MultisigHDWallet(d["M"], pub_hd_keys)
+    wallet.set_puzzle_hash_store(PuzzleHashStore(puzzle_hash_store_path(Path(path))))
     return wallet
 
 
-async def generate_coins(wallet, storage, coinbase_puzzle_hash, fees_puzzle_hash):
+async def extend_lookahead(wallet, start=0, count=None):
+    """
+    Make sure the puzzle hashes for indexes start up to count (by default,
+    the wallet's lookahead) are known, deriving any missing ones on a
+    process pool off the event loop, and save them with the wallet.
+
+    Only the derivation runs off the event loop; the wallet and its store
+    are only touched from the loop's thread.
+    """
+    if count is None:
+        count = wallet.lookahead_count()
+    missing = wallet.missing_indexes(range(start, count))
+    if missing:
+        loop = asyncio.get_event_loop()
+        puzzle_hashes = await loop.run_in_executor(None, wallet.compute_puzzle_hashes, missing)
+        wallet.add_puzzle_hashes(list(zip(missing, puzzle_hashes)))
+    wallet.save_puzzle_hashes()
+
+
+class LookaheadWatcher:
+    """
+    Keep storage interested in the puzzle hashes of the wallet's lookahead,
+    growing it as coins turn up for the wallet while syncing. Each index is
+    only derived and added to storage once.
+
+    The lookahead is extended in the background, a chunk of indexes at a
+    time, each saved and watched as soon as it's derived.
+    """
+
+    def __init__(self, wallet, storage, chunk_size=LOOKAHEAD_CHUNK):
+        self._wallet = wallet
+        self._storage = storage
+        self._chunk_size = chunk_size
+        self._watched_count = 0
+        self._extension = None
+        storage.on_interesting_coins(self._on_interesting_coins)
+
+    def watched_count(self):
+        return self._watched_count
+
+    async def _extend(self):
+        while self._watched_count < self._wallet.lookahead_count():
+            start = self._watched_count
+            count = min(self._wallet.lookahead_count(), start + self._chunk_size)
+            await extend_lookahead(self._wallet, start, count)
+            self._storage.add_interested_puzzle_hashes(
+                self._wallet.puzzle_hash_for_index(_) for _ in range(start, count))
+            self._watched_count = count
+
+    def start(self):
+        """
+        Start extending the lookahead in the background, unless it already
+        is, and return the task.
+        """
+        if self._extension is None or self._extension.done():
+            self._extension = asyncio.ensure_future(self._extend())
+        return self._extension
+
+    async def ready(self):
+        """
+        Wait until every index of the lookahead is watched.
+        """
+        while self._watched_count < self._wallet.lookahead_count():
+            await self.start()
+
+    async def close(self):
+        if self._extension is not None and not self._extension.done():
+            self._extension.cancel()
+            await asyncio.gather(self._extension, return_exceptions=True)
+        self._extension = None
+
+    async def _on_interesting_coins(self, coins):
+        if self._wallet.note_used_puzzle_hashes(_.puzzle_hash for _ in coins):
+            await self.ready()
+
+
+async def generate_coins(wallet, storage, watcher, coinbase_puzzle_hash, fees_puzzle_hash):
     """
     Invoke "next_block" on ledger sim with the given reward puzzle hashes.
     """
@@ -104,10 +201,10 @@ async def generate_coins(wallet, storage, coinbase_puzzle_hash, fees_puzzle_hash
     await remote.next_block(
         coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash
     )
-    await do_sync(wallet, storage)
+    await do_sync(wallet, storage, watcher)
 
 
-async def do_generate_address(wallet, storage, input):
+async def do_generate_address(wallet, storage, watcher, input):
     """
     UI to generate and return an address in the wallet and optionally
     generate coins.
@@ -118,11 +215,13 @@ async def do_generate_address(wallet, storage, input):
     except ValueError:
         pass
     address = wallet.address_for_index(index)
+    if wallet.note_used_indexes([index]):
+        watcher.start()
     print(f"address #{index} is {address}")
     r = input(f"Generate coins with this address? (y/n)> ")
     if r.lower().startswith("y"):
         puzzle_hash = wallet.puzzle_hash_for_index(index)
-        await generate_coins(wallet, storage, puzzle_hash, puzzle_hash)
+        await generate_coins(wallet, storage, watcher, puzzle_hash, puzzle_hash)
     return address
 
 
@@ -151,28 +250,42 @@ async def do_spend_coin(wallet, storage, input):
 
     # create an unfinalized SpendBundle
     pst = spend_coin(wallet, coins, dest_address)
-    pst_encoded = bytes(pst)
+    pst_encoded = pst.to_bytes(compress=True)
     print(pst_encoded.hex())
 
-    # keep requesting signatures until finalized
-    sigs = []
-    while True:
-        sig_str = input("Enter a signature> ")
-        try:
-            sig = BLSSignature.from_bytes(bytes.fromhex(sig_str))
-        except Exception as ex:
-            print("failed: %s" % ex)
-            continue
-        sigs.append(sig)
-        sigs = list(set(sigs))
-        spend_bundle, summary_list = finalize_pst(wallet, pst, sigs)
-        if spend_bundle:
-            break
-        for summary in summary_list:
-            print(
-                "coin %s has %d of %d sigs"
-                % (summary[0].name(), len(summary[2]), summary[3])
-            )
+    # keep requesting signatures until finalized, combining each batch at once;
+    # the verifier only verifies the signatures it hasn't seen in earlier batches
+    from .combiner import SignatureVerifier, combine
+
+    signer_outputs = []
+    verifier = SignatureVerifier()
+    try:
+        while True:
+            sigs = []
+            while True:
+                sig_str = input("Enter a signature or signer output file (blank to finish)> ")
+                if len(sig_str) == 0:
+                    break
+                try:
+                    if os.path.isfile(sig_str):
+                        sigs.extend(signatures_from_file(sig_str))
+                    else:
+                        sigs.append(signature_for_str(sig_str))
+                except Exception as ex:
+                    print("failed: %s" % ex)
+            if not sigs:
+                continue
+            signer_outputs.append(sigs)
+            [(spend_bundle, summary_list)] = combine(wallet, [pst], signer_outputs, verifier=verifier)
+            if spend_bundle:
+                break
+            for summary in summary_list:
+                print(
+                    "coin %s has %d of %d sigs"
+                    % (summary[0].name(), len(summary[2]), summary[3])
+                )
+    finally:
+        verifier.close()
     print("spend bundle = %s" % bytes(spend_bundle).hex())
 
     # optionally send to ledger sim
@@ -210,7 +323,9 @@ def spend_coin(wallet, coins, dest_address):
     coin_solutions = []
     hd_hints = {}
     for coin in coins:
-        index = wallet.index_for_puzzle_hash(coin.puzzle_hash, GAP_LIMIT)
+        index = wallet.index_for_puzzle_hash(coin.puzzle_hash)
+        if index is None:
+            raise ValueError("coin %s isn't paid to this wallet" % coin.name())
         coin_solution, pub_keys = maximal_solution_for_coin(
             wallet, index, coin, conditions
         )
@@ -236,53 +351,59 @@ def sigs_to_aggsig_sig_dict(wallet, pst, sigs):
     Figure out which signatures in sigs correspond to which
     aggsig pairs in the unfinalized SpendBundle pst.
 
-    Return a dictionary with keys that are aggsig pairs and
-    signature values.
+    sigs can hold (aggsig_pair, signature) pairs, as the signer produces,
+    or bare signatures.
 
-    This is an n^2 algorithm, so not ideal, but fine for small
-    M and N.
+    Return a pair (dictionary with keys that are aggsig pairs and
+    signature values, set of the aggsig pairs whose signatures
+    haven't been checked).
+
+    Paired signatures are matched by lookup and checked later, all at once,
+    when the spend bundle signature is validated. Bare signatures still
+    have to be tried against each unmatched pair.
     """
     all_sigs_dict = {}
+    unchecked = set()
     all_aggsigs = set()
-    for coin_solution in pst.get("coin_solutions"):
-        solution = coin_solution.solution
-        conditions_dict = conditions_dict_for_solution(solution)
-        hkp_list = hash_key_pairs_for_conditions_dict(conditions_dict)
+    for hkp_list in pst.hash_key_pairs():
         all_aggsigs.update(hkp_list)
+    bare_sigs = []
     for sig in sigs:
+        if isinstance(sig, tuple):
+            aggsig, sig = sig
+            if aggsig in all_aggsigs:
+                all_sigs_dict[aggsig] = sig
+                unchecked.add(aggsig)
+        else:
+            bare_sigs.append(sig)
+    all_aggsigs.difference_update(all_sigs_dict)
+    for sig in bare_sigs:
         for aggsig in all_aggsigs:
             if sig.validate([aggsig]):
                 all_sigs_dict[aggsig] = sig
                 all_aggsigs.remove(aggsig)
                 break
-    return all_sigs_dict
+    return all_sigs_dict, unchecked
 
 
-def finalize_pst(wallet, pst, sigs):
+def spend_bundle_for_sig_dict(wallet, pst, sig_dict):
     """
-    Return a pair (SpendBundle or None, summary_list).
-
-    If we have a finalized SpendBundle, it's returned, otherwise None,
-    The summary_list item is a list of items (coin, hkp_list, sigs_to_use, m)
-    which allows the UI to give the end user information about which
-    coins still need signatures.
-
-    Note that hkp is short for hash_key_pair (ie. aggsig pair)
+    Return a pair (SpendBundle or None, summary_list) as finalize_pst does,
+    using the signatures in sig_dict.
     """
     m = wallet.m()
     coin_solutions = []
-    sig_dict = sigs_to_aggsig_sig_dict(wallet, pst, sigs)
 
     all_sigs_to_use = []
 
     summary_list = []
 
-    for coin_solution in pst.get("coin_solutions"):
-        coin, solution = coin_solution.coin, coin_solution.solution
-        # run maximal_solution and get conditions
-        conditions_dict = conditions_dict_for_solution(solution)
-        # look for AGG_SIG conditions
-        hkp_list = hash_key_pairs_for_conditions_dict(conditions_dict)
+    conditions = pst.get("conditions")
+    delegated_puzzle = puzzle_for_conditions(conditions)
+    delegated_solution = solution_for_conditions(conditions)
+
+    for coin_solution, hkp_list in zip(pst.get("coin_solutions"), pst.hash_key_pairs()):
+        coin = coin_solution.coin
         # see if we have enough info to build signatures
         found_list = []
         sigs_to_use = []
@@ -296,11 +417,9 @@ def finalize_pst(wallet, pst, sigs):
 
         all_sigs_to_use.extend(sigs_to_use)
 
-        conditions = pst.get("conditions")
-        delegated_puzzle = puzzle_for_conditions(conditions)
-        delegated_solution = solution_for_conditions(conditions)
-
-        index = wallet.index_for_puzzle_hash(coin.puzzle_hash, GAP_LIMIT)
+        index = wallet.index_for_puzzle_hash(coin.puzzle_hash)
+        if index is None:
+            raise ValueError("coin %s isn't paid to this wallet" % coin.name())
         pub_keys = wallet.pub_keys_for_index(index)
         actual_solution = solution_for_delegated_puzzle(
             m, pub_keys, found_list, delegated_puzzle, delegated_solution
@@ -311,7 +430,8 @@ def finalize_pst(wallet, pst, sigs):
         summary = (coin, hkp_list, sigs_to_use, m)
         summary_list.append(summary)
 
-    if len(all_sigs_to_use) > 0:
+    # every coin needs m signatures before there's any point validating
+    if len(all_sigs_to_use) > 0 and all(len(_[2]) >= m for _ in summary_list):
         aggregated_sig = all_sigs_to_use[0].aggregate(all_sigs_to_use)
         spend_bundle = SpendBundle(coin_solutions, aggregated_sig)
         try:
@@ -323,6 +443,29 @@ def finalize_pst(wallet, pst, sigs):
     return None, summary_list
 
 
+def finalize_pst(wallet, pst, sigs):
+    """
+    Return a pair (SpendBundle or None, summary_list).
+
+    If we have a finalized SpendBundle, it's returned, otherwise None,
+    The summary_list item is a list of items (coin, hkp_list, sigs_to_use, m)
+    which allows the UI to give the end user information about which
+    coins still need signatures.
+
+    Note that hkp is short for hash_key_pair (ie. aggsig pair)
+    """
+    sig_dict, unchecked = sigs_to_aggsig_sig_dict(wallet, pst, sigs)
+    spend_bundle, summary_list = spend_bundle_for_sig_dict(wallet, pst, sig_dict)
+    if spend_bundle is None and unchecked and all(len(_[2]) >= _[3] for _ in summary_list):
+        # a paired signature may not be what it claims to be: drop the bad ones and retry
+        bad_aggsigs = [_ for _ in unchecked if not sig_dict[_].validate([_])]
+        if bad_aggsigs:
+            for aggsig in bad_aggsigs:
+                del sig_dict[aggsig]
+            spend_bundle, summary_list = spend_bundle_for_sig_dict(wallet, pst, sig_dict)
+    return spend_bundle, summary_list
+
+
 async def ledger_sim_proxy():
     """
     Return an async proxy to the ledger sim instance running on 9868.
@@ -332,46 +475,41 @@ async def ledger_sim_proxy():
 
     reader, writer = await asyncio.open_connection(host="localhost", port=9868)
     proxy = request_response_proxy(reader, writer, ledger_sim.REMOTE_SIGNATURES)
-    return proxy
+    return CachedLedgerAPI(proxy, PreimageCache())
 
 
 async def all_coins_and_unspents(storage):
     """
-    Query the ledger sim instance for all coins and unspents.
+    Return the coins storage has seen, and their unspents.
     """
     coins = []
     unspents = []
-    coin_name_unspent_pairs = [_ async for _ in storage.all_unspents()]
-    for coin_name, unspent in coin_name_unspent_pairs:
-        preimage = await storage.hash_preimage(hash=coin_name)
-        coin = Coin.from_bytes(preimage)
-        unspents.append(unspent)
+    async for coin, unspent in storage.coins_and_unspents():
         coins.append(coin)
+        unspents.append(unspent)
     return coins, unspents
 
 
-async def do_sync(wallet, storage):
+async def do_sync(wallet, storage, watcher):
     """
     Fetch the most recent blocks from the ledger sim instance
     and troll through them looking for relevant puzzle hashes.
     """
-    storage.add_interested_puzzle_hashes(
-        wallet.puzzle_hash_for_index(_) for _ in range(GAP_LIMIT)
-    )
+    await watcher.ready()
     r = await storage.sync()
+    wallet.save_puzzle_hashes()
     noun = "block" if r == 1 else "blocks"
     print(f"{r} new {noun} loaded")
 
-    coins, unspents = await all_coins_and_unspents(storage)
-    print(f"Coin count: {len(coins)}")
-    for coin, unspent in zip(coins, unspents):
-        if unspent.spent_block_index == 0:
-            print(
-                f"{coin.name().hex()}  {coin.amount:12}  {unspent.confirmed_block_index:4}"
-            )
+    coins_and_unspents = [_ async for _ in storage.coins_and_unspents(unspent_only=True)]
+    print(f"Coin count: {len(coins_and_unspents)}")
+    for coin, unspent in coins_and_unspents:
+        print(
+            f"{coin.name().hex()}  {coin.amount:12}  {unspent.confirmed_block_index:4}"
+        )
 
 
-async def menu(wallet, storage, input):
+async def menu(wallet, storage, watcher, input):
     """
     UI for the main menu.
     """
@@ -382,11 +520,11 @@ async def menu(wallet, storage, input):
     print("q. Quit")
     choice = input("> ")
     if choice == "1":
-        await do_generate_address(wallet, storage, input)
+        await do_generate_address(wallet, storage, watcher, input)
     if choice == "2":
         await do_spend_coin(wallet, storage, input)
     if choice == "3":
-        await do_sync(wallet, storage)
+        await do_sync(wallet, storage, watcher)
     return choice != "q"
 
 
@@ -395,15 +533,22 @@ async def main_loop(path, storage=None, input=input):
     async version of main
     """
     if storage is None:
-        storage = Storage("junk path", await ledger_sim_proxy())
+        storage = Storage(coin_store_path(path), await ledger_sim_proxy())
 
     if not path.exists():
         create_wallet(path, input)
     wallet = load_wallet(path)
-    while True:
-        should_continue = await menu(wallet, storage, input)
-        if not should_continue:
-            break
+    watcher = LookaheadWatcher(wallet, storage)
+    # derive the lookahead while the menu is up, instead of before
+    watcher.start()
+    try:
+        while True:
+            should_continue = await menu(wallet, storage, watcher, input)
+            if not should_continue:
+                break
+    finally:
+        await watcher.close()
+        wallet.close()
 
 
 def main(path=Path("multisig-wallet.json"), input=input):
@@ -1,22 +1,66 @@
-import pkg_resources
+"""
+Load compiled clvm
+
+`python setup.py build_clvm` compiles each .clvm file in this package to a
+.clvm.hex file next to it. load_clvm parses one the first time it's asked
+for and keeps the Program for the rest of the process, so modules can refer
+to their clvm without paying for it at import.
+
+If a .clvm.bin file with the serialized program is next to the .hex, and
+no older than it, it's read instead to skip the hex decoding. load_clvm
+writes one when asked to with keep_binary.
+"""
+
+import importlib.resources
 import os
 import sys
 
+from pathlib import Path
+
 from chiasim.hashable import Program
 
 
+_programs = {}  # {filename: Program}
+
+
 def path_list_for_filename(filename):
-    yield pkg_resources.resource_filename(__name__, "%s.hex" % filename)
-    yield "%s/%s.hex" % (sys.prefix, filename)
+    resource = "%s.hex" % filename
+    if importlib.resources.is_resource(__package__, resource):
+        with importlib.resources.path(__package__, resource) as path:
+            yield path
+    yield Path(sys.prefix, resource)
 
     # TODO: try to compile it
 
 
-def load_clvm(filename):
-    for p in path_list_for_filename(filename):
-        if os.path.isfile(p):
-            break
+def binary_path(hex_path):
+    return hex_path.with_suffix(".bin")
+
 
-    clvm_hex = open(p, "rt").read()
-    clvm_blob = bytes.fromhex(clvm_hex)
+def read_clvm(hex_path, keep_binary=False):
+    bin_path = binary_path(hex_path)
+    if bin_path.is_file() and bin_path.stat().st_mtime >= hex_path.stat().st_mtime:
+        return Program.from_bytes(bin_path.read_bytes())
+    clvm_blob = bytes.fromhex(hex_path.read_text())
+    if keep_binary:
+        temp_path = bin_path.with_name("%s.%d" % (bin_path.name, os.getpid()))
+        try:
+            temp_path.write_bytes(clvm_blob)
+            os.replace(temp_path, bin_path)
+        except OSError:
+            # e.g. a read-only install; the hex still works
+            pass
     return Program.from_bytes(clvm_blob)
+
+
+def load_clvm(filename, keep_binary=False):
+    program = _programs.get(filename)
+    if program is None:
+        for path in path_list_for_filename(filename):
+            if path.is_file():
+                break
+        else:
+            raise FileNotFoundError("%s.hex not found, run `python setup.py build_clvm`" % filename)
+        program = read_clvm(path, keep_binary)
+        _programs[filename] = program
+    return program
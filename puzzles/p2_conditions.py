@@ -8,6 +8,10 @@ in bitcoin.
 This is a pretty useless most of the time. But some (most?) solutions
 require a delegated puzzle program, so in those cases, this is just what
 the doctor ordered.
+
+puzzle_for_conditions and solution_for_conditions build what CONTRACT
+returns directly, without running it: the puzzle is (q conditions) and the
+solution is ((q conditions) ()).
 """
 
 from clvm_tools import binutils
@@ -41,6 +45,8 @@ def make_contract():
 
 CONTRACT = make_contract()
 
+QUOTE_KEYWORD = binutils.assemble("#q")
+
 
 def puzzle_for_contract(contract, puzzle_parameters):
     env = Program.to([]).cons(Program.to(puzzle_parameters))
@@ -56,8 +62,16 @@ def solution_for_contract(contract, puzzle_parameters, solution_parameters):
 
 
 def puzzle_for_conditions(conditions):
-    return puzzle_for_contract(CONTRACT, conditions)
+    return Program.to([QUOTE_KEYWORD, conditions])
 
 
 def solution_for_conditions(conditions):
-    return solution_for_contract(CONTRACT, conditions, [])
+    return Program.to([[QUOTE_KEYWORD, conditions], []])
+
+
+def puzzles_for_conditions(conditions_list):
+    return [puzzle_for_conditions(_) for _ in conditions_list]
+
+
+def solutions_for_conditions(conditions_list):
+    return [solution_for_conditions(_) for _ in conditions_list]
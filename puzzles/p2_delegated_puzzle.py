@@ -12,19 +12,24 @@ you can use p2_conditions.
 This roughly corresponds to bitcoin's graftroot.
 """
 
-from clvm_tools import binutils
-
 from chiasim.hashable import Program
 from chiasim.validation.Conditions import ConditionOpcode
 
 from . import p2_conditions
+from .puzzle_template import PuzzleTemplate
+
+
+AGGSIG = ConditionOpcode.AGG_SIG[0]
+TEMPLATE = PuzzleTemplate(f"(c (c (q {AGGSIG}) (c (q {{public_key}}) (c (sha256tree (f (a))) (q ())))) "
+                          f"((c (f (a)) (f (r (a))))))")
 
 
 def puzzle_for_pk(public_key):
-    aggsig = ConditionOpcode.AGG_SIG[0]
-    TEMPLATE = (f"(c (c (q {aggsig}) (c (q 0x%s) (c (sha256tree (f (a))) (q ())))) "
-                f"((c (f (a)) (f (r (a))))))")
-    return Program.to(binutils.assemble(TEMPLATE % public_key.hex()))
+    return TEMPLATE.puzzle(public_key=public_key)
+
+
+def puzzle_hash_for_pk(public_key):
+    return TEMPLATE.puzzle_hash(public_key=public_key)
 
 
 def solution_for_conditions(puzzle_reveal, conditions):
@@ -12,9 +12,18 @@ If the hidden puzzle path is taken, the hidden puzzle and original public key wi
 which proves that it was hidden there in the first place.
 
 This roughly corresponds to bitcoin's taproot.
+
+The synthetic public key is computed with blspy rather than by running clvm,
+and kept per (public key, hidden puzzle hash), so deriving many taproot
+puzzle hashes costs one point multiplication and addition per key. The
+hidden puzzle hash is the puzzle's own (sha256tree hidden_puzzle), run once
+per hidden puzzle.
 """
+import functools
 import hashlib
 
+import blspy
+
 from clvm.casts import int_from_bytes
 
 from clvm_tools import binutils
@@ -23,12 +32,27 @@ from chiasim.hashable import Program
 from chiasim.utils.run_program import run_program
 
 from .load_clvm import load_clvm
+from .puzzle_template import PuzzleTemplate
 
 
 DEFAULT_HIDDEN_PUZZLE = binutils.assemble("(x)")
 
 
-puzzle_prog_template = load_clvm("make_p2_delegated_puzzle_or_hidden_puzzle.clvm")
+PUZZLE_CLVM = "make_p2_delegated_puzzle_or_hidden_puzzle.clvm"
+
+
+def __getattr__(name):
+    if name == "puzzle_prog_template":
+        return load_clvm(PUZZLE_CLVM)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+GROUP_ORDER = 0x73EDA753299D7D483339D80809A1D80553BDA402FFFE5BFEFFFFFFFF00000001
+
+
+TEMPLATE = PuzzleTemplate(
+    lambda: "((c (q %s) (c (q {synthetic_public_key}) (a))))" % binutils.disassemble(load_clvm(PUZZLE_CLVM)),
+    ["synthetic_public_key"])
 
 
 def run(program, args):
@@ -42,22 +66,47 @@ def calculate_synthetic_offset(public_key, hidden_puzzle_hash):
     return int_from_bytes(blob)
 
 
+@functools.lru_cache(maxsize=65536)
+def synthetic_public_key_for_hash(public_key, hidden_puzzle_hash):
+    """
+    The same as
+    (point_add public_key (pubkey_for_exp (sha256 public_key hidden_puzzle_hash)))
+    in clvm. public_key is bytes.
+    """
+    offset = calculate_synthetic_offset(public_key, hidden_puzzle_hash) % GROUP_ORDER
+    offset_key = blspy.PrivateKey.from_bytes(offset.to_bytes(32, "big")).get_public_key()
+    synthetic_key = blspy.PublicKey.aggregate_insecure([blspy.PublicKey.from_bytes(public_key), offset_key])
+    return synthetic_key.serialize()
+
+
+@functools.lru_cache(maxsize=1024)
+def _hidden_puzzle_hash_for_blob(hidden_puzzle_blob):
+    return run("(sha256tree (a))", Program.from_bytes(hidden_puzzle_blob))
+
+
+def hidden_puzzle_hash(hidden_puzzle):
+    """
+    Return the hash the puzzle checks the hidden puzzle against, which is
+    its tree hash rather than the hash of its serialization.
+    """
+    return _hidden_puzzle_hash_for_blob(bytes(Program(hidden_puzzle)))
+
+
 def calculate_synthetic_public_key(public_key, hidden_puzzle):
-    args = (public_key, hidden_puzzle)
-    r = run(
-        "(point_add (f (a)) (pubkey_for_exp (sha256 (f (a)) (sha256tree (r (a))))))",
-        args,
-    )
-    return r
+    return synthetic_public_key_for_hash(bytes(public_key), hidden_puzzle_hash(hidden_puzzle))
+
+
+def synthetic_public_keys(public_key_list, hidden_puzzle=DEFAULT_HIDDEN_PUZZLE):
+    puzzle_hash = hidden_puzzle_hash(hidden_puzzle)
+    return [synthetic_public_key_for_hash(bytes(_), puzzle_hash) for _ in public_key_list]
 
 
 def puzzle_for_synthetic_public_key(synthetic_public_key):
-    puzzle_src = "((c (q %s) (c (q 0x%s) (a))))" % (
-        binutils.disassemble(puzzle_prog_template),
-        synthetic_public_key.hex(),
-    )
-    puzzle_prog = binutils.assemble(puzzle_src)
-    return Program(puzzle_prog)
+    return TEMPLATE.puzzle(synthetic_public_key=synthetic_public_key)
+
+
+def puzzle_hash_for_synthetic_public_key(synthetic_public_key):
+    return TEMPLATE.puzzle_hash(synthetic_public_key=synthetic_public_key)
 
 
 def puzzle_for_public_key_and_hidden_puzzle(
@@ -68,6 +117,14 @@ def puzzle_for_public_key_and_hidden_puzzle(
     return puzzle_for_synthetic_public_key(synthetic_public_key)
 
 
+def puzzle_hashes_for_public_keys(public_key_list, hidden_puzzle=DEFAULT_HIDDEN_PUZZLE):
+    """
+    Return the puzzle hash for each public key with the same hidden puzzle,
+    e.g. for a run of HD wallet children.
+    """
+    return [puzzle_hash_for_synthetic_public_key(_) for _ in synthetic_public_keys(public_key_list, hidden_puzzle)]
+
+
 def solution_with_delegated_puzzle(synthetic_public_key, delegated_puzzle, solution):
     puzzle = puzzle_for_synthetic_public_key(synthetic_public_key)
     return Program.to([puzzle, [[], delegated_puzzle, solution]])
@@ -10,18 +10,31 @@ from chiasim.hashable import Program
 from clvm_tools import binutils
 
 from .load_clvm import load_clvm
+from .puzzle_template import PuzzleTemplate
 
 
-puzzle_prog_template = load_clvm("make_puzzle_m_of_n_direct.clvm")
+PUZZLE_CLVM = "make_puzzle_m_of_n_direct.clvm"
+
+
+def __getattr__(name):
+    if name == "puzzle_prog_template":
+        return load_clvm(PUZZLE_CLVM)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def puzzle_source():
+    return "((c (q %s) (c (q {m}) (c (q {public_key_list}) (a)))))" % binutils.disassemble(load_clvm(PUZZLE_CLVM))
+
+
+TEMPLATE = PuzzleTemplate(puzzle_source, ["m", "public_key_list"])
 
 
 def puzzle_for_m_of_public_key_list(m, public_key_list):
-    format_tuple = tuple(
-        binutils.disassemble(Program.to(_))
-        for _ in (puzzle_prog_template, m, public_key_list))
-    puzzle_src = "((c (q %s) (c (q %s) (c (q %s) (a)))))" % format_tuple
-    puzzle_prog = binutils.assemble(puzzle_src)
-    return Program.to(puzzle_prog)
+    return TEMPLATE.puzzle(m=m, public_key_list=public_key_list)
+
+
+def puzzle_hash_for_m_of_public_key_list(m, public_key_list):
+    return TEMPLATE.puzzle_hash(m=m, public_key_list=public_key_list)
 
 
 def solution_for_delegated_puzzle(m, public_key_list, selectors, puzzle, solution):
@@ -5,10 +5,10 @@ In this puzzle program, the solution must be a reveal of the puzzle with the giv
 hash along with its solution.
 """
 
-from clvm_tools import binutils
-
 from chiasim.hashable import Program, ProgramHash
 
+from .puzzle_template import PuzzleTemplate
+
 
 """
 solution: (puzzle_reveal . solution_to_puzzle)
@@ -21,9 +21,16 @@ solution: (puzzle_reveal . solution_to_puzzle)
 """
 
 
+TEMPLATE = PuzzleTemplate(
+    "((c (i (= (sha256tree (f (a))) (q {puzzle_hash})) (q ((c (f (a)) (f (r (a)))))) (q (x))) (a)))")
+
+
 def puzzle_for_puzzle_hash(underlying_puzzle_hash):
-    TEMPLATE = "((c (i (= (sha256tree (f (a))) (q 0x%s)) (q ((c (f (a)) (f (r (a)))))) (q (x))) (a)))"
-    return Program(binutils.assemble(TEMPLATE % underlying_puzzle_hash.hex()))
+    return TEMPLATE.puzzle(puzzle_hash=underlying_puzzle_hash)
+
+
+def puzzle_hash_for_puzzle_hash(underlying_puzzle_hash):
+    return TEMPLATE.puzzle_hash(puzzle_hash=underlying_puzzle_hash)
 
 
 def solution_for_puzzle_and_solution(underlying_puzzle, underlying_solution):
@@ -5,101 +5,172 @@ In this puzzle program, there is a binary tree of depth N
 containing K <= 2^N puzzles. We reveal a path to one of them,
 and then solve it.
 
+The solution is (puzzle_reveal proof solution), where proof lists the
+siblings on the path from the puzzle's hash up to the root as
+(is_right sibling_hash) pairs, is_right being 1 when the path comes up from
+the right hand child. The puzzle hashes its way up the path, checks it
+arrives at the committed root, and runs the puzzle reveal with its solution.
 
+Leaves are hashed as sha256(0x01 + puzzle_hash) and nodes as
+sha256(0x02 + left + right), so a node can't pass for a leaf. A level with
+an odd number of nodes moves its last node up a level as it is, so the
+trees for [a, b, c] and [a, b, c, c] have different roots.
 
 This roughly corresponds to bitcoin's MAST.
 """
 
-from clvm_tools import binutils
+import hashlib
 
-from chiasim.atoms import hexbytes
-from chiasim.hashable import Program
+from chiasim.hashable import Program, ProgramHash
 
+from .puzzle_template import PuzzleTemplate
 
-def position_to_index(position, depth):
-    s = bin(position)[2:]
-    s += ("0" * depth) + s
-    s = s[-depth:]
-    s = "".join(list(reversed(s)))
-    return int(s, 2)
 
+LEAF_PREFIX = bytes([1])
+NODE_PREFIX = bytes([2])
 
-def solution_tree_for_position(tree, position, hash_f):
-    if isinstance(tree, bytes):
-        return tree
-    next_position = position >> 1
-    if next_position + next_position != position:
-        left = hash_tree(tree[0], hash_f)
-        right = solution_tree_for_position(tree[1], position >> 1, hash_f)
-    else:
-        left = solution_tree_for_position(tree[0], position >> 1, hash_f)
-        right = hash_tree(tree[1], hash_f)
-    return (left, right)
 
+def hash_f(blob):
+    return hashlib.sha256(blob).digest()
 
-def list_to_tree(items):
-    size = len(items)
-    if size == 1:
-        return items[0], 0
-    if size & 1:
-        items.append(items[-1])
-        size += 1
-    halfway_index = size >> 1
-    left_node, left_height = list_to_tree(items[:halfway_index])
-    right_node, right_height = list_to_tree(items[halfway_index:])
-    return (left_node, right_node), max(left_height, right_height) + 1
 
+# env is (loop node_hash proof), returns the root hash
+ROOT_LOOP = ("((c (i (f (r (r (a)))) "
+             "(q ((c (f (a)) (c (f (a)) (c "
+             "((c (i (f (f (f (r (r (a)))))) "
+             "(q (sha256 (q 0x02) (f (r (f (f (r (r (a))))))) (f (r (a))))) "
+             "(q (sha256 (q 0x02) (f (r (a))) (f (r (f (f (r (r (a)))))))))) (a))) "
+             "(c (r (f (r (r (a))))) (q ()))))))) "
+             "(q (f (r (a))))) (a)))")
 
-def hash_tree(tree, hash_f):
-    if isinstance(tree, bytes):
-        return tree
-    left = hash_tree(tree[0], hash_f)
-    right = hash_tree(tree[1], hash_f)
-    return hash_f(left + right)
+TEMPLATE = PuzzleTemplate(
+    "((c (i (= ((c (q ((c (f (a)) (a)))) (c (q %s) (c (sha256 (q 0x01) (sha256tree (f (a)))) "
+    "(c (f (r (a))) (q ())))))) (q {root})) "
+    "(q ((c (f (a)) (f (r (r (a))))))) (q (x))) (a)))" % ROOT_LOOP)
 
 
-def puzzle_for_tree_hash(tree_hash):
-    TEMPLATE = """
-        (q 0x%s)
+class MerkleTree:
+    """
+    A merkle tree of leaf hashes, kept level by level in one flat list:
+    the hashed leaves, then their parents, and so on up to the root. A
+    level with an odd number of nodes moves its last node up as it is.
     """
-    return Program(binutils.assemble(TEMPLATE % hexbytes(tree_hash)))
 
+    def __init__(self, leaves, hash_f=hash_f):
+        if not leaves:
+            raise ValueError("a merkle tree needs at least one leaf")
+        self._leaves = [bytes(_) for _ in leaves]
+        self._nodes = [hash_f(LEAF_PREFIX + _) for _ in self._leaves]
+        self._level_starts = [0]
+        start, size = 0, len(self._nodes)
+        while size > 1:
+            for index in range(start, start + size, 2):
+                if index + 1 < start + size:
+                    self._nodes.append(hash_f(NODE_PREFIX + self._nodes[index] + self._nodes[index + 1]))
+                else:
+                    self._nodes.append(self._nodes[index])
+            self._level_starts.append(start + size)
+            start, size = start + size, (size + 1) >> 1
+        self._leaf_indexes = None
+
+    def __len__(self):
+        return len(self._leaves)
+
+    def depth(self):
+        return len(self._level_starts) - 1
+
+    def root(self):
+        return self._nodes[-1]
+
+    def leaf(self, index):
+        return self._leaves[index]
+
+    def index(self, leaf):
+        """
+        Return the index of leaf, or None if it isn't in the tree.
+        """
+        if self._leaf_indexes is None:
+            self._leaf_indexes = {}
+            for index in reversed(range(len(self))):
+                self._leaf_indexes[self._leaves[index]] = index
+        return self._leaf_indexes.get(bytes(leaf))
+
+    def proof(self, index):
+        """
+        Return the path from the leaf at index to the root as a list of
+        (is_right, sibling_hash) pairs, leaf end first. A node moved up
+        without a sibling adds no step.
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("no leaf %d in a tree of %d" % (index, len(self)))
+        proof = []
+        for level in range(self.depth()):
+            start, end = self._level_starts[level], self._level_starts[level + 1]
+            sibling = index ^ 1
+            if start + sibling < end:
+                proof.append((index & 1, self._nodes[start + sibling]))
+            index >>= 1
+        return proof
+
+    def proofs(self, indexes):
+        """
+        Return {index: proof} for many leaves. Paths that meet share their
+        proof from there to the root.
+        """
+        proofs = {}
+        paths = {}  # {node index on this level: [leaf indexes whose path goes through it]}
+        for index in indexes:
+            if not 0 <= index < len(self):
+                raise IndexError("no leaf %d in a tree of %d" % (index, len(self)))
+            proofs[index] = []
+            paths.setdefault(index, []).append(index)
+        for level in range(self.depth()):
+            start, end = self._level_starts[level], self._level_starts[level + 1]
+            parents = {}
+            for node, leaves in paths.items():
+                sibling = node ^ 1
+                if start + sibling < end:
+                    step = (node & 1, self._nodes[start + sibling])
+                    for leaf in leaves:
+                        proofs[leaf].append(step)
+                parents.setdefault(node >> 1, []).extend(leaves)
+            paths = parents
+        return proofs
+
+
+def root_for_proof(leaf, proof, hash_f=hash_f):
+    node = hash_f(LEAF_PREFIX + bytes(leaf))
+    for is_right, sibling in proof:
+        node = hash_f(NODE_PREFIX + sibling + node) if is_right else hash_f(NODE_PREFIX + node + sibling)
+    return node
+
+
+def hash_tree(puzzle_hash_list, hash_f=hash_f):
+    return MerkleTree(puzzle_hash_list, hash_f).root()
 
-def puzzle_for_puzzle_hashes(puzzle_hash_list):
-    tree, levels = list_to_tree(puzzle_hash_list)
-    top_level_hash = hash_tree(tree)
-    return puzzle_for_tree_hash(top_level_hash)
 
+def puzzle_for_tree_hash(tree_hash):
+    return TEMPLATE.puzzle(root=tree_hash)
 
-def solution_for_position(solution_tree, puzzle_reveal, solution):
-    pass
 
+def puzzle_hash_for_tree_hash(tree_hash):
+    return TEMPLATE.puzzle_hash(root=tree_hash)
 
-def is_in_tree(v, tree):
-    if isinstance(tree, bytes):
-        return v == tree
-    return any(is_in_tree(v, tree[_]) for _ in [0, 1])
 
+def puzzle_for_puzzle_hashes(puzzle_hash_list):
+    return puzzle_for_tree_hash(hash_tree(puzzle_hash_list))
 
-def main():
-    from chiasim.hashable.Hash import std_hash
 
-    COUNT = 61
-    hashes = [std_hash(_.to_bytes(8, "big")) for _ in range(COUNT)]
-    breakpoint()
-    tree, depth = list_to_tree(hashes)
-    print(tree)
-    the_hash = hash_tree(tree, std_hash)
-    print(the_hash)
-    for _ in range(COUNT):
-        index = position_to_index(_, depth)
-        subtree = solution_tree_for_position(tree, index, std_hash)
-        print("looking for %s" % hashes[_])
-        print("%d [%d]: %s\n" % (_, index, subtree))
-        solution_hash = hash_tree(subtree, std_hash)
-        assert solution_hash == the_hash
-        assert is_in_tree(hashes[_], subtree)
+def solution_for_proof(proof, puzzle_reveal, solution):
+    return Program.to([puzzle_reveal, [[is_right, sibling] for is_right, sibling in proof], solution])
 
 
-if __name__ == "__main__":
-    main()
+def solution_for_puzzle(tree, puzzle_reveal, solution):
+    """
+    Return the solution spending a coin locked to tree's root by running
+    puzzle_reveal, which must be one of the leaves, with solution.
+    """
+    index = tree.index(ProgramHash(puzzle_reveal))
+    if index is None:
+        raise ValueError("puzzle isn't in the tree")
+    return solution_for_proof(tree.proof(index), puzzle_reveal, solution)
@@ -0,0 +1,133 @@
+"""
+Puzzle templates
+
+Most puzzles are a fixed program with a few atoms filled in, such as public
+keys, puzzle hashes and amounts. Building one by formatting clvm source and
+assembling it parses the whole program every time, and hashing it
+serializes the whole program again.
+
+A PuzzleTemplate assembles its source once, with a unique placeholder atom
+in each parameter slot, and splits the serialized program around the
+placeholders. Serialization is a pre-order walk of the tree, so a puzzle is
+just the serialized parameter atoms spliced between those fixed segments,
+and its puzzle hash is the sha256 of that, continued from the saved hash
+state of the first segment. Neither needs the program to be built.
+"""
+
+import hashlib
+import re
+import string
+
+from clvm_tools import binutils
+
+from chiasim.hashable import Program, ProgramHash
+
+
+def atom_blob(value):
+    """
+    Return the serialization of a parameter. value is an int, a hex string
+    (with or without 0x), a list of parameters or anything bytes() accepts.
+    """
+    if isinstance(value, int):
+        return bytes(Program.to(value))
+    if isinstance(value, str):
+        value = bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    if isinstance(value, (list, tuple)):
+        return bytes(Program.to(list(value)))
+    return bytes(Program.to(bytes(value)))
+
+
+def atom_source(value):
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, str):
+        return value if value.startswith("0x") else f"0x{value}"
+    if isinstance(value, (list, tuple)):
+        return binutils.disassemble(Program.to(list(value)))
+    return f"0x{bytes(value).hex()}"
+
+
+class PuzzleTemplate:
+    """
+    source is clvm with {name} wherever the atom for parameter name goes,
+    e.g. "(c (q {pubkey}) (q ()))". A parameter can also be a list, which
+    is spliced in as a subtree where the atom would be. The source is
+    assembled the first time the template is used. It can be a function
+    returning the source, which isn't called until then if the parameter
+    names are given too.
+    """
+
+    def __init__(self, source, parameters=None):
+        self._source = source
+        self._names = list(parameters) if parameters is not None else self._parameters_in(self.source())
+        self._segments = None
+
+    def _parameters_in(self, source):
+        names = []
+        for _, name, _, _ in string.Formatter().parse(source):
+            if name is not None and name not in names:
+                names.append(name)
+        return names
+
+    def source(self):
+        return self._source() if callable(self._source) else self._source
+
+    def parameters(self):
+        return list(self._names)
+
+    def _placeholder(self, name):
+        return hashlib.sha256(b"puzzle template parameter " + name.encode()).digest()
+
+    def _compile(self):
+        placeholders = {name: self._placeholder(name) for name in self._names}
+        source = self.source().format(**{name: atom_source(_) for name, _ in placeholders.items()})
+        blob = bytes(Program(binutils.assemble(source)))
+        slot_names = {atom_blob(_): name for name, _ in placeholders.items()}
+        pattern = re.compile(b"|".join(re.escape(_) for _ in slot_names))
+        segments = []
+        slots = []
+        start = 0
+        for match in (pattern.finditer(blob) if slot_names else []):
+            segments.append(blob[start:match.start()])
+            slots.append(slot_names[match.group()])
+            start = match.end()
+        segments.append(blob[start:])
+        missing = set(self._names) - set(slots)
+        if missing:
+            raise ValueError(f"parameters {sorted(missing)} don't appear as atoms in the template")
+        self._slots = slots
+        self._segments = segments
+        self._first_hash = hashlib.sha256(segments[0])
+
+    def _blobs(self, values):
+        if self._segments is None:
+            self._compile()
+        if set(values) != set(self._names):
+            raise TypeError(f"expected parameters {self._names}, got {sorted(values)}")
+        return {name: atom_blob(value) for name, value in values.items()}
+
+    def serialize(self, **values):
+        blobs = self._blobs(values)
+        parts = [self._segments[0]]
+        for slot, segment in zip(self._slots, self._segments[1:]):
+            parts.append(blobs[slot])
+            parts.append(segment)
+        return b"".join(parts)
+
+    def puzzle(self, **values):
+        return Program.from_bytes(self.serialize(**values))
+
+    def puzzle_hash(self, **values):
+        blobs = self._blobs(values)
+        h = self._first_hash.copy()
+        for slot, segment in zip(self._slots, self._segments[1:]):
+            h.update(blobs[slot])
+            h.update(segment)
+        return ProgramHash(h.digest())
+
+    def assemble(self, **values):
+        """
+        Build the puzzle from source, the slow way.
+        """
+        source = self.source().format(**{name: atom_source(_) for name, _ in values.items()})
+        return Program(binutils.assemble(source))
@@ -1,5 +1,8 @@
 from chiasim.atoms import hexbytes
 from standard_wallet.wallet import *
+from standard_wallet.coin_selection import select_coins
+from standard_wallet.seen_coins import SeenCoins
+from utilities.signing_pool import SIGN_SOLUTION_HASH
 import clvm
 from chiasim.hashable import Program, ProgramHash, CoinSolution, SpendBundle, BLSSignature
 from binascii import hexlify
@@ -7,11 +10,14 @@ from chiasim.hashable.Coin import Coin
 from chiasim.hashable.CoinSolution import CoinSolutionList
 from clvm_tools import binutils
 from chiasim.validation.Conditions import ConditionOpcode
-from puzzles.p2_delegated_puzzle import puzzle_for_pk
+from puzzles.p2_delegated_puzzle import puzzle_for_pk, puzzle_hash_for_pk
+from puzzles.puzzle_template import PuzzleTemplate
 import math
 
 # RLWallet is subclass of Wallet
 class RLWallet(Wallet):
+    rl_template = None
+
     def __init__(self):
         self.aggregation_coins = set()
         self.rl_parent = None
@@ -19,12 +25,13 @@ class RLWallet(Wallet):
         self.interval = 0
         self.limit = 0
         self.rl_origin = None
+        self.rl_origin_coin = None
         self.pubkey_orig = None
         self.current_rl_balance = 0
         self.rl_index = 0
         self.tip_index = 0
-        self.all_rl_additions = {}
-        self.all_rl_deletions = {}
+        self.seen_rl_additions = SeenCoins()
+        self.seen_rl_deletions = SeenCoins()
         self.rl_clawback_pk = None
         self.clawback_limit = 0
         self.clawback_interval = 0
@@ -43,6 +50,7 @@ class RLWallet(Wallet):
         else:
             self.rl_origin = origin["name"]
         self.rl_parent = origin
+        self.rl_origin_coin = origin
 
     def rl_available_balance(self):
         if self.rl_coin is None:
@@ -52,8 +60,21 @@ class RLWallet(Wallet):
         available_amount = min(unlocked, total_amount)
         return available_amount
 
+    def clear_coins(self):
+        super().clear_coins()
+        self.aggregation_coins = set()
+        self.rl_coin = None
+        if self.rl_origin_coin is not None:
+            self.set_origin(self.rl_origin_coin)
+        self.current_rl_balance = 0
+        self.rl_index = 0
+        self.tip_index = 0
+        self.seen_rl_additions = SeenCoins()
+        self.seen_rl_deletions = SeenCoins()
+        self.latest_clawback_coin = None
+
     def notify(self, additions, deletions, index):
-        super().notify(additions, deletions)
+        super().notify(additions, deletions, index)
         self.tip_index = index
         self.rl_notify(additions, deletions, index)
         spend_bundle_list = self.ac_notify(additions)
@@ -61,13 +82,15 @@ class RLWallet(Wallet):
 
     def rl_notify(self, additions, deletions, index):
         for coin in additions:
-            if coin.name() in self.all_rl_additions:
+            if coin.name() in self.seen_rl_additions:
                 continue
             if coin.puzzle_hash == self.clawback_puzzlehash:
                 self.latest_clawback_coin = coin
                 continue
-            self.all_rl_additions[coin.name()] = coin
-            if self.can_generate_rl_puzzle_hash(coin.puzzle_hash):
+            mine = self.can_generate_rl_puzzle_hash(coin.puzzle_hash)
+            if not self.seen_rl_additions.add(coin.name(), index, keep=mine):
+                continue
+            if mine:
                 self.current_rl_balance += coin.amount
                 if self.rl_coin:
                     self.rl_parent = self.rl_coin
@@ -78,10 +101,10 @@ class RLWallet(Wallet):
         for coin in deletions:
             if self.rl_coin is None:
                 break
-            if coin.name() in self.all_rl_deletions:
+            mine = coin.puzzle_hash == self.rl_coin.puzzle_hash
+            if not self.seen_rl_deletions.add(coin.name(), index, keep=mine):
                 continue
-            self.all_rl_deletions[coin.name()] = coin
-            if coin.puzzle_hash == self.rl_coin.puzzle_hash:
+            if mine:
                 self.current_rl_balance -= coin.amount
                 if self.current_rl_balance == 0:
                     self.rl_coin = None
@@ -111,9 +134,9 @@ class RLWallet(Wallet):
             return None
         if self.rl_clawback_pk is None:
             return None
-        return any(map(lambda child: hash == ProgramHash(self.rl_puzzle_for_pk(
+        return any(map(lambda child: hash == self.rl_puzzle_hash_for_pk(
             bytes(self.extended_secret_key.public_child(child)), self.limit, self.interval,
-            self.rl_origin, self.rl_clawback_pk)),
+            self.rl_origin, self.rl_clawback_pk),
                        reversed(range(self.next_address))))
 
     # Solution to this puzzle must be in format:
@@ -125,39 +148,53 @@ class RLWallet(Wallet):
     # MIN_BLOCK_AGE = V / (M / N)
     # if not (min_block_age * M >=  V * N) do X (raise)
     # ASSERT_COIN_BLOCK_AGE_EXCEEDS min_block_age
-    def rl_puzzle_for_pk(self, pubkey, rate_amount, interval_time, origin_id, clawback_pk):
-        hex_pk = hexbytes(pubkey)
-        #breakpoint()
+    def rl_puzzle_source(self):
         opcode_aggsig = hexlify(ConditionOpcode.AGG_SIG).decode('ascii')
         opcode_coin_block_age = hexlify(ConditionOpcode.ASSERT_BLOCK_AGE_EXCEEDS).decode('ascii')
         opcode_create = hexlify(ConditionOpcode.CREATE_COIN).decode('ascii')
         opcode_myid = hexlify(ConditionOpcode.ASSERT_MY_COIN_ID).decode('ascii')
-        if (not origin_id):
-            return None
 
         TEMPLATE_MY_PARENT_ID = "(sha256 (f (r (r (r (r (r (r (a)))))))) (f (r (a))) (f (r (r (r (r (r (r (r (a))))))))))"
-        TEMPLATE_SINGLETON_RL = f"((c (i (i (= {TEMPLATE_MY_PARENT_ID} (f (a))) (q 1) (= (f (a)) (q 0x{origin_id}))) (q (c (q 1) (q ()))) (q (x (q \"Parent doesnt satisfy RL conditions\")))) (a)))"
-        TEMPLATE_BLOCK_AGE = f"((c (i (i (= (* (f (r (r (r (r (r (a))))))) (q {rate_amount})) (* (f (r (r (r (r (a)))))) (q {interval_time}))) (q 1) (q (> (* (f (r (r (r (r (r (a))))))) (q {rate_amount})) (* (f (r (r (r (r (a))))))) (q {interval_time})))) (q (c (q 0x{opcode_coin_block_age}) (c (f (r (r (r (r (r (a))))))) (q ())))) (q (x (q \"wrong min block time\")))) (a) ))"
+        TEMPLATE_SINGLETON_RL = f"((c (i (i (= {TEMPLATE_MY_PARENT_ID} (f (a))) (q 1) (= (f (a)) (q {{origin_id}}))) (q (c (q 1) (q ()))) (q (x (q \"Parent doesnt satisfy RL conditions\")))) (a)))"
+        TEMPLATE_BLOCK_AGE = f"((c (i (i (= (* (f (r (r (r (r (r (a))))))) (q {{rate_amount}})) (* (f (r (r (r (r (a)))))) (q {{interval_time}}))) (q 1) (q (> (* (f (r (r (r (r (r (a))))))) (q {{rate_amount}})) (* (f (r (r (r (r (a))))))) (q {{interval_time}})))) (q (c (q 0x{opcode_coin_block_age}) (c (f (r (r (r (r (r (a))))))) (q ())))) (q (x (q \"wrong min block time\")))) (a) ))"
         TEMPLATE_MY_ID = f"(c (q 0x{opcode_myid}) (c (sha256 (f (a)) (f (r (a))) (f (r (r (a))))) (q ())))"
         CREATE_CHANGE = f"(c (q 0x{opcode_create}) (c (f (r (a))) (c (- (f (r (r (a)))) (f (r (r (r (r (a))))))) (q ()))))"
         CREATE_NEW_COIN = f"(c (q 0x{opcode_create}) (c (f (r (r (r (a))))) (c (f (r (r (r (r (a)))))) (q ()))))"
         RATE_LIMIT_PUZZLE = f"(c {TEMPLATE_SINGLETON_RL} (c {TEMPLATE_BLOCK_AGE} (c {CREATE_CHANGE} (c {TEMPLATE_MY_ID} (c {CREATE_NEW_COIN} (q ()))))))"
 
         TEMPLATE_MY_PARENT_ID_2 = "(sha256 (f (r (r (r (r (r (r (r (r (a)))))))))) (f (r (a))) (f (r (r (r (r (r (r (r (a))))))))))"
-        TEMPLATE_SINGLETON_RL_2 = f"((c (i (i (= {TEMPLATE_MY_PARENT_ID_2} (f (r (r (r (r (r (a)))))))) (q 1) (= (f (r (r (r (r (r (a))))))) (q 0x{origin_id}))) (q (c (q 1) (q ()))) (q (x (q \"Parent doesnt satisfy RL conditions\")))) (a)))"
+        TEMPLATE_SINGLETON_RL_2 = f"((c (i (i (= {TEMPLATE_MY_PARENT_ID_2} (f (r (r (r (r (r (a)))))))) (q 1) (= (f (r (r (r (r (r (a))))))) (q {{origin_id}}))) (q (c (q 1) (q ()))) (q (x (q \"Parent doesnt satisfy RL conditions\")))) (a)))"
         CREATE_CONSOLIDATED = f"(c (q 0x{opcode_create}) (c (f (r (a))) (c (+ (f (r (r (r (r (a)))))) (f (r (r (r (r (r (r (a))))))))) (q ()))))"
         MODE_TWO_ME_STRING = f"(c (q 0x{opcode_myid}) (c (sha256 (f (r (r (r (r (r (a))))))) (f (r (a))) (f (r (r (r (r (r (r (a))))))))) (q ())))"
         CREATE_LOCK = f"(c (q 0x{opcode_create}) (c (sha256tree (c (q 7) (c (c (q 5) (c (c (q 1) (c (sha256 (f (r (r (a)))) (f (r (r (r (a))))) (f (r (r (r (r (a))))))) (q ()))) (c (q (q ())) (q ())))) (q ())))) (c (q 0) (q ()))))"
 
         MODE_TWO = f"(c {TEMPLATE_SINGLETON_RL_2} (c {MODE_TWO_ME_STRING} (c {CREATE_LOCK} (c {CREATE_CONSOLIDATED} (q ())))))"
 
-        AGGSIG_ENTIRE_SOLUTION = f"(c (q 0x{opcode_aggsig}) (c (q 0x{hex_pk}) (c (sha256tree (a)) (q ()))))"
+        AGGSIG_ENTIRE_SOLUTION = f"(c (q 0x{opcode_aggsig}) (c (q {{pubkey}}) (c (sha256tree (a)) (q ()))))"
 
         WHOLE_PUZZLE = f"(c {AGGSIG_ENTIRE_SOLUTION} ((c (i (= (f (a)) (q 1)) (q ((c (q {RATE_LIMIT_PUZZLE}) (r (a))))) (q {MODE_TWO})) (a))) (q ()))"
-        CLAWBACK = f"(c (c (q 0x{opcode_aggsig}) (c (q 0x{clawback_pk}) (c (sha256tree (a)) (q ())))) (r (a)))"
+        CLAWBACK = f"(c (c (q 0x{opcode_aggsig}) (c (q {{clawback_pk}}) (c (sha256tree (a)) (q ())))) (r (a)))"
         WHOLE_PUZZLE_WITH_CLAWBACK = f"((c (i (= (f (a)) (q 3)) (q {CLAWBACK}) (q {WHOLE_PUZZLE})) (a)))"
 
-        return Program(binutils.assemble(WHOLE_PUZZLE_WITH_CLAWBACK))
+        return WHOLE_PUZZLE_WITH_CLAWBACK
+
+    def rl_puzzle_template(self):
+        if RLWallet.rl_template is None:
+            RLWallet.rl_template = PuzzleTemplate(self.rl_puzzle_source())
+        return RLWallet.rl_template
+
+    def rl_puzzle_for_pk(self, pubkey, rate_amount, interval_time, origin_id, clawback_pk):
+        if (not origin_id):
+            return None
+        return self.rl_puzzle_template().puzzle(pubkey=pubkey, rate_amount=rate_amount, interval_time=interval_time,
+                                                origin_id=origin_id, clawback_pk=clawback_pk)
+
+    def rl_puzzle_hash_for_pk(self, pubkey, rate_amount, interval_time, origin_id, clawback_pk):
+        if (not origin_id):
+            return None
+        return self.rl_puzzle_template().puzzle_hash(pubkey=pubkey, rate_amount=rate_amount,
+                                                     interval_time=interval_time, origin_id=origin_id,
+                                                     clawback_pk=clawback_pk)
 
     def rl_make_aggregation_puzzle(self, wallet_puzzle):
         # If Wallet A wants to send further funds to Wallet B then they can lock them up using this code
@@ -208,8 +245,8 @@ class RLWallet(Wallet):
             return s
         for child in reversed(range(self.next_address)):
             pubkey = self.extended_secret_key.public_child(child)
-            if hash == ProgramHash(
-                    self.rl_puzzle_for_pk(bytes(pubkey), self.limit, self.interval, self.rl_origin, self.rl_clawback_pk)):
+            if hash == self.rl_puzzle_hash_for_pk(
+                    bytes(pubkey), self.limit, self.interval, self.rl_origin, self.rl_clawback_pk):
                 return pubkey, self.extended_secret_key.private_child(child)
 
     def get_keys_pk(self, clawback_pubkey):
@@ -241,13 +278,12 @@ class RLWallet(Wallet):
         return self.rl_sign_transaction(transaction)
 
     def rl_sign_transaction(self, spends: (Program, [CoinSolution])):
-        sigs = []
+        jobs = []
         for puzzle, solution in spends:
             pubkey, secretkey = self.get_keys(
                 solution.coin.puzzle_hash)
-            signature = secretkey.sign(
-                ProgramHash(Program(solution.solution)))
-            sigs.append(signature)
+            jobs.append((SIGN_SOLUTION_HASH, puzzle, solution.solution, self.child_for_pubkey(pubkey)))
+        sigs = self.signing_pool.sign(jobs)
         aggsig = BLSSignature.aggregate(sigs)
         solution_list = CoinSolutionList(
             [CoinSolution(coin_solution.coin, clvm.to_sexp_f([puzzle, coin_solution.solution])) for
@@ -332,15 +368,13 @@ class RLWallet(Wallet):
         return puzzle
 
     def get_puzzlehash_for_pk(self, pubkey):
-        puzzle = self.get_puzzle_for_pk(pubkey)
-        puzzlehash = ProgramHash(puzzle)
-        return puzzlehash
+        return puzzle_hash_for_pk(pubkey)
 
     def rl_get_aggregation_puzzlehash(self, wallet_puzzle):
         return ProgramHash(self.rl_make_aggregation_puzzle(wallet_puzzle))
 
     # We need to select origin primary input
-    def select_coins(self, amount, origin_name=None):
+    def select_coins(self, amount, strategy=None, origin_name=None):
         if amount > self.temp_balance:
             return None
         used_utxos = set()
@@ -348,16 +382,26 @@ class RLWallet(Wallet):
             for coin in self.temp_utxos.copy():
                 if str(coin.name()) == str(origin_name):
                     used_utxos.add(coin)
-        while sum(map(lambda coin: coin.amount, used_utxos)) < amount:
-            tmp = self.temp_utxos.pop()
-            if tmp.amount is not 0:
-                used_utxos.add(tmp)
+                    self.temp_utxos.remove(coin)
+        remaining = amount - sum(coin.amount for coin in used_utxos)
+        if remaining > 0:
+            if strategy is None:
+                strategy = self.coin_selection_strategy
+            coins = select_coins(self.temp_utxos, remaining, strategy)
+            if coins is None:
+                self.temp_utxos.update(used_utxos)
+                return None
+            for coin in coins:
+                self.temp_utxos.remove(coin)
+                used_utxos.add(coin)
         return used_utxos
 
-    def generate_unsigned_transaction_with_origin(self, amount, newpuzzlehash, origin_name):
+    def generate_unsigned_transaction_with_origin(self, amount, newpuzzlehash, origin_name, strategy=None):
         if self.temp_balance < amount:
             return None  # TODO: Should we throw a proper error here, or just return None?
-        utxos = self.select_coins(amount, origin_name)
+        utxos = self.select_coins(amount, strategy=strategy, origin_name=origin_name)
+        if utxos is None:
+            return None
         spends = []
         spend_value = sum([coin.amount for coin in utxos])
         change = spend_value - amount
@@ -380,8 +424,8 @@ class RLWallet(Wallet):
         self.temp_balance -= amount
         return spends
 
-    def generate_signed_transaction_with_origin(self, amount, newpuzzlehash, origin_name):
-        transaction = self.generate_unsigned_transaction_with_origin(amount, newpuzzlehash, origin_name)
+    def generate_signed_transaction_with_origin(self, amount, newpuzzlehash, origin_name, strategy=None):
+        transaction = self.generate_unsigned_transaction_with_origin(amount, newpuzzlehash, origin_name, strategy)
         if transaction is None:
             return None  # TODO: Should we throw a proper error here, or just return None?
         return self.sign_transaction(transaction)
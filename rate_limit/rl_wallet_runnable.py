@@ -1,13 +1,13 @@
 import asyncio
 from rate_limit.rl_wallet import RLWallet
 from chiasim.clients.ledger_sim import connect_to_ledger_sim
-from chiasim.wallet.deltas import additions_for_body, removals_for_body
-from chiasim.hashable import BLSPublicKey, Coin
-from chiasim.hashable.Body import BodyList
+from chiasim.hashable import BLSPublicKey
 from utilities.decorations import print_leaf, divider, prompt
 from chiasim.hashable import ProgramHash
 from binascii import hexlify
 from chiasim.atoms import hexbytes
+from utilities.block_sync import BlockSync
+from utilities.preimage_cache import CachedLedgerAPI, PreimageCache
 
 
 def get_int(message):
@@ -157,46 +157,30 @@ async def add_funds_to_rl_coin(wallet, ledger_api):
     _ = await ledger_api.push_tx(tx=spend_bundle)
 
 
-async def update_ledger(wallet, ledger_api, most_recent_header):
-    if most_recent_header is None:
-        r = await ledger_api.get_all_blocks()
-    else:
-        r = await ledger_api.get_recent_blocks(most_recent_header=most_recent_header)
-    update_list = BodyList.from_bytes(r)
-    tip = await ledger_api.get_tip()
-    index = int(tip["tip_index"])
-    for body in update_list:
-        additions = list(additions_for_body(body))
-        removals = removals_for_body(body)
-        removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
+async def update_ledger(wallet, block_sync):
+    ledger_api = block_sync.ledger_api()
+    async for index, header, additions, removals in block_sync.new_blocks():
         spend_bundle_list = wallet.notify(additions, removals, index)
         if spend_bundle_list is not None:
             for spend_bundle in spend_bundle_list:
                 _ = await ledger_api.push_tx(tx=spend_bundle)
+    return block_sync.checkpoint()
 
-    return most_recent_header
 
-
-async def new_block(wallet, ledger_api):
+async def new_block(wallet, block_sync):
     coinbase_puzzle_hash = wallet.get_new_puzzlehash()
     fees_puzzle_hash = wallet.get_new_puzzlehash()
-    r = await ledger_api.next_block(coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
-    body = r["body"]
-    tip = await  ledger_api.get_tip()
-    index = tip["tip_index"]
-    most_recent_header = r['header']
-    additions = list(additions_for_body(body))
-    removals = removals_for_body(body)
-    removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
-    wallet.notify(additions, removals, index)
-    return most_recent_header
+    r = await block_sync.ledger_api().next_block(
+        coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
+    block_sync.add_block(r['header'], r['body'])
+    return await update_ledger(wallet, block_sync)
 
 
 async def main_loop():
-    ledger_api = await connect_to_ledger_sim("localhost", 9868)
+    ledger_api = CachedLedgerAPI(await connect_to_ledger_sim("localhost", 9868), PreimageCache())
     selection = ""
     wallet = RLWallet()
-    most_recent_header = None
+    block_sync = BlockSync(ledger_api, on_reorg=wallet.clear_coins)
     print_leaf()
     print()
     print("Welcome to your Chia Rate Limited Wallet.")
@@ -233,9 +217,9 @@ async def main_loop():
         elif selection == "2":
             view_funds(wallet)
         elif selection == "3":
-            most_recent_header = await update_ledger(wallet, ledger_api, most_recent_header)
+            await update_ledger(wallet, block_sync)
         elif selection == "4":
-            most_recent_header = await new_block(wallet, ledger_api)
+            await new_block(wallet, block_sync)
         elif selection == "5":
             receive_rl_coin(wallet)
         elif selection == "6":
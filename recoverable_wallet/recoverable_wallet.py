@@ -5,6 +5,8 @@ from enum import IntEnum
 import cbor
 import clvm
 from standard_wallet.wallet import Wallet
+from standard_wallet.coin_selection import UTXOSet
+from utilities.signing_pool import SIGN_CONDITIONS
 try:
     from chialisp import *
 except Exception:
@@ -12,10 +14,11 @@ except Exception:
 
 from chiasim.validation.Conditions import ConditionOpcode
 from chiasim.atoms import hexbytes
-from chiasim.hashable import Program, ProgramHash, CoinSolution, SpendBundle, BLSSignature
+from chiasim.hashable import Program, CoinSolution, SpendBundle, BLSSignature
 from chiasim.hashable.CoinSolution import CoinSolutionList
 from clvm_tools import binutils
 from clvm import to_sexp_f
+from puzzles.puzzle_template import PuzzleTemplate
 from chiasim.validation.Conditions import \
     (conditions_by_opcode, make_create_coin_condition, make_assert_my_coin_id_condition, make_assert_min_time_condition)
 from chiasim.validation.consensus import\
@@ -48,10 +51,10 @@ def get_destination_puzzle_hash(solution):
     return val[0][1]
 
 
-def aggsig_condition(key):
+def aggsig_condition(key_source):
     op_aggsig = ConditionOpcode.AGG_SIG[0]
     return make_list(quote(op_aggsig),
-                     quote(f'0x{hexbytes(key)}'),
+                     quote(key_source),
                      sha256tree(args(0)))
 
 
@@ -64,6 +67,62 @@ class DurationType(IntEnum):
     WALLCLOCK_TIME = 2
 
 
+def escrow_puzzle_source(duration_type):
+    op_block_age_exceeds = ConditionOpcode.ASSERT_BLOCK_AGE_EXCEEDS[0]
+    op_time_exceeds = ConditionOpcode.ASSERT_TIME_EXCEEDS[0]
+    solution = args(0)
+    solution_args = args(1)
+    secure_switch = args(2)
+    evaluate_solution = eval(solution, solution_args)
+    standard_conditions = make_list(aggsig_condition('{pubkey}'),
+                                    terminator=evaluate_solution)
+    if duration_type == DurationType.BLOCKS:
+        op_code = op_block_age_exceeds
+    elif duration_type == DurationType.WALLCLOCK_TIME:
+        op_code = op_time_exceeds
+    recovery_conditions = make_list(aggsig_condition('{recovery_pubkey}'),
+                                    make_list(quote(op_code),
+                                              quote('{duration}')),
+                                    terminator=evaluate_solution)
+    escrow_puzzle = make_if(is_zero(secure_switch),
+                            standard_conditions,
+                            recovery_conditions)
+    return escrow_puzzle
+
+
+def puzzle_source():
+    op_create = ConditionOpcode.CREATE_COIN[0]
+    op_consumed = ConditionOpcode.ASSERT_COIN_CONSUMED[0]
+    solution = args(0)
+    solution_args = args(1)
+    secure_switch = args(2)
+    parent = args(3)
+    puzzle_hash = args(4)
+    value = args(5)
+    new_value = args(6)
+    evaluate_solution = eval(solution, solution_args)
+    standard_conditions = make_list(aggsig_condition('{pubkey}'),
+                                    terminator=evaluate_solution)
+    stake_factor_numerator = quote('{stake_factor_numerator}')
+    stake_factor_denominator = quote('{stake_factor_denominator}')
+    create_condition = make_if(equal(multiply(new_value, stake_factor_denominator),
+                                     multiply(value, stake_factor_numerator)),
+                               make_list(quote(op_create), quote('{escrow_puzzlehash}'), new_value),
+                               fail())
+    coin_id = sha256(parent, puzzle_hash, value)
+    consumed_condition = make_list(quote(op_consumed), coin_id)
+    escrow_conditions = make_list(create_condition,
+                                  consumed_condition)
+    puzzle = make_if(is_zero(secure_switch),
+                     standard_conditions,
+                     escrow_conditions)
+    return puzzle
+
+
+ESCROW_TEMPLATES = {_: PuzzleTemplate(escrow_puzzle_source(_)) for _ in DurationType}
+PUZZLE_TEMPLATE = PuzzleTemplate(puzzle_source())
+
+
 class RecoverableWallet(Wallet):
     def __init__(self, stake_factor, escrow_duration, duration_type):
         super().__init__()
@@ -103,59 +162,29 @@ class RecoverableWallet(Wallet):
         return str(hexbytes(cbor.dumps(d)))
 
     def get_escrow_puzzle_with_params(self, recovery_pubkey, pubkey, duration, duration_type):
-        op_block_age_exceeds = ConditionOpcode.ASSERT_BLOCK_AGE_EXCEEDS[0]
-        op_time_exceeds = ConditionOpcode.ASSERT_TIME_EXCEEDS[0]
-        solution = args(0)
-        solution_args = args(1)
-        secure_switch = args(2)
-        evaluate_solution = eval(solution, solution_args)
-        standard_conditions = make_list(aggsig_condition(pubkey),
-                                        terminator=evaluate_solution)
-        if duration_type == DurationType.BLOCKS:
-            op_code = op_block_age_exceeds
-        elif duration_type == DurationType.WALLCLOCK_TIME:
-            op_code = op_time_exceeds
-        recovery_conditions = make_list(aggsig_condition(recovery_pubkey),
-                                        make_list(quote(op_code),
-                                                  quote(duration)),
-                                        terminator=evaluate_solution)
-        escrow_puzzle = make_if(is_zero(secure_switch),
-                                standard_conditions,
-                                recovery_conditions)
-        program = Program(binutils.assemble(escrow_puzzle))
-        return program
+        return ESCROW_TEMPLATES[duration_type].puzzle(recovery_pubkey=recovery_pubkey, pubkey=pubkey,
+                                                      duration=duration)
 
-    def get_new_puzzle_with_params_and_root(self, recovery_pubkey, pubkey, stake_factor, duration, duration_type):
-        op_create = ConditionOpcode.CREATE_COIN[0]
-        op_consumed = ConditionOpcode.ASSERT_COIN_CONSUMED[0]
-        solution = args(0)
-        solution_args = args(1)
-        secure_switch = args(2)
-        parent = args(3)
-        puzzle_hash = args(4)
-        value = args(5)
-        new_value = args(6)
-        evaluate_solution = eval(solution, solution_args)
-        standard_conditions = make_list(aggsig_condition(pubkey),
-                                        terminator=evaluate_solution)
-        escrow_program = self.get_escrow_puzzle_with_params(recovery_pubkey, pubkey, duration, duration_type)
-        escrow_puzzlehash = f'0x' + str(hexbytes(ProgramHash(escrow_program)))
+    def get_escrow_puzzle_hash_with_params(self, recovery_pubkey, pubkey, duration, duration_type):
+        return ESCROW_TEMPLATES[duration_type].puzzle_hash(recovery_pubkey=recovery_pubkey, pubkey=pubkey,
+                                                           duration=duration)
+
+    def puzzle_parameters(self, recovery_pubkey, pubkey, stake_factor, duration, duration_type):
         f = Fraction(stake_factor)
-        stake_factor_numerator = quote(f.numerator)
-        stake_factor_denominator = quote(f.denominator)
-        create_condition = make_if(equal(multiply(new_value, stake_factor_denominator),
-                                         multiply(value, stake_factor_numerator)),
-                                   make_list(quote(op_create), quote(escrow_puzzlehash), new_value),
-                                   fail())
-        coin_id = sha256(parent, puzzle_hash, value)
-        consumed_condition = make_list(quote(op_consumed), coin_id)
-        escrow_conditions = make_list(create_condition,
-                                      consumed_condition)
-        puzzle = make_if(is_zero(secure_switch),
-                         standard_conditions,
-                         escrow_conditions)
-        program = Program(binutils.assemble(puzzle))
-        return program
+        return dict(pubkey=pubkey,
+                    escrow_puzzlehash=self.get_escrow_puzzle_hash_with_params(
+                        recovery_pubkey, pubkey, duration, duration_type),
+                    stake_factor_numerator=f.numerator,
+                    stake_factor_denominator=f.denominator)
+
+    def get_new_puzzle_with_params_and_root(self, recovery_pubkey, pubkey, stake_factor, duration, duration_type):
+        return PUZZLE_TEMPLATE.puzzle(**self.puzzle_parameters(
+            recovery_pubkey, pubkey, stake_factor, duration, duration_type))
+
+    def get_new_puzzle_hash_with_params_and_root(self, recovery_pubkey, pubkey, stake_factor, duration,
+                                                 duration_type):
+        return PUZZLE_TEMPLATE.puzzle_hash(**self.puzzle_parameters(
+            recovery_pubkey, pubkey, stake_factor, duration, duration_type))
 
     def get_new_puzzle_with_params(self, pubkey, stake_factor, escrow_duration, duration_type):
         return self.get_new_puzzle_with_params_and_root(bytes(self.get_recovery_public_key()),
@@ -173,17 +202,21 @@ class RecoverableWallet(Wallet):
         return program
 
     def get_new_puzzlehash(self):
-        puzzle = self.get_new_puzzle()
-        puzzlehash = ProgramHash(puzzle)
-        return puzzlehash
-
-    def can_generate_puzzle_hash(self, hash):
-        return any(map(lambda child: hash == ProgramHash(self.get_new_puzzle_with_params(
-            bytes(self.extended_secret_key.public_child(child)),
-            self.get_stake_factor(),
-            self.get_escrow_duration(),
-            self.get_duration_type())),
-                reversed(range(self.next_address))))
+        pubkey = bytes(self.get_next_public_key())
+        return self.puzzle_hash_for_pk(pubkey)
+
+    def puzzle_for_pk(self, pubkey):
+        return self.get_new_puzzle_with_params(pubkey,
+                                               self.get_stake_factor(),
+                                               self.get_escrow_duration(),
+                                               self.get_duration_type())
+
+    def puzzle_hash_for_pk(self, pubkey):
+        return self.get_new_puzzle_hash_with_params_and_root(bytes(self.get_recovery_public_key()),
+                                                             pubkey,
+                                                             self.get_stake_factor(),
+                                                             self.get_escrow_duration(),
+                                                             self.get_duration_type())
 
     def is_in_escrow(self, coin):
         keys = self.get_keys_for_escrow_puzzle(coin.puzzle_hash)
@@ -206,7 +239,7 @@ class RecoverableWallet(Wallet):
                 self.current_balance += coin.amount
                 self.my_utxos.add(coin)
 
-        self.temp_utxos = self.my_utxos.copy()
+        self.temp_utxos = UTXOSet(self.my_utxos)
         self.temp_balance = self.current_balance
 
     def can_generate_puzzle_hash_with_root_public_key(self,
@@ -217,12 +250,12 @@ class RecoverableWallet(Wallet):
                                                       duration_type):
         root_public_key = BLSPublicHDKey.from_bytes(root_public_key_serialized)
         recovery_pubkey = bytes(root_public_key.public_child(0))
-        return any(map(lambda child: hash == ProgramHash(self.get_new_puzzle_with_params_and_root(
+        return any(map(lambda child: hash == self.get_new_puzzle_hash_with_params_and_root(
             recovery_pubkey,
             bytes(root_public_key.public_child(child)),
             stake_factor,
             escrow_duration,
-            duration_type)),
+            duration_type),
                 reversed(range(20))))
 
     def find_pubkey_for_hash(self, hash, root_public_key_serialized, stake_factor, escrow_duration, duration_type):
@@ -230,27 +263,17 @@ class RecoverableWallet(Wallet):
         recovery_pubkey = bytes(root_public_key.public_child(0))
         for child in reversed(range(20)):
             pubkey = bytes(root_public_key.public_child(child))
-            puzzle = self.get_new_puzzle_with_params_and_root(recovery_pubkey,
-                                                              pubkey,
-                                                              stake_factor,
-                                                              escrow_duration,
-                                                              duration_type)
-            puzzlehash = ProgramHash(puzzle)
+            puzzlehash = self.get_new_puzzle_hash_with_params_and_root(recovery_pubkey,
+                                                                       pubkey,
+                                                                       stake_factor,
+                                                                       escrow_duration,
+                                                                       duration_type)
             if hash == puzzlehash:
                 return pubkey
 
-    def get_keys(self, hash):
-        for child in range(self.next_address):
-            pubkey = self.extended_secret_key.public_child(child)
-            if hash == ProgramHash(self.get_new_puzzle_with_params(bytes(pubkey),
-                                                                   self.get_stake_factor(),
-                                                                   self.get_escrow_duration(),
-                                                                   self.get_duration_type())):
-                return pubkey, self.extended_secret_key.private_child(child)
-
-    def generate_unsigned_transaction(self, amount, newpuzzlehash):
+    def generate_unsigned_transaction(self, amount, newpuzzlehash, strategy=None):
         stake_factor = self.get_stake_factor()
-        utxos = self.select_coins(amount)
+        utxos = self.select_coins(amount, strategy=strategy)
         if utxos is None:
             raise InsufficientFundsError
         spends = []
@@ -278,9 +301,9 @@ class RecoverableWallet(Wallet):
         return spends
 
 
-    def generate_unsigned_transaction_without_recipient(self, amount):
+    def generate_unsigned_transaction_without_recipient(self, amount, strategy=None):
         stake_factor = self.get_stake_factor()
-        utxos = self.select_coins(amount)
+        utxos = self.select_coins(amount, strategy=strategy)
         if utxos is None:
             raise InsufficientFundsError
         spends = []
@@ -345,18 +368,14 @@ class RecoverableWallet(Wallet):
         return signed_transaction, destination_puzzlehash, amount
 
     def sign_transaction(self, spends: (Program, CoinSolution)):
-        sigs = []
+        jobs = []
         for puzzle, solution in spends:
             val = self.get_keys(solution.coin.puzzle_hash)
             if val is None:
                 continue
             pubkey, secretkey = val
-            code_ = [puzzle, solution.solution]
-            sexp = clvm.to_sexp_f(code_)
-            conditions_dict = conditions_by_opcode(conditions_for_solution(sexp))
-            for _ in hash_key_pairs_for_conditions_dict(conditions_dict):
-                signature = secretkey.sign(_.message_hash)
-                sigs.append(signature)
+            jobs.append((SIGN_CONDITIONS, puzzle, solution.solution, self.child_for_pubkey(pubkey)))
+        sigs = self.signing_pool.sign(jobs)
         aggsig = BLSSignature.aggregate(sigs)
         solution_list = CoinSolutionList(
             [CoinSolution(coin_solution.coin, clvm.to_sexp_f([puzzle, coin_solution.solution])) for
@@ -367,15 +386,15 @@ class RecoverableWallet(Wallet):
     def get_keys_for_escrow_puzzle(self, hash):
         for child in range(self.next_address):
             pubkey = self.extended_secret_key.public_child(child)
-            escrow_hash = ProgramHash(self.get_escrow_puzzle_with_params(bytes(self.get_recovery_public_key()),
-                                                                         bytes(pubkey),
-                                                                         self.get_escrow_duration(),
-                                                                         self.get_duration_type()))
+            escrow_hash = self.get_escrow_puzzle_hash_with_params(bytes(self.get_recovery_public_key()),
+                                                                  bytes(pubkey),
+                                                                  self.get_escrow_duration(),
+                                                                  self.get_duration_type())
             if hash == escrow_hash:
                 return pubkey, self.extended_secret_key.private_child(child)
 
-    def generate_signed_transaction(self, amount, newpuzzlehash):
-        transaction = self.generate_unsigned_transaction(amount, newpuzzlehash)
+    def generate_signed_transaction(self, amount, newpuzzlehash, strategy=None):
+        transaction = self.generate_unsigned_transaction(amount, newpuzzlehash, strategy)
         if transaction is None:
             return None
         return self.sign_transaction(transaction)
@@ -415,10 +434,10 @@ class RecoverableWallet(Wallet):
         child = 0
         while True:
             pubkey = root_public_key.public_child(child)
-            test_hash = ProgramHash(self.get_escrow_puzzle_with_params(recovery_pubkey,
-                                                                       bytes(pubkey),
-                                                                       duration,
-                                                                       duration_type))
+            test_hash = self.get_escrow_puzzle_hash_with_params(recovery_pubkey,
+                                                                bytes(pubkey),
+                                                                duration,
+                                                                duration_type)
             if coin.puzzle_hash == test_hash:
                 return pubkey
             child += 1
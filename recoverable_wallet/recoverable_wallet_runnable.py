@@ -3,15 +3,17 @@ import cbor
 import sys
 from recoverable_wallet import RecoverableWallet
 from chiasim.clients.ledger_sim import connect_to_ledger_sim
-from chiasim.wallet.deltas import additions_for_body, removals_for_body
-from chiasim.hashable import Coin, Header, HeaderHash, Body
+from chiasim.wallet.deltas import additions_for_body
+from chiasim.hashable import Coin, HeaderHash
 from chiasim.hashable import ProgramHash
 from chiasim.remote.client import RemoteError
 from decimal import Decimal
 from utilities.BLSHDKey import BLSPublicHDKey, BLSPrivateKey
+from utilities.block_sync import BlockSync
+from utilities.preimage_cache import CachedLedgerAPI, PreimageCache
 
 
-async def view_coins(ledger_api, wallet, most_recent_header):
+async def view_coins(block_sync, wallet, most_recent_header):
     print('Recoverable coins:')
     for coin in wallet.my_utxos:
         print(f'Coin ID: {coin.name()}, Amount: {coin.amount}')
@@ -22,7 +24,7 @@ async def view_coins(ledger_api, wallet, most_recent_header):
         recovery_dict = recovery_string_to_dict(recovery_string)
         escrow_duration = recovery_dict['escrow_duration']
         for coin in coin_set:
-            coin_age = await get_coin_age(coin, ledger_api, most_recent_header)
+            coin_age = await get_coin_age(coin, block_sync, most_recent_header)
             wait_period = max(escrow_duration - coin_age, 0)
             print(f'Coin ID: {coin.name()}, Block wait: {wait_period}, Amount: {coin.amount}')
         escrow_value += sum([coin.amount for coin in coin_set])
@@ -45,53 +47,38 @@ async def spend_coins(wallet, ledger_api):
         await ledger_api.push_tx(tx=tx)
 
 
-async def process_blocks(wallet, ledger_api, last_known_header, current_header_hash):
-    r = await ledger_api.hash_preimage(hash=current_header_hash)
-    header = Header.from_bytes(r)
-    body = Body.from_bytes(await ledger_api.hash_preimage(hash=header.body_hash))
-    if header.previous_hash != last_known_header:
-        await process_blocks(wallet, ledger_api, last_known_header, header.previous_hash)
-    print(f'processing block {HeaderHash(header)}')
-    additions = list(additions_for_body(body))
-    removals = removals_for_body(body)
-    removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
-    wallet.notify(additions, removals)
-    clawback_coins = [coin for coin in additions if wallet.is_in_escrow(coin)]
-    if len(clawback_coins) != 0:
-        print(f'WARNING! Coins from this wallet have been moved to escrow!\n'
-              f'Attempting to send a clawback for these coins:')
-        for coin in clawback_coins:
-            print(f'Coin ID: {coin.name()}, Amount: {coin.amount}')
-        transaction = wallet.generate_clawback_transaction(clawback_coins)
-        r = await ledger_api.push_tx(tx=transaction)
-        if type(r) is RemoteError:
-            print('Clawback failed')
-        else:
-            print('Clawback transaction submitted')
-
-
-async def farm_block(wallet, ledger_api, last_known_header):
+async def process_blocks(wallet, block_sync):
+    ledger_api = block_sync.ledger_api()
+    async for index, header, additions, removals in block_sync.new_blocks():
+        print(f'processing block {HeaderHash(header)}')
+        wallet.notify(additions, removals)
+        clawback_coins = [coin for coin in additions if wallet.is_in_escrow(coin)]
+        if len(clawback_coins) != 0:
+            print(f'WARNING! Coins from this wallet have been moved to escrow!\n'
+                  f'Attempting to send a clawback for these coins:')
+            for coin in clawback_coins:
+                print(f'Coin ID: {coin.name()}, Amount: {coin.amount}')
+            transaction = wallet.generate_clawback_transaction(clawback_coins)
+            r = await ledger_api.push_tx(tx=transaction)
+            if type(r) is RemoteError:
+                print('Clawback failed')
+            else:
+                print('Clawback transaction submitted')
+
+
+async def farm_block(wallet, block_sync):
     coinbase_puzzle_hash = wallet.get_new_puzzlehash()
     fees_puzzle_hash = wallet.get_new_puzzlehash()
-    r = await ledger_api.next_block(coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
-    header = r['header']
-    header_hash = HeaderHash(header)
-    tip = await ledger_api.get_tip()
-    await process_blocks(wallet,
-                         ledger_api,
-                         tip['genesis_hash'] if last_known_header is None else last_known_header,
-                         header_hash)
-    return header_hash
-
-
-async def update_ledger(wallet, ledger_api, most_recent_header):
-    r = await ledger_api.get_tip()
-    if r['tip_hash'] != most_recent_header:
-        await process_blocks(wallet,
-                             ledger_api,
-                             r['genesis_hash'] if most_recent_header is None else most_recent_header,
-                             r['tip_hash'])
-    return r['tip_hash']
+    r = await block_sync.ledger_api().next_block(
+        coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
+    block_sync.add_block(r['header'], r['body'])
+    await process_blocks(wallet, block_sync)
+    return block_sync.checkpoint()
+
+
+async def update_ledger(wallet, block_sync):
+    await process_blocks(wallet, block_sync)
+    return block_sync.checkpoint()
 
 
 def print_backup(wallet):
@@ -107,30 +94,24 @@ def recovery_string_to_dict(recovery_string):
     return recovery_dict
 
 
-async def get_unspent_coins(ledger_api, header_hash):
-    r = await ledger_api.get_tip()
-    if r['genesis_hash'] == header_hash:
-        return set()
-
-    r = await ledger_api.hash_preimage(hash=header_hash)
-    header = Header.from_bytes(r)
-    unspent_coins = await get_unspent_coins(ledger_api, header.previous_hash)
-    body = Body.from_bytes(await ledger_api.hash_preimage(hash=header.body_hash))
-    additions = list(additions_for_body(body))
-    unspent_coins.update(additions)
-    removals = removals_for_body(body)
-    removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
-    unspent_coins.difference_update(removals)
+async def get_unspent_coins(block_sync, header_hash):
+    r = await block_sync.ledger_api().get_tip()
+    headers = await block_sync.headers_since(None, header_hash, r['genesis_hash'])
+    unspent_coins = set()
+    async for header, additions, removals in block_sync.fetch_blocks(headers):
+        unspent_coins.update(additions)
+        unspent_coins.difference_update(removals)
     return unspent_coins
 
 
-async def restore(ledger_api, wallet, header_hash):
+async def restore(block_sync, wallet, header_hash):
+    ledger_api = block_sync.ledger_api()
     recovery_string = input('Enter the recovery string of the wallet to be restored: ')
     recovery_dict = recovery_string_to_dict(recovery_string)
     root_public_key_serialized = recovery_dict['root_public_key'].serialize()
 
     recovery_pubkey = recovery_dict['root_public_key'].public_child(0).get_public_key().serialize()
-    unspent_coins = await get_unspent_coins(ledger_api, header_hash)
+    unspent_coins = await get_unspent_coins(block_sync, header_hash)
     recoverable_coins = []
     print('scanning', end='')
     for coin in unspent_coins:
@@ -169,18 +150,17 @@ async def restore(ledger_api, wallet, header_hash):
             wallet.escrow_coins[recovery_string].add(child)
 
 
-async def get_coin_age(coin, ledger_api, header_hash):
-    r = await ledger_api.get_tip()
-    if r['genesis_hash'] == header_hash:
-        return float('-inf')
-
-    r = await ledger_api.hash_preimage(hash=header_hash)
-    header = Header.from_bytes(r)
-    body = Body.from_bytes(await ledger_api.hash_preimage(hash=header.body_hash))
-    additions = list(additions_for_body(body))
-    if coin in additions:
-        return 0
-    return 1 + await get_coin_age(coin, ledger_api, header.previous_hash)
+async def get_coin_age(coin, block_sync, header_hash):
+    r = await block_sync.ledger_api().get_tip()
+    age = 0
+    while header_hash != r['genesis_hash']:
+        header = await block_sync.header(header_hash)
+        body = await block_sync.body(header)
+        if coin in additions_for_body(body):
+            return age
+        age += 1
+        header_hash = header.previous_hash
+    return float('-inf')
 
 
 async def recover_escrow_coins(ledger_api, wallet):
@@ -208,7 +188,7 @@ async def recover_escrow_coins(ledger_api, wallet):
 
 
 async def main_loop():
-    ledger_api = await connect_to_ledger_sim('localhost', 9868)
+    ledger_api = CachedLedgerAPI(await connect_to_ledger_sim('localhost', 9868), PreimageCache())
     print('Creating a new Recoverable Wallet')
     stake_factor = input('Input stake factor (defaults to 1.1): ')
     if stake_factor == '':
@@ -218,6 +198,7 @@ async def main_loop():
         escrow_duration = '3'
     wallet = RecoverableWallet(Decimal(stake_factor), int(escrow_duration))
     most_recent_header = None
+    block_sync = BlockSync(ledger_api)
     selection = ''
     while selection != 'q':
         print('\nAvailable commands:')
@@ -233,19 +214,19 @@ async def main_loop():
         selection = input()
         print()
         if selection == '1':
-            await view_coins(ledger_api, wallet, most_recent_header)
+            await view_coins(block_sync, wallet, most_recent_header)
         elif selection == '2':
             await spend_coins(wallet, ledger_api)
         elif selection == '3':
-            most_recent_header = await update_ledger(wallet, ledger_api, most_recent_header)
+            most_recent_header = await update_ledger(wallet, block_sync)
         elif selection == '4':
-            most_recent_header = await farm_block(wallet, ledger_api, most_recent_header)
+            most_recent_header = await farm_block(wallet, block_sync)
         elif selection == '5':
             generate_puzzlehash(wallet)
         elif selection == '6':
             print_backup(wallet)
         elif selection == '7':
-            await restore(ledger_api, wallet, most_recent_header)
+            await restore(block_sync, wallet, most_recent_header)
         elif selection == '8':
             await recover_escrow_coins(ledger_api, wallet)
     sys.exit(0)
@@ -19,6 +19,7 @@ setuptools.setup(
         "custody_wallet",
         "puzzles",
         "multisig",
+        "benchmarks",
     ],
     license="Apache License",
     python_requires=">=3.7, <4",
@@ -0,0 +1,319 @@
+"""
+Coin selection
+
+A UTXOSet is a set of coins that also keeps an index of its coins sorted
+by amount, so selection strategies never have to scan or re-sort the whole
+set.
+
+A strategy is a function f(utxos, amount) that returns a list of coins
+whose amounts sum to at least amount, or None if it can't find one. It
+must not modify utxos. Strategies can be passed to select_coins either as
+a callable or by name (see STRATEGIES).
+
+    exact           branch and bound search for a selection with no change
+    largest_first   fewest inputs, biggest coins first
+    smallest_first  consolidates dust by spending the smallest coins first
+    knapsack        smallest coin that covers the amount, or an approximate
+                    best subset of the smaller coins
+    default         exact, falling back to knapsack
+"""
+
+import random
+from bisect import bisect_left, bisect_right
+
+
+# bound the work done by the search strategies so they stay fast
+# with very large UTXO sets
+BNB_MAX_TRIES = 100000
+KNAPSACK_MAX_CANDIDATES = 256
+KNAPSACK_ITERATIONS = 1000
+
+
+class UTXOSet(set):
+    """
+    A set of coins which lazily maintains an amount-sorted index of itself.
+    Zero value coins are kept in the set but never selected.
+    """
+
+    def __init__(self, coins=()):
+        super().__init__(coins)
+        self._amounts = None
+        self._coins = None
+
+    def _build_index(self):
+        pairs = sorted(((coin.amount, coin) for coin in self if coin.amount > 0),
+                       key=lambda pair: pair[0])
+        self._amounts = [amount for amount, coin in pairs]
+        self._coins = [coin for amount, coin in pairs]
+
+    def _index_add(self, coin):
+        if self._amounts is None or coin.amount <= 0:
+            return
+        i = bisect_right(self._amounts, coin.amount)
+        self._amounts.insert(i, coin.amount)
+        self._coins.insert(i, coin)
+
+    def _index_remove(self, coin):
+        if self._amounts is None or coin.amount <= 0:
+            return
+        i = bisect_left(self._amounts, coin.amount)
+        while self._coins[i] != coin:
+            i += 1
+        del self._amounts[i]
+        del self._coins[i]
+
+    def _invalidate(self):
+        self._amounts = None
+        self._coins = None
+
+    def sorted_coins(self):
+        """
+        Return a list of the spendable coins in ascending order of amount.
+        The list belongs to the set and must not be modified.
+        """
+        if self._amounts is None:
+            self._build_index()
+        return self._coins
+
+    def sorted_amounts(self):
+        if self._amounts is None:
+            self._build_index()
+        return self._amounts
+
+    def add(self, coin):
+        if coin not in self:
+            super().add(coin)
+            self._index_add(coin)
+
+    def remove(self, coin):
+        super().remove(coin)
+        self._index_remove(coin)
+
+    def discard(self, coin):
+        if coin in self:
+            self.remove(coin)
+
+    def pop(self):
+        coin = super().pop()
+        self._index_remove(coin)
+        return coin
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def update(self, *others):
+        super().update(*others)
+        self._invalidate()
+
+    def difference_update(self, *others):
+        super().difference_update(*others)
+        self._invalidate()
+
+    def intersection_update(self, *others):
+        super().intersection_update(*others)
+        self._invalidate()
+
+    def symmetric_difference_update(self, other):
+        super().symmetric_difference_update(other)
+        self._invalidate()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+    def copy(self):
+        utxos = self.__class__()
+        set.update(utxos, self)
+        if self._amounts is not None:
+            utxos._amounts = list(self._amounts)
+            utxos._coins = list(self._coins)
+        return utxos
+
+
+def as_utxo_set(coins):
+    if isinstance(coins, UTXOSet):
+        return coins
+    return UTXOSet(coins)
+
+
+def largest_first(utxos, amount):
+    coins = utxos.sorted_coins()
+    selected = []
+    total = 0
+    for coin in reversed(coins):
+        if total >= amount:
+            break
+        selected.append(coin)
+        total += coin.amount
+    if total < amount:
+        return None
+    return selected
+
+
+def smallest_first(utxos, amount):
+    coins = utxos.sorted_coins()
+    selected = []
+    total = 0
+    for coin in coins:
+        if total >= amount:
+            break
+        selected.append(coin)
+        total += coin.amount
+    if total < amount:
+        return None
+    return selected
+
+
+def exact(utxos, amount, max_tries=BNB_MAX_TRIES):
+    """
+    Branch and bound search for a set of coins that sums to exactly amount,
+    so no change output is needed. Larger coins are tried first so the
+    first match found tends to have few inputs.
+    """
+    amounts = utxos.sorted_amounts()
+    coins = utxos.sorted_coins()
+
+    # a single coin is the best possible match
+    i = bisect_left(amounts, amount)
+    if i < len(amounts) and amounts[i] == amount:
+        return [coins[i]]
+
+    # only the i coins smaller than amount can be part of an exact match.
+    # They're visited largest first, so depth d refers to coins[i - 1 - d]
+    # and the coins left to consider at depth d are coins[:i - d]
+    prefix_totals = [0]
+    for coin_amount in amounts[:i]:
+        prefix_totals.append(prefix_totals[-1] + coin_amount)
+    if prefix_totals[i] < amount:
+        return None
+
+    selected = []
+    total = 0
+    depth = 0
+    for _ in range(max_tries):
+        if total == amount:
+            return [coins[i - 1 - _] for _ in selected]
+        need = amount - total
+        if depth < i:
+            # jump straight past coins that are too big to fit
+            depth = i - bisect_right(amounts, need, 0, i - depth)
+        if depth >= i or prefix_totals[i - depth] < need:
+            # backtrack: omit the most recently included coin instead
+            if not selected:
+                return None
+            last = selected.pop()
+            last_amount = amounts[i - 1 - last]
+            total -= last_amount
+            depth = last + 1
+            # omitting one coin then including an equal one is a branch
+            # we've already searched
+            while depth < i and amounts[i - 1 - depth] == last_amount:
+                depth += 1
+            continue
+        selected.append(depth)
+        total += amounts[i - 1 - depth]
+        depth += 1
+    return None
+
+
+def knapsack(utxos, amount, iterations=KNAPSACK_ITERATIONS, rng=None):
+    """
+    Prefer the smallest single coin that covers amount, unless a subset of
+    the smaller coins gets closer to amount.
+    """
+    amounts = utxos.sorted_amounts()
+    coins = utxos.sorted_coins()
+    i = bisect_left(amounts, amount)
+    lowest_larger = coins[i] if i < len(coins) else None
+
+    smaller = coins[max(0, i - KNAPSACK_MAX_CANDIDATES):i][::-1]
+    smaller_total = sum(coin.amount for coin in smaller)
+    if smaller_total < amount:
+        if lowest_larger is not None:
+            return [lowest_larger]
+        if i > KNAPSACK_MAX_CANDIDATES:
+            return largest_first(utxos, amount)
+        return None
+    if smaller_total == amount:
+        return smaller
+
+    rng = rng or random.Random(amount)
+    best = [True] * len(smaller)
+    best_total = smaller_total
+    for _ in range(iterations):
+        if best_total == amount:
+            break
+        included = [False] * len(smaller)
+        total = 0
+        reached = False
+        # first pass includes coins at random, second pass includes the rest
+        for npass in range(2):
+            if reached:
+                break
+            for index, coin in enumerate(smaller):
+                if included[index] or (npass == 0 and rng.random() < 0.5):
+                    continue
+                total += coin.amount
+                included[index] = True
+                if total >= amount:
+                    reached = True
+                    if total < best_total:
+                        best_total = total
+                        best = list(included)
+                    total -= coin.amount
+                    included[index] = False
+
+    if lowest_larger is not None and lowest_larger.amount <= best_total:
+        return [lowest_larger]
+    return [coin for coin, used in zip(smaller, best) if used]
+
+
+def default(utxos, amount):
+    return exact(utxos, amount) or knapsack(utxos, amount)
+
+
+STRATEGIES = dict(
+    exact=exact,
+    largest_first=largest_first,
+    smallest_first=smallest_first,
+    knapsack=knapsack,
+    default=default,
+)
+
+DEFAULT_STRATEGY = "default"
+
+
+def strategy_for(strategy):
+    if strategy is None:
+        strategy = DEFAULT_STRATEGY
+    if callable(strategy):
+        return strategy
+    try:
+        return STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError("unknown coin selection strategy %s" % strategy)
+
+
+def select_coins(utxos, amount, strategy=None):
+    """
+    Choose coins from utxos adding up to at least amount, without modifying
+    utxos. Returns a list of coins, or None if the strategy can't cover
+    amount.
+    """
+    if amount <= 0:
+        return []
+    utxos = as_utxo_set(utxos)
+    return strategy_for(strategy)(utxos, amount)
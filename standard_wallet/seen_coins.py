@@ -0,0 +1,85 @@
+"""
+Deduplication of coin notifications
+
+A wallet can be told about the same block more than once, and must not
+count its coins twice. Rather than remembering every coin it has ever
+been told about, a wallet keeps a SeenCoins per kind of notification it
+deduplicates:
+
+  - coins the wallet acted on (its own coins) are kept exactly, so their
+    memory grows with the wallet's history, not the chain's
+  - every other coin is only remembered for the last `window` block
+    heights. Seeing one of those again is harmless, since it didn't
+    concern the wallet the first time either
+  - anything at or below the height watermark (the highest height seen
+    minus `window`) counts as already processed
+"""
+
+from collections import OrderedDict
+
+
+# number of block heights whose coin names are remembered
+DEDUP_WINDOW = 100
+
+
+class SeenCoins:
+    def __init__(self, window=DEDUP_WINDOW):
+        self._window = window
+        self._kept = set()
+        self._heights = {}  # {coin name: height it was seen at}
+        self._names = OrderedDict()  # {height: [coin names]}
+        self._tip = None
+
+    def __len__(self):
+        return len(self._kept) + len(self._heights)
+
+    def __contains__(self, name):
+        return name in self._kept or name in self._heights
+
+    def tip(self):
+        return self._tip
+
+    def watermark(self):
+        """
+        Heights at or below the watermark are considered processed.
+        """
+        if self._tip is None:
+            return None
+        return self._tip - self._window
+
+    def add(self, name, height=None, keep=False):
+        """
+        Record that the coin called name was seen at height (the highest
+        height so far by default), and remember it for good if keep is
+        set. Returns False if it had already been seen, or is at or below
+        the watermark.
+        """
+        if height is None:
+            height = 0 if self._tip is None else self._tip
+        if self._tip is not None and height <= self._tip - self._window:
+            return False
+        if name in self:
+            return False
+        if keep:
+            self._kept.add(name)
+        else:
+            self._heights[name] = height
+            self._names.setdefault(height, []).append(name)
+        if self._tip is None or height > self._tip:
+            self._tip = height
+            self._prune()
+        return True
+
+    def set_tip(self, height):
+        """
+        Count heights up to height as seen, e.g. for a restored wallet.
+        """
+        if self._tip is None or height > self._tip:
+            self._tip = height
+            self._prune()
+
+    def _prune(self):
+        watermark = self._tip - self._window
+        for height in [_ for _ in self._names if _ <= watermark]:
+            for name in self._names.pop(height):
+                self._heights.pop(name, None)
@@ -1,19 +1,20 @@
 import clvm
 from os import urandom
-from chiasim.hashable import Program, ProgramHash, CoinSolution, SpendBundle, BLSSignature, Coin
+from chiasim.hashable import Program, CoinSolution, SpendBundle, BLSSignature, Coin
 from chiasim.hashable.CoinSolution import CoinSolutionList
 from chiasim.validation.Conditions import (
-    conditions_by_opcode, make_create_coin_condition, make_assert_my_coin_id_condition, make_assert_min_time_condition, make_assert_coin_consumed_condition
-)
-from chiasim.validation.consensus import (
-    conditions_for_solution, hash_key_pairs_for_conditions_dict
+    make_create_coin_condition, make_assert_my_coin_id_condition, make_assert_min_time_condition, make_assert_coin_consumed_condition
 )
 
 from utilities.BLSHDKey import BLSPrivateHDKey
+from utilities.signing_pool import SigningPool, SIGN_CONDITIONS, SERIAL_THRESHOLD
 
-from puzzles.p2_delegated_puzzle import puzzle_for_pk
+from puzzles.p2_delegated_puzzle import puzzle_for_pk, puzzle_hash_for_pk
 from puzzles.p2_conditions import puzzle_for_conditions
 
+from .coin_selection import UTXOSet, select_coins
+from .seen_coins import SeenCoins
+
 
 class Wallet:
     seed = b'seed'
@@ -28,10 +29,16 @@ class Wallet:
         # self.contacts = {}  # {'name': (puzzlegenerator, last, extradata)}
         self.generator_lookups = {}  # {generator_hash: generator}
         self.name = "MyChiaWallet"
-        self.temp_utxos = set()
+        self.temp_utxos = UTXOSet()
         self.temp_balance = 0
-        self.all_additions = {}
-        self.all_deletions = {}
+        self.coin_selection_strategy = None  # use coin_selection.DEFAULT_STRATEGY
+        self.seen_additions = SeenCoins()
+        self.seen_deletions = SeenCoins()
+        # {puzzle_hash: (child, pubkey, secretkey)}, filled in as addresses are handed out
+        self.puzzle_hash_index = {}
+        self.pubkey_index = {}  # {bytes(pubkey): child}
+        self.indexed_address = 0
+        self.signing_pool = SigningPool(self.extended_secret_key, pool_size=0)
 
     def get_next_public_key(self):
         pubkey = self.extended_secret_key.public_child(self.next_address)
@@ -48,58 +55,132 @@ class Wallet:
     def set_name(self, name):
         self.name = name
 
+    def set_seed(self, seed):
+        """
+        Switch to the keys derived from seed, e.g. when restoring a wallet.
+        """
+        self.seed = seed
+        self.extended_secret_key = BLSPrivateHDKey.from_seed(seed)
+        self.puzzle_hash_index = {}
+        self.pubkey_index = {}
+        self.indexed_address = 0
+        self.signing_pool.close()
+        self.signing_pool = SigningPool(self.extended_secret_key, pool_size=0)
+
+    def update_puzzle_hash_index(self):
+        """
+        Index the puzzle hash of every child handed out since the last call,
+        so each child key is only derived and hashed once.
+        """
+        while self.indexed_address < self.next_address:
+            child = self.indexed_address
+            pubkey = self.extended_secret_key.public_child(child)
+            puzzle_hash = self.puzzle_hash_for_pk(bytes(pubkey))
+            self.puzzle_hash_index[puzzle_hash] = (child, pubkey, None)
+            self.pubkey_index[bytes(pubkey)] = child
+            self.indexed_address += 1
+
+    def child_for_pubkey(self, pubkey):
+        self.update_puzzle_hash_index()
+        return self.pubkey_index.get(bytes(pubkey))
+
+    def enable_parallel_signing(self, pool_size=None, serial_threshold=SERIAL_THRESHOLD):
+        """
+        Sign transactions with at least serial_threshold spends on a pool of
+        pool_size processes (one per cpu by default).
+        """
+        self.signing_pool.close()
+        self.signing_pool = SigningPool(self.extended_secret_key, pool_size, serial_threshold)
+
     def can_generate_puzzle_hash(self, hash):
-        return any(map(lambda child: hash == ProgramHash(puzzle_for_pk(
-            bytes(self.extended_secret_key.public_child(child)))),
-            reversed(range(self.next_address))))
+        self.update_puzzle_hash_index()
+        return hash in self.puzzle_hash_index
 
     def get_keys(self, hash):
-        for child in range(self.next_address):
-            pubkey = self.extended_secret_key.public_child(child)
-            if hash == ProgramHash(puzzle_for_pk(bytes(pubkey))):
-                return (pubkey, self.extended_secret_key.private_child(child))
+        self.update_puzzle_hash_index()
+        entry = self.puzzle_hash_index.get(hash)
+        if entry is None:
+            return None
+        child, pubkey, secretkey = entry
+        if secretkey is None:
+            secretkey = self.extended_secret_key.private_child(child)
+            self.puzzle_hash_index[hash] = (child, pubkey, secretkey)
+        return (pubkey, secretkey)
 
-    def notify(self, additions, deletions):
+    def next_height(self, height=None):
+        """
+        Return height, or if it's None count the notification as the block
+        after the last one seen.
+        """
+        if height is not None:
+            return height
+        tip = self.seen_additions.tip()
+        return 0 if tip is None else tip + 1
+
+    def notify(self, additions, deletions, height=None):
+        height = self.next_height(height)
         for coin in additions:
-            if coin.name() in self.all_additions:
+            mine = self.can_generate_puzzle_hash(coin.puzzle_hash)
+            if not self.seen_additions.add(coin.name(), height, keep=mine):
                 continue
-            self.all_additions[coin.name()] = coin
-            if self.can_generate_puzzle_hash(coin.puzzle_hash):
+            if mine:
                 self.current_balance += coin.amount
                 self.my_utxos.add(coin)
         for coin in deletions:
-            if coin.name() in self.all_deletions:
+            mine = coin in self.my_utxos
+            if not self.seen_deletions.add(coin.name(), height, keep=mine):
                 continue
-            self.all_deletions[coin.name()] = coin
-            if coin in self.my_utxos:
+            if mine:
                 self.my_utxos.remove(coin)
                 self.current_balance -= coin.amount
 
-        self.temp_utxos = self.my_utxos.copy()
+        self.temp_utxos = UTXOSet(self.my_utxos)
         self.temp_balance = self.current_balance
 
-    def select_coins(self, amount):
+    def clear_coins(self):
+        """
+        Forget every coin seen, e.g. before the chain is synced again from
+        genesis after a reorg.
+        """
+        self.current_balance = 0
+        self.my_utxos = set()
+        self.temp_utxos = UTXOSet()
+        self.temp_balance = 0
+        self.seen_additions = SeenCoins()
+        self.seen_deletions = SeenCoins()
+
+    def select_coins(self, amount, strategy=None):
+        """
+        Take coins adding up to at least amount out of temp_utxos, using the
+        given coin selection strategy (see coin_selection.STRATEGIES).
+        """
         if amount > self.temp_balance:
             return None
-        used_utxos = set()
-        while sum(map(lambda coin: coin.amount, used_utxos)) < amount:
-            temp = self.temp_utxos.pop()
-            used_utxos.add(temp)
-            self.temp_balance -= temp.amount
+        if strategy is None:
+            strategy = self.coin_selection_strategy
+        coins = select_coins(self.temp_utxos, amount, strategy)
+        if coins is None:
+            return None
+        used_utxos = set(coins)
+        for coin in used_utxos:
+            self.temp_utxos.remove(coin)
+            self.temp_balance -= coin.amount
         return used_utxos
 
     def puzzle_for_pk(self, pubkey):
         return puzzle_for_pk(pubkey)
 
+    def puzzle_hash_for_pk(self, pubkey):
+        return puzzle_hash_for_pk(pubkey)
+
     def get_new_puzzle(self):
         pubkey = bytes(self.get_next_public_key())
         puzzle = puzzle_for_pk(pubkey)
         return puzzle
 
     def get_new_puzzlehash(self):
-        puzzle = self.get_new_puzzle()
-        puzzlehash = ProgramHash(puzzle)
-        return puzzlehash
+        pubkey = bytes(self.get_next_public_key())
+        return puzzle_hash_for_pk(pubkey)
 
     def sign(self, value, pubkey):
         privatekey = self.extended_secret_key.private_child(self.pubkey_num_lookup[pubkey])
@@ -118,10 +199,26 @@ class Wallet:
             ret.append(make_assert_my_coin_id_condition(me['id']))
         return clvm.to_sexp_f([puzzle_for_conditions(ret), []])
 
-    def generate_unsigned_transaction(self, amount, newpuzzlehash):
+    def generate_unsigned_transaction(self, amount, newpuzzlehash, strategy=None):
+        return self.generate_unsigned_batch_transaction([(newpuzzlehash, amount)], strategy)
+
+    def generate_unsigned_batch_transaction(self, payments, strategy=None):
+        """
+        Pay every (puzzlehash, amount) pair in payments from a single coin
+        selection, with one change output. Return None if payments is
+        empty, has an amount that isn't positive or repeats a payment,
+        which would create the same coin twice.
+        """
+        if not payments or any(value <= 0 for puzzlehash, value in payments):
+            return None
+        if len(set((bytes(puzzlehash), value) for puzzlehash, value in payments)) < len(payments):
+            return None
+        amount = sum(value for puzzlehash, value in payments)
         if self.temp_balance < amount:
-            return None  # TODO: Should we throw a proper error here, or just return None?
-        utxos = self.select_coins(amount)
+            return None
+        utxos = self.select_coins(amount, strategy=strategy)
+        if utxos is None:
+            return None
         spends = []
         output_created = False
         spend_value = sum([coin.amount for coin in utxos])
@@ -132,7 +229,8 @@ class Wallet:
             pubkey, secretkey = self.get_keys(puzzle_hash)
             puzzle = puzzle_for_pk(pubkey)
             if output_created is False:
-                primaries = [{'puzzlehash': newpuzzlehash, 'amount': amount}]
+                primaries = [{'puzzlehash': puzzlehash, 'amount': value}
+                             for puzzlehash, value in payments]
                 if change > 0:
                     changepuzzlehash = self.get_new_puzzlehash()
                     primaries.append(
@@ -148,16 +246,11 @@ class Wallet:
         return spends
 
     def sign_transaction(self, spends: (Program, [CoinSolution])):
-        sigs = []
+        jobs = []
         for puzzle, solution in spends:
             pubkey, secretkey = self.get_keys(solution.coin.puzzle_hash)
-            code_ = [puzzle, solution.solution]
-            sexp = clvm.to_sexp_f(code_)
-            conditions_dict = conditions_by_opcode(
-                conditions_for_solution(sexp))
-            for _ in hash_key_pairs_for_conditions_dict(conditions_dict):
-                signature = secretkey.sign(_.message_hash)
-                sigs.append(signature)
+            jobs.append((SIGN_CONDITIONS, puzzle, solution.solution, self.child_for_pubkey(pubkey)))
+        sigs = self.signing_pool.sign(jobs)
         aggsig = BLSSignature.aggregate(sigs)
         solution_list = CoinSolutionList(
             [CoinSolution(coin_solution.coin, clvm.to_sexp_f([puzzle, coin_solution.solution])) for
@@ -165,12 +258,18 @@ class Wallet:
         spend_bundle = SpendBundle(solution_list, aggsig)
         return spend_bundle
 
-    def generate_signed_transaction(self, amount, newpuzzlehash):
-        transaction = self.generate_unsigned_transaction(amount, newpuzzlehash)
+    def generate_signed_transaction(self, amount, newpuzzlehash, strategy=None):
+        transaction = self.generate_unsigned_transaction(amount, newpuzzlehash, strategy)
         if transaction is None:
             return None  # TODO: Should we throw a proper error here, or just return None?
         return self.sign_transaction(transaction)
 
+    def generate_signed_batch_transaction(self, payments, strategy=None):
+        transaction = self.generate_unsigned_batch_transaction(payments, strategy)
+        if transaction is None:
+            return None
+        return self.sign_transaction(transaction)
+
 
 """
 Copyright 2018 Chia Network Inc
@@ -1,13 +1,17 @@
 import asyncio
+import csv
+import sys
+from os import urandom
 from utilities.decorations import print_leaf, divider, prompt, start_list, close_list, selectable, informative
 from utilities.puzzle_utilities import puzzlehash_from_string
-from chiasim.hashable import Coin, Header, HeaderHash
+from chiasim.hashable import HeaderHash
 from chiasim.clients.ledger_sim import connect_to_ledger_sim
-from chiasim.wallet.deltas import additions_for_body, removals_for_body
-from chiasim.hashable.Body import Body
 from binascii import hexlify
 from authorised_payees import ap_wallet_a_functions
 from standard_wallet.wallet import Wallet
+from utilities.block_sync import BlockSync
+from utilities.preimage_cache import CachedLedgerAPI, PreimageCache
+from standard_wallet.wallet_store import WalletStore
 try:
     import qrcode
     from PIL import Image
@@ -72,7 +76,7 @@ async def make_payment(wallet, ledger_api):
     if wallet.current_balance <= 0:
         print("You need some money first")
         return None
-    while amount > wallet.temp_balance or amount < 0:
+    while amount > wallet.temp_balance or amount <= 0:
         amount = input(f"{prompt} Enter amount to give recipient: ")
         if amount == "q":
             return
@@ -87,6 +91,52 @@ async def make_payment(wallet, ledger_api):
         await ledger_api.push_tx(tx=tx)
 
 
+def read_payments_csv(fn):
+    """
+    Read (puzzlehash, amount) pairs from a csv file with one payment per row.
+    Blank rows and rows starting with '#' are ignored. A row repeating an
+    earlier payment is an error, as both would create the same coin.
+    """
+    payments = []
+    seen = set()
+    with open(fn, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) == 0 or row[0].strip().startswith("#"):
+                continue
+            puzzlehash = puzzlehash_from_string(row[0].strip())
+            amount = int(row[1])
+            if amount <= 0:
+                raise ValueError(f"invalid amount {row[1]}")
+            if (puzzlehash, amount) in seen:
+                raise ValueError(f"duplicate payment of {amount} to {puzzlehash}")
+            seen.add((puzzlehash, amount))
+            payments.append((puzzlehash, amount))
+    return payments
+
+
+async def make_bulk_payment(wallet, ledger_api):
+    if wallet.current_balance <= 0:
+        print("You need some money first")
+        return None
+    fn = input(f"{prompt} Enter csv file of puzzlehash,amount rows: ")
+    try:
+        payments = read_payments_csv(fn)
+    except Exception as e:
+        print(f"Couldn't read payments: {e}")
+        return None
+    if not payments:
+        print(f"There are no payments in {fn}")
+        return None
+    total = sum(amount for puzzlehash, amount in payments)
+    if total > wallet.temp_balance:
+        print(f"Insufficient funds: {total} needed, {wallet.temp_balance} available")
+        return None
+    tx = wallet.generate_signed_batch_transaction(payments)
+    if tx is not None:
+        await ledger_api.push_tx(tx=tx)
+        print(f"{informative} Paid {total} to {len(payments)} recipients")
+
+
 async def initiate_ap(wallet, ledger_api):
     if wallet.temp_balance <= 0:
         print("You need some money first")
@@ -96,7 +146,7 @@ async def initiate_ap(wallet, ledger_api):
     a_pubkey = wallet.get_next_public_key().serialize()
     b_pubkey = input("Enter recipient's pubkey: 0x")
     amount = -1
-    while amount > wallet.temp_balance or amount < 0:
+    while amount > wallet.temp_balance or amount <= 0:
         amount = input("Enter amount to give recipient: ")
         if amount == "q":
             return
@@ -137,52 +187,58 @@ async def initiate_ap(wallet, ledger_api):
         choice = input("Press 'c' to continue, or 'q' to quit to menu: ")
 
 
-async def process_blocks(wallet, ledger_api, last_known_header, current_header_hash):
-    r = await ledger_api.hash_preimage(hash=current_header_hash)
-    header = Header.from_bytes(r)
-    body = Body.from_bytes(await ledger_api.hash_preimage(hash=header.body_hash))
-    if header.previous_hash != last_known_header:
-        await process_blocks(wallet, ledger_api, last_known_header, header.previous_hash)
-    print(f'processing block {HeaderHash(header)}')
-    additions = list(additions_for_body(body))
-    removals = removals_for_body(body)
-    removals = [Coin.from_bytes(await ledger_api.hash_preimage(hash=x)) for x in removals]
-    wallet.notify(additions, removals)
+async def process_blocks(wallet, block_sync):
+    async for index, header, additions, removals in block_sync.new_blocks():
+        print(f'processing block {HeaderHash(header)}')
+        wallet.notify(additions, removals, index)
 
 
-async def farm_block(wallet, ledger_api, last_known_header):
+async def farm_block(wallet, block_sync):
     coinbase_puzzle_hash = wallet.get_new_puzzlehash()
     fees_puzzle_hash = wallet.get_new_puzzlehash()
-    r = await ledger_api.next_block(coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
-    header = r['header']
-    header_hash = HeaderHash(header)
-    tip = await ledger_api.get_tip()
-    await process_blocks(wallet,
-                         ledger_api,
-                         tip['genesis_hash'] if last_known_header is None else last_known_header,
-                         header_hash)
-    return header_hash
-
-
-async def update_ledger(wallet, ledger_api, most_recent_header):
-    r = await ledger_api.get_tip()
-    if r['tip_hash'] != most_recent_header:
-        await process_blocks(wallet,
-                             ledger_api,
-                             r['genesis_hash'] if most_recent_header is None else most_recent_header,
-                             r['tip_hash'])
-    return r['tip_hash']
+    r = await block_sync.ledger_api().next_block(
+        coinbase_puzzle_hash=coinbase_puzzle_hash, fees_puzzle_hash=fees_puzzle_hash)
+    block_sync.add_block(r['header'], r['body'])
+    await process_blocks(wallet, block_sync)
+    return block_sync.checkpoint()
 
 
-async def main_loop():
-    ledger_api = await connect_to_ledger_sim("localhost", 9868)
-    selection = ""
+async def update_ledger(wallet, block_sync):
+    await process_blocks(wallet, block_sync)
+    return block_sync.checkpoint()
+
+
+def open_wallet(store):
+    """
+    Ask for the seed of the wallet in store and restore it, or make a new
+    wallet and show its seed, which the store doesn't keep.
+    """
+    while store.has_wallet():
+        try:
+            return store.load(bytes.fromhex(input(f"{prompt} Enter your wallet seed: ")))
+        except ValueError as e:
+            print(f"Couldn't open the wallet: {e}")
     wallet = Wallet()
+    wallet.set_seed(urandom(32))
+    print(f"{informative} Your wallet seed is {wallet.seed.hex()}")
+    print(f"{informative} It isn't saved: keep it, you'll need it to open this wallet again.")
+    return wallet
+
+
+async def main_loop(store=None):
+    ledger_api = CachedLedgerAPI(await connect_to_ledger_sim("localhost", 9868), PreimageCache())
+    selection = ""
     print(divider)
     print_leaf()
+    wallet = Wallet() if store is None else open_wallet(store)
     r = await ledger_api.get_tip()
     most_recent_header = r['genesis_hash']
+    if store is not None and store.last_header() is not None:
+        most_recent_header = store.last_header()
+    block_sync = BlockSync(ledger_api, most_recent_header, on_reorg=wallet.clear_coins)
     while selection != "q":
+        if store is not None:
+            store.checkpoint(wallet, most_recent_header)
         print(divider)
         view_funds(wallet)
         print(divider)
@@ -194,36 +250,45 @@ async def main_loop():
         print(f"{selectable} 4: Print my details for somebody else")
         print(f"{selectable} 5: Set my wallet name")
         print(f"{selectable} 6: Initiate Authorised Payee")
+        print(f"{selectable} 7: Bulk Payment from CSV")
         if qrcode:
-            print(f"{selectable} 7: Make QR code")
-            print(f"{selectable} 8: Payment to QR code")
+            print(f"{selectable} 8: Make QR code")
+            print(f"{selectable} 9: Payment to QR code")
         print(f"{selectable} q: Quit")
         print(close_list)
         selection = input(prompt)
         if selection == "1":
             r = await make_payment(wallet, ledger_api)
         elif selection == "2":
-            most_recent_header = await update_ledger(wallet, ledger_api, most_recent_header)
+            most_recent_header = await update_ledger(wallet, block_sync)
         elif selection == "3":
-            most_recent_header = await farm_block(wallet, ledger_api, most_recent_header)
+            most_recent_header = await farm_block(wallet, block_sync)
         elif selection == "4":
             print_my_details(wallet)
         elif selection == "5":
             set_name(wallet)
         elif selection == "6":
             await initiate_ap(wallet, ledger_api)
+        elif selection == "7":
+            await make_bulk_payment(wallet, ledger_api)
         if qrcode:
-            if selection == "7":
+            if selection == "8":
                 make_QR(wallet)
-            elif selection == "8":
+            elif selection == "9":
                 r = read_qr(wallet)
                 if r is not None:
                     await ledger_api.push_tx(tx=r)
 
 
 def main():
+    # an optional wallet file keeps the wallet across restarts
+    store = WalletStore(sys.argv[1]) if len(sys.argv) > 1 else None
     run = asyncio.get_event_loop().run_until_complete
-    run(main_loop())
+    try:
+        run(main_loop(store))
+    finally:
+        if store is not None:
+            store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+"""
+Durable wallet state
+
+A WalletStore keeps a Wallet's state in a SQLite database in WAL mode, so
+a wallet survives restarts and resumes syncing from the last header it
+processed instead of replaying the chain from genesis.
+
+    meta    public hd key, derivation counter, name, the height of the
+            last block seen and the last processed header
+    utxos   the coins the wallet can spend
+    spent   the wallet's coins that have been spent, with the height they
+            were checkpointed at, so a block that is processed again can't
+            resurrect them
+
+The seed never touches the disk: the store only keeps the public hd key,
+and load needs the seed, which it checks against it.
+
+The store tracks which coins it last wrote, so a checkpoint only writes
+the coins that changed since the previous one. Spent coins are only kept
+for the wallet's dedup window; blocks further back count as processed once
+the wallet is restored, as they do for a running wallet. So loading reads
+each table once and is O(UTXOs); child keys are derived lazily as they're
+needed, as usual.
+"""
+
+import sqlite3
+
+from chiasim.hashable import Coin, HeaderHash
+
+from utilities.BLSHDKey import BLSPrivateHDKey
+
+from .coin_selection import UTXOSet
+from .seen_coins import DEDUP_WINDOW
+from .wallet import Wallet
+
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)",
+    "CREATE TABLE IF NOT EXISTS utxos (name BLOB PRIMARY KEY, coin BLOB)",
+    "CREATE TABLE IF NOT EXISTS spent (name BLOB PRIMARY KEY, coin BLOB, height INTEGER)",
+    "CREATE INDEX IF NOT EXISTS spent_height ON spent (height)",
+]
+
+
+class WalletStore:
+    """
+    spent_window is how many block heights spent coins are kept for.
+    """
+
+    def __init__(self, path, spent_window=DEDUP_WINDOW):
+        self._spent_window = spent_window
+        self._db = sqlite3.connect(str(path))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps commits durable against crashes of the wallet process
+        # without an fsync on every checkpoint
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+        self._stored_utxos = set(_[0] for _ in self._db.execute("SELECT name FROM utxos"))
+
+    def close(self):
+        self._db.close()
+
+    def _get_meta(self, key, default=None):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    def has_wallet(self):
+        return self._get_meta("public_hd_key") is not None
+
+    def last_header(self):
+        """
+        Return the hash of the last header checkpointed, or None.
+        """
+        header_hash = self._get_meta("last_header")
+        if header_hash is None:
+            return None
+        return HeaderHash.from_bytes(header_hash)
+
+    def checkpoint(self, wallet, header_hash=None):
+        """
+        Write the wallet's state, with header_hash as the last block it has
+        processed, in a single transaction.
+        """
+        utxos = dict((bytes(coin.name()), coin) for coin in wallet.my_utxos)
+        tip = wallet.seen_additions.tip()
+        with self._db:
+            meta = [
+                ("public_hd_key", bytes(wallet.extended_secret_key.public_hd_key())),
+                ("next_address", wallet.next_address),
+                ("name", wallet.name),
+            ]
+            if tip is not None:
+                meta.append(("tip", tip))
+            if header_hash is not None:
+                meta.append(("last_header", bytes(header_hash)))
+            self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta)
+            spent = [(tip or 0, _) for _ in self._stored_utxos if _ not in utxos]
+            self._db.executemany(
+                "INSERT OR IGNORE INTO spent (name, coin, height) SELECT name, coin, ? FROM utxos WHERE name = ?",
+                spent)
+            self._db.executemany("DELETE FROM utxos WHERE name = ?", [(_,) for height, _ in spent])
+            if tip is not None:
+                self._db.execute("DELETE FROM spent WHERE height <= ?", (tip - self._spent_window,))
+            self._db.executemany(
+                "INSERT INTO utxos (name, coin) VALUES (?, ?)",
+                [(name, bytes(coin)) for name, coin in utxos.items() if name not in self._stored_utxos])
+        self._stored_utxos = set(utxos)
+
+    def load(self, seed, wallet_class=Wallet):
+        """
+        Return a new wallet_class instance with seed restored from the
+        store, or None if no wallet has been checkpointed yet. Raise
+        ValueError if seed isn't the stored wallet's.
+        """
+        public_hd_key = self._get_meta("public_hd_key")
+        if public_hd_key is None:
+            return None
+        if bytes(BLSPrivateHDKey.from_seed(seed).public_hd_key()) != public_hd_key:
+            raise ValueError("that seed isn't this wallet's")
+        wallet = wallet_class()
+        wallet.set_seed(seed)
+        wallet.next_address = self._get_meta("next_address")
+        wallet.name = self._get_meta("name")
+        utxos = [Coin.from_bytes(_[0]) for _ in self._db.execute("SELECT coin FROM utxos")]
+        spent = [Coin.from_bytes(_[0]) for _ in self._db.execute("SELECT coin FROM spent")]
+        wallet.my_utxos = set(utxos)
+        wallet.current_balance = sum(coin.amount for coin in utxos)
+        for coin in utxos:
+            wallet.seen_additions.add(coin.name(), keep=True)
+        for coin in spent:
+            wallet.seen_additions.add(coin.name(), keep=True)
+            wallet.seen_deletions.add(coin.name(), keep=True)
+        tip = self._get_meta("tip")
+        if tip is not None:
+            wallet.seen_additions.set_tip(tip)
+            wallet.seen_deletions.set_tip(tip)
+        wallet.temp_utxos = UTXOSet(wallet.my_utxos)
+        wallet.temp_balance = wallet.current_balance
+        return wallet
@@ -0,0 +1,24 @@
+from benchmarks.benchmark_puzzles import compare, puzzle_cases, run
+
+
+def report(**results):
+    return dict(results=results)
+
+
+def test_compare():
+    old = report(a=dict(construct_us=10.0, cost=100, puzzle_size=50), b=dict(hash_us=5.0))
+    assert compare(old, old) == []
+    new = report(a=dict(construct_us=10.5, cost=101, puzzle_size=49), b=dict(hash_us=6.0), c=dict(hash_us=1.0))
+    assert compare(old, new) == [("a", "cost", 100, 101), ("b", "hash_us", 5.0, 6.0)]
+    assert compare(old, new, threshold=0.01) == [
+        ("a", "cost", 100, 101), ("a", "construct_us", 10.0, 10.5), ("b", "hash_us", 5.0, 6.0)]
+    broken = report(a=dict(construct_us=10.0, error="EvalError: clvm raise"), b=dict(hash_us=5.0))
+    assert compare(old, broken) == [("a", "error", None, "EvalError: clvm raise")]
+
+
+def test_every_case_runs():
+    results = run(count=1)["results"]
+    assert set(results) == {_.name for _ in puzzle_cases()}
+    for name, result in results.items():
+        assert "error" not in result, name
+        assert result["cost"] > 0
@@ -0,0 +1,98 @@
+import itertools
+import random
+
+import pytest
+
+from chiasim.hashable import Coin
+
+from standard_wallet.coin_selection import STRATEGIES, UTXOSet, select_coins
+
+
+def make_coins(amounts):
+    return [Coin(_.to_bytes(32, "big"), bytes(32), amount) for _, amount in enumerate(amounts)]
+
+
+def subset_sums(coins):
+    sums = set()
+    for count in range(len(coins) + 1):
+        for subset in itertools.combinations(coins, count):
+            sums.add(sum(coin.amount for coin in subset))
+    return sums
+
+
+@pytest.mark.parametrize("strategy", sorted(STRATEGIES.keys()))
+def test_strategies_cover_amount(strategy):
+    r = random.Random(strategy)
+    for _ in range(200):
+        coins = make_coins([r.randint(1, 50) for _ in range(r.randint(1, 10))])
+        utxos = UTXOSet(coins)
+        amount = r.randint(1, 200)
+        selected = select_coins(utxos, amount, strategy)
+        if selected is None:
+            if strategy == "exact":
+                assert amount not in subset_sums(coins)
+            else:
+                assert sum(coin.amount for coin in coins) < amount
+            continue
+        assert len(set(selected)) == len(selected)
+        assert all(coin in utxos for coin in selected)
+        total = sum(coin.amount for coin in selected)
+        assert total >= amount
+        if strategy == "exact":
+            assert total == amount
+
+
+def test_exact_avoids_change():
+    utxos = UTXOSet(make_coins([100, 70, 50, 30, 20, 1]))
+    selected = select_coins(utxos, 90, "exact")
+    assert sum(coin.amount for coin in selected) == 90
+    assert [coin.amount for coin in select_coins(utxos, 70)] == [70]
+
+
+def test_largest_first_minimises_inputs():
+    utxos = UTXOSet(make_coins([1] * 50 + [500, 1000]))
+    selected = select_coins(utxos, 1200, "largest_first")
+    assert sorted(coin.amount for coin in selected) == [500, 1000]
+    selected = select_coins(utxos, 10, "smallest_first")
+    assert [coin.amount for coin in selected] == [1] * 10
+
+
+def test_zero_value_coins_are_skipped():
+    utxos = UTXOSet(make_coins([0, 0, 5]))
+    for strategy in STRATEGIES:
+        assert [coin.amount for coin in select_coins(utxos, 5, strategy)] == [5]
+
+
+def test_utxo_set_index():
+    coins = make_coins(range(1, 20))
+    utxos = UTXOSet(coins)
+    assert utxos.sorted_amounts() == list(range(1, 20))
+    utxos.remove(coins[4])
+    utxos.add(Coin(bytes(32), bytes(32), 7))
+    utxos.pop()
+    copy = utxos.copy()
+    assert isinstance(copy, UTXOSet)
+    copy.discard(coins[0])
+    for s in (utxos, copy):
+        assert s.sorted_amounts() == sorted(coin.amount for coin in s)
+
+
+def test_large_utxo_set():
+    r = random.Random(0)
+    utxos = UTXOSet(make_coins([r.randint(1, 10 ** 6) for _ in range(100000)]))
+    for strategy in STRATEGIES:
+        selected = select_coins(utxos, 12345678, strategy)
+        assert sum(coin.amount for coin in selected) >= 12345678
+
+
+def test_rl_wallet_select_coins_strategy():
+    from rate_limit.rl_wallet import RLWallet
+
+    coins = make_coins([10, 100, 1000])
+    for strategy, expected in [("largest_first", [1000]), ("smallest_first", [10, 100])]:
+        wallet = RLWallet()
+        wallet.temp_utxos = UTXOSet(coins)
+        wallet.temp_balance = 1110
+        # the strategy is the second argument, as Wallet.select_coins takes it
+        selected = wallet.select_coins(60, strategy)
+        assert sorted(coin.amount for coin in selected) == expected
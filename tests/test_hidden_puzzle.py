@@ -0,0 +1,48 @@
+from chiasim.hack.keys import public_key_bytes_for_index
+from chiasim.hashable import Program, ProgramHash
+from clvm_tools import binutils
+
+from puzzles import p2_conditions
+from puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    DEFAULT_HIDDEN_PUZZLE, PUZZLE_CLVM, TEMPLATE, calculate_synthetic_public_key, hidden_puzzle_hash, load_clvm,
+    puzzle_for_public_key_and_hidden_puzzle, puzzle_hashes_for_public_keys, run, synthetic_public_key_for_hash,
+    synthetic_public_keys,
+)
+
+
+def clvm_synthetic_public_key(public_key, hidden_puzzle):
+    return run(
+        "(point_add (f (a)) (pubkey_for_exp (sha256 (f (a)) (sha256tree (r (a))))))",
+        (public_key, hidden_puzzle),
+    )
+
+
+def test_synthetic_public_key():
+    hidden_puzzle = p2_conditions.puzzle_for_conditions([])
+    public_keys = [public_key_bytes_for_index(_) for _ in range(10)]
+    for hidden in (DEFAULT_HIDDEN_PUZZLE, hidden_puzzle):
+        expected = [clvm_synthetic_public_key(_, hidden) for _ in public_keys]
+        assert [calculate_synthetic_public_key(_, hidden) for _ in public_keys] == expected
+        assert synthetic_public_keys(public_keys, hidden) == expected
+
+
+def test_synthetic_public_key_for_hash():
+    # a hidden puzzle that's a tree, whose tree hash isn't the hash of its serialization
+    hidden_puzzle = binutils.assemble("(q ((51 0x%s 100)))" % ("ab" * 32))
+    assert hidden_puzzle_hash(hidden_puzzle) == run("(sha256tree (a))", hidden_puzzle)
+    for public_key in [public_key_bytes_for_index(_) for _ in range(3)]:
+        assert synthetic_public_key_for_hash(public_key, hidden_puzzle_hash(hidden_puzzle)) == \
+            clvm_synthetic_public_key(public_key, hidden_puzzle)
+
+
+def test_puzzle_for_synthetic_public_key():
+    public_keys = [public_key_bytes_for_index(_) for _ in range(5)]
+    expected = []
+    for public_key in public_keys:
+        synthetic_public_key = clvm_synthetic_public_key(public_key, DEFAULT_HIDDEN_PUZZLE)
+        puzzle = Program(binutils.assemble("((c (q %s) (c (q 0x%s) (a))))" % (
+            binutils.disassemble(load_clvm(PUZZLE_CLVM)), synthetic_public_key.hex())))
+        assert bytes(puzzle_for_public_key_and_hidden_puzzle(public_key)) == bytes(puzzle)
+        expected.append(ProgramHash(puzzle))
+    assert puzzle_hashes_for_public_keys(public_keys) == expected
+    assert TEMPLATE.parameters() == ["synthetic_public_key"]
@@ -0,0 +1,46 @@
+import os
+import pathlib
+import tempfile
+
+import pytest
+
+from chiasim.hashable import Program
+
+from puzzles import load_clvm
+
+
+def write_hex(program):
+    path = pathlib.Path(tempfile.mkdtemp(), "test.clvm.hex")
+    path.write_text(bytes(program).hex())
+    return path
+
+
+def test_load_clvm_is_cached(monkeypatch):
+    program = Program.to([1, [2, 3]])
+    path = write_hex(program)
+    monkeypatch.setattr(load_clvm, "path_list_for_filename", lambda filename: iter([path]))
+    monkeypatch.setattr(load_clvm, "_programs", {})
+    loaded = load_clvm.load_clvm("test.clvm")
+    assert bytes(loaded) == bytes(program)
+    path.unlink()
+    assert load_clvm.load_clvm("test.clvm") is loaded
+    with pytest.raises(FileNotFoundError):
+        load_clvm.load_clvm("missing.clvm")
+
+
+def test_keep_binary():
+    program = Program.to([1, [2, 3]])
+    path = write_hex(program)
+    bin_path = load_clvm.binary_path(path)
+    assert bytes(load_clvm.read_clvm(path)) == bytes(program)
+    assert not bin_path.exists()
+    assert bytes(load_clvm.read_clvm(path, keep_binary=True)) == bytes(program)
+    assert bin_path.read_bytes() == bytes(program)
+
+    # the binary is used while it's up to date with the hex
+    other = Program.to([4, 5])
+    bin_path.write_bytes(bytes(other))
+    assert bytes(load_clvm.read_clvm(path)) == bytes(other)
+    stat = bin_path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert bytes(load_clvm.read_clvm(path)) == bytes(program)
@@ -0,0 +1,68 @@
+from os import urandom
+
+import pytest
+
+from chiasim.hashable import Program, ProgramHash
+from chiasim.utils.run_program import run_program
+from clvm_tools import binutils
+
+from puzzles.p2_puzzle_in_merkle_tree import (
+    LEAF_PREFIX, NODE_PREFIX, MerkleTree, hash_f, hash_tree, puzzle_for_tree_hash, puzzle_hash_for_tree_hash,
+    root_for_proof, solution_for_puzzle,
+)
+
+
+def nested_root(nodes):
+    # the straightforward recursive definition the flat tree must agree with
+    if len(nodes) == 1:
+        return nodes[0]
+    parents = [hash_f(NODE_PREFIX + nodes[_] + nodes[_ + 1]) for _ in range(0, len(nodes) - 1, 2)]
+    return nested_root(parents + nodes[len(parents) * 2:])
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8, 13])
+def test_proofs(count):
+    leaves = [urandom(32) for _ in range(count)]
+    tree = MerkleTree(leaves)
+    assert tree.root() == nested_root([hash_f(LEAF_PREFIX + _) for _ in leaves]) == hash_tree(leaves)
+    assert len(tree) == count
+    proofs = tree.proofs(range(count))
+    for index, leaf in enumerate(leaves):
+        assert tree.index(leaf) == index
+        proof = tree.proof(index)
+        assert proofs[index] == proof
+        assert len(proof) <= tree.depth()
+        assert root_for_proof(leaf, proof) == tree.root()
+        assert root_for_proof(urandom(32), proof) != tree.root()
+    assert tree.index(urandom(32)) is None
+    with pytest.raises(IndexError):
+        tree.proof(count)
+
+
+def test_second_preimages():
+    leaves = [urandom(32) for _ in range(4)]
+    tree = MerkleTree(leaves)
+    # repeating the last leaf of an odd level doesn't give the same root
+    assert MerkleTree(leaves[:3]).root() != MerkleTree(leaves[:3] + leaves[2:3]).root()
+    # a node doesn't pass for a leaf
+    left, right = hash_tree(leaves[:2]), hash_tree(leaves[2:])
+    assert hash_f(NODE_PREFIX + left + right) == tree.root()
+    assert root_for_proof(left, [(0, right)]) != tree.root()
+
+
+def test_puzzle():
+    conditions = ["(q ((51 0x%s %d)))" % (urandom(32).hex(), _) for _ in range(5)]
+    puzzles = [Program(binutils.assemble(_)) for _ in conditions]
+    tree = MerkleTree([ProgramHash(_) for _ in puzzles])
+    puzzle = puzzle_for_tree_hash(tree.root())
+    assert ProgramHash(puzzle) == puzzle_hash_for_tree_hash(tree.root())
+    for inner_puzzle in puzzles:
+        cost, r = run_program(puzzle, solution_for_puzzle(tree, inner_puzzle, Program.to([])))
+        assert r == run_program(inner_puzzle, Program.to([]))[1]
+
+    other_tree = MerkleTree([ProgramHash(_) for _ in puzzles[:4]])
+    solution = solution_for_puzzle(other_tree, puzzles[0], Program.to([]))
+    with pytest.raises(Exception):
+        run_program(puzzle, solution)
+    with pytest.raises(ValueError):
+        solution_for_puzzle(tree, Program.to([1]), Program.to([]))
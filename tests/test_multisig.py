@@ -1,8 +1,14 @@
 import asyncio
+import os
 import pathlib
+import stat
 import tempfile
+import zlib
 from aiter import map_aiter
 
+import cbor
+import pytest
+
 from chiasim.utils.log import init_logging
 from chiasim.remote.api_server import api_server
 from chiasim.remote.client import request_response_proxy
@@ -12,10 +18,14 @@ from chiasim.storage import RAM_DB
 from chiasim.utils.server import start_unix_server_aiter
 
 from multisig.address import puzzle_hash_for_address
-from multisig.pst import PartiallySignedTransaction
-from multisig.signer import generate_signatures
+from multisig.combiner import SignatureVerifier, combine
+from multisig.pst import FLAG_ZLIB, MAGIC, MAX_PST_SIZE, VERSION, PartiallySignedTransaction
+from multisig.puzzle_hash_store import PuzzleHashStore
+from multisig.signer import generate_signature_pairs, generate_signatures, read_psts, sign_batch, sign_psts
+from multisig.signer_daemon import SignerDaemon, request_signatures
 from multisig.storage import Storage
 from multisig.wallet import spend_coin, finalize_pst, main_loop, all_coins_and_unspents
+from multisig.wallet import LookaheadWatcher
 from multisig.wallet import MultisigHDWallet
 
 from utilities.BLSHDKey import BLSPrivateHDKey
@@ -79,6 +89,41 @@ def test_pst_serialization():
     assert bytes(pst) == bytes(pst_1)
 
 
+def test_compact_pst_serialization():
+    run = asyncio.get_event_loop().run_until_complete
+
+    remote = make_client_server()
+
+    wallet, private_wallets = create_wallet(2, 5)
+    coins = [run(coin_for_address(remote, wallet.address_for_index(_))) for _ in [0, 0, 0, 1]]
+    pst = spend_coin(wallet, coins, wallet.address_for_index(10))
+
+    cbor_blob = pst.cbor_bytes()
+    for compress in [False, True]:
+        blob = pst.to_bytes(compress=compress)
+        # the puzzle reveal for index 0 and the delegated spend are only kept once
+        assert len(blob) < len(cbor_blob)
+        pst_1 = PartiallySignedTransaction.from_bytes(blob)
+        assert pst_1 == pst
+        assert pst_1.to_bytes(compress=compress) == blob
+        assert pst_1.cbor_bytes() == cbor_blob
+        assert PartiallySignedTransaction.from_bytes(memoryview(blob)) == pst
+
+    # signers can still be handed cbor, which bytes(pst) still is
+    assert bytes(pst) == cbor_blob
+    assert cbor.loads(bytes(pst))["coin_solutions"]
+    pst_2 = PartiallySignedTransaction.from_bytes(cbor_blob)
+    assert pst_2 == pst
+    assert bytes(pst_2) == bytes(pst)
+
+    # compressed payloads are only decompressed up to MAX_PST_SIZE, and must be all used
+    header = MAGIC + bytes([VERSION, FLAG_ZLIB])
+    compressed = pst.to_bytes(compress=True)
+    for blob in [header + zlib.compress(bytes(MAX_PST_SIZE + 1)), compressed + b"more", compressed[:-4]]:
+        with pytest.raises(ValueError):
+            PartiallySignedTransaction.from_bytes(blob)
+
+
 def test_multisig_spend():
     remote = make_client_server()
 
@@ -143,6 +188,290 @@ def test_multisig_spend_two():
     assert r["response"].startswith("accepted SpendBundle")
 
 
+def test_multisig_spend_signature_pairs():
+    remote = make_client_server()
+
+    run = asyncio.get_event_loop().run_until_complete
+
+    M, N = 2, 5
+    wallet, private_wallets = create_wallet(M, N)
+
+    coins = [run(coin_for_address(remote, wallet.address_for_index(_))) for _ in range(3)]
+
+    dest_address = wallet.address_for_index(100)
+    pst = spend_coin(wallet, coins, dest_address)
+
+    # the first key's pairs carry signatures for the wrong messages
+    bad_pairs = generate_signature_pairs(pst, private_wallets[0])
+    sig_pairs = [(bad_pairs[_][0], bad_pairs[_ - 1][1]) for _ in range(len(bad_pairs))]
+
+    spend_bundle, summary_list = finalize_pst(wallet, pst, sig_pairs)
+    assert spend_bundle is None
+    assert [len(_[2]) for _ in summary_list] == [1, 1, 1]
+
+    for pw in private_wallets[1:M + 1]:
+        sig_pairs.extend(generate_signature_pairs(pst, pw))
+
+    spend_bundle, summary_list = finalize_pst(wallet, pst, sig_pairs)
+
+    r = run(remote.push_tx(tx=spend_bundle))
+    assert r["response"].startswith("accepted SpendBundle")
+
+
+def test_combine():
+    remote = make_client_server()
+
+    run = asyncio.get_event_loop().run_until_complete
+
+    M, N = 2, 3
+    wallet, private_wallets = create_wallet(M, N)
+
+    dest_address = wallet.address_for_index(100)
+    psts = []
+    for index in range(4):
+        coins = [run(coin_for_address(remote, wallet.address_for_index(index)))]
+        psts.append(spend_coin(wallet, coins, dest_address))
+
+    # the first signer signs everything, twice, but its pairs are mixed up for the first pst
+    outputs = [generate_signature_pairs(pst, private_wallets[0]) for pst in psts]
+    outputs.append(outputs[1])
+    bad_pairs = generate_signature_pairs(psts[0], private_wallets[0])
+    outputs[0] = [(bad_pairs[0][0], outputs[1][0][1])]
+
+    # the second signer's output is saved to a file, and has no signature for the last pst
+    path = pathlib.Path(tempfile.mkdtemp(), "signatures")
+    with open(path, "w") as f:
+        print("SIGNATURES:", file=f)
+        for pst in psts[:3]:
+            for aggsig_pair, sig in generate_signature_pairs(pst, private_wallets[1]):
+                print("%s:%s" % (bytes(aggsig_pair).hex(), bytes(sig).hex()), file=f)
+    outputs.append(str(path))
+
+    # the third signer only signs the first pst, without pairs
+    outputs.append(generate_signatures(psts[0], private_wallets[2]))
+
+    results = combine(wallet, psts, outputs, pool_size=2, serial_threshold=1)
+    assert [_[0] is None for _ in results] == [False, False, False, True]
+
+    # a verifier kept across combines verifies each signature once, on one pool
+    class CountingVerifier(SignatureVerifier):
+        verified = 0
+
+        def _verify_new(self, jobs):
+            CountingVerifier.verified += len(jobs)
+            return super()._verify_new(jobs)
+
+    verifier = CountingVerifier(pool_size=2, serial_threshold=1)
+    combine(wallet, psts, outputs[:2], verifier=verifier)
+    executor, verified = verifier._executor, CountingVerifier.verified
+    assert executor is not None
+    results = combine(wallet, psts, outputs, verifier=verifier)
+    assert [_[0] is None for _ in results] == [False, False, False, True]
+    assert verifier._executor is executor
+    assert CountingVerifier.verified > verified
+    verified = CountingVerifier.verified
+    combine(wallet, psts, outputs, verifier=verifier)
+    assert CountingVerifier.verified == verified
+    verifier.close()
+    assert [len(_[2]) for _ in results[3][1]] == [1]
+    for spend_bundle, summary_list in results[:3]:
+        r = run(remote.push_tx(tx=spend_bundle))
+        assert r["response"].startswith("accepted SpendBundle")
+
+
+def test_sign_batch():
+    remote = make_client_server()
+
+    run = asyncio.get_event_loop().run_until_complete
+
+    M, N = 2, 3
+    wallet, private_wallets = create_wallet(M, N)
+
+    dest_address = wallet.address_for_index(100)
+    psts = []
+    for index in [0, 1, 1]:
+        coins = [run(coin_for_address(remote, wallet.address_for_index(index)))]
+        psts.append(spend_coin(wallet, coins, dest_address))
+
+    expected = [generate_signature_pairs(_, private_wallets[0]) for _ in psts]
+    assert sign_psts(psts, private_wallets[0], pool_size=0) == expected
+    assert sign_psts(psts, private_wallets[0], pool_size=2, serial_threshold=1) == expected
+
+    pst_dir = pathlib.Path(tempfile.mkdtemp())
+    for name, pst in zip("abc", psts):
+        (pst_dir / name).write_text(bytes(pst).hex())
+    output_paths = []
+    for private_wallet in private_wallets[:M]:
+        path = pathlib.Path(tempfile.mkdtemp(), "signatures")
+        with open(path, "w") as f:
+            signature_count, elapsed = sign_batch(read_psts(pst_dir), private_wallet, f, pool_size=0)
+        assert signature_count == 3
+        output_paths.append(str(path))
+
+    for spend_bundle, summary_list in combine(wallet, psts, output_paths, pool_size=0):
+        r = run(remote.push_tx(tx=spend_bundle))
+        assert r["response"].startswith("accepted SpendBundle")
+
+
+def test_signer_daemon():
+    remote = make_client_server()
+
+    run = asyncio.get_event_loop().run_until_complete
+
+    wallet, private_wallets = create_wallet(2, 3)
+    dest_address = wallet.address_for_index(100)
+    psts = []
+    for index in range(3):
+        coins = [run(coin_for_address(remote, wallet.address_for_index(index)))]
+        psts.append(spend_coin(wallet, coins, dest_address))
+    expected = [generate_signature_pairs(_, private_wallets[0]) for _ in psts]
+
+    for pool_size in [0, 2]:
+        path = pathlib.Path(tempfile.mkdtemp(), "signer.sock")
+        daemon = SignerDaemon(private_wallets[0], pool_size)
+        umask = os.umask(0o022)
+        run(daemon.start(path))
+        # the umask is restored once the socket exists
+        assert os.umask(umask) == 0o022
+        assert stat.S_IMODE(path.stat().st_mode) == 0o600
+        # two clients at once
+        results = run(asyncio.gather(request_signatures(path, psts), request_signatures(path, psts[1:])))
+        assert results == [expected, expected[1:]]
+        with pytest.raises(ValueError):
+            run(request_signatures(path, [b"not a pst"]))
+        run(daemon.close())
+
+    class SlowDaemon(SignerDaemon):
+        signing = max_signing = 0
+
+        async def sign(self, pst_blob):
+            SlowDaemon.signing += 1
+            SlowDaemon.max_signing = max(SlowDaemon.max_signing, SlowDaemon.signing)
+            await asyncio.sleep(0.1 if pst_blob == psts[0].to_bytes() else 0.05)
+            SlowDaemon.signing -= 1
+            return await super().sign(pst_blob)
+
+    # one client's batch is signed concurrently, and answered in order
+    path = pathlib.Path(tempfile.mkdtemp(), "signer.sock")
+    daemon = SlowDaemon(private_wallets[0], 0)
+    run(daemon.start(path))
+    assert run(request_signatures(path, psts)) == expected
+    assert SlowDaemon.max_signing == len(psts)
+    run(daemon.close())
+
+
+def test_derive_puzzle_hashes():
+    wallet, private_wallets = create_wallet(2, 3)
+    # computing doesn't record anything, so it's safe off the wallet's thread
+    computed = wallet.compute_puzzle_hashes(range(20, 40), pool_size=2, serial_threshold=1)
+    assert wallet.compute_puzzle_hashes([20], pool_size=0) == computed[:1]
+    assert wallet.missing_indexes(range(20, 40)) == list(range(20, 40))
+    pairs = wallet.derive_puzzle_hashes(range(20), pool_size=2, serial_threshold=1)
+    assert [_[0] for _ in pairs] == list(range(20))
+    serial_wallet, private_wallets = create_wallet(2, 3)
+    for index, puzzle_hash in pairs:
+        assert serial_wallet.puzzle_hash_for_index(index) == puzzle_hash
+        assert wallet.index_for_puzzle_hash(puzzle_hash, 0) == index
+    assert wallet.derive_puzzle_hashes(range(20)) == []
+
+    # the pool is kept for the next batch
+    executor = wallet._executor
+    more_pairs = wallet.derive_puzzle_hashes(range(40), pool_size=2, serial_threshold=1)
+    assert [_[0] for _ in more_pairs] == list(range(20, 40))
+    assert [_[1] for _ in more_pairs] == computed
+    assert wallet._executor is executor
+    # a search that misses derives up to its limit on the pool, and finds nothing
+    assert wallet.index_for_puzzle_hash(bytes(32), 100) is None
+    assert wallet.missing_indexes(range(101)) == []
+    wallet.close()
+    assert wallet._executor is None
+
+
+def test_puzzle_hash_store():
+    path = pathlib.Path(tempfile.mkdtemp(), "wallet.json.puzzle_hashes")
+    wallet, private_wallets = create_wallet(2, 3)
+    wallet.set_puzzle_hash_store(PuzzleHashStore(path))
+    wallet.derive_puzzle_hashes(range(10), pool_size=0)
+    wallet.note_used_indexes([3, 7])
+    wallet.save_puzzle_hashes()
+
+    reopened, private_wallets = create_wallet(2, 3)
+    reopened.set_puzzle_hash_store(PuzzleHashStore(path))
+    assert reopened.derive_puzzle_hashes(range(10)) == []
+    assert reopened.lookahead_count() == wallet.lookahead_count()
+    assert [reopened.puzzle_hash_for_index(_) for _ in range(10)] == [
+        wallet.puzzle_hash_for_index(_) for _ in range(10)]
+
+    # a store for other keys starts over
+    other_wallet, private_wallets = create_wallet(1, 3)
+    other_wallet.set_puzzle_hash_store(PuzzleHashStore(path))
+    assert len(other_wallet.derive_puzzle_hashes(range(10), pool_size=0)) == 10
+
+
+def test_lookahead():
+    wallet = MultisigHDWallet(2, [], gap_limit=10)
+    assert wallet.lookahead_count() == 10
+    assert not wallet.note_used_indexes([])
+    assert wallet.note_used_indexes([5])
+    assert wallet.lookahead_count() == 16
+    assert wallet.note_used_indexes([30])
+    assert (wallet.highest_used_index(), wallet.gap_limit(), wallet.lookahead_count()) == (30, 24, 55)
+    # filling in a gap doesn't shrink the largest gap seen
+    assert not wallet.note_used_indexes([20, 5])
+    assert wallet.lookahead_count() == 55
+
+
+def test_sync_grows_lookahead():
+    run = asyncio.get_event_loop().run_until_complete
+
+    remote = make_client_server()
+    wallet, private_wallets = create_wallet(1, 2)
+    wallet = MultisigHDWallet(1, wallet.pub_hd_keys(), gap_limit=20)
+    storage = Storage(pathlib.Path(tempfile.mkdtemp(), "coins"), remote)
+
+    # each coin is only in the lookahead once the one before it is seen
+    for index in [15, 30, 45]:
+        run(coin_for_address(remote, wallet.address_for_index(index)))
+    run(remote.next_block(coinbase_puzzle_hash=wallet.puzzle_hash_for_index(55),
+                          fees_puzzle_hash=wallet.puzzle_hash_for_index(60)))
+
+    watcher = LookaheadWatcher(wallet, storage)
+    run(watcher.ready())
+    assert watcher.watched_count() == 20
+    run(storage.sync())
+    coins, unspents = run(all_coins_and_unspents(storage))
+    assert sorted(wallet.index_for_puzzle_hash(_.puzzle_hash) for _ in coins) == [15, 15, 30, 30, 45, 45, 55, 60]
+    assert wallet.highest_used_index() == 60
+    assert watcher.watched_count() == wallet.lookahead_count() == 81
+
+
+def test_storage_reopen():
+    run = asyncio.get_event_loop().run_until_complete
+
+    remote = make_client_server()
+    wallet, private_wallets = create_wallet(1, 2)
+    path = pathlib.Path(tempfile.mkdtemp(), "coins")
+    storage = Storage(path, remote)
+    storage.add_interested_puzzle_hashes(wallet.puzzle_hash_for_index(_) for _ in range(3))
+    coins = [run(coin_for_address(remote, wallet.address_for_index(_))) for _ in range(3)]
+    run(coin_for_address(remote, wallet.address_for_index(10)))
+    assert run(storage.sync()) == 4
+    storage.close()
+
+    storage = Storage(path, remote)
+    assert run(storage.sync()) == 0
+    unspents = run(storage.unspent_coins_for_puzzle_hashes([coins[0].puzzle_hash, coins[2].puzzle_hash]))
+    assert set(_.name() for _ in unspents) > {coins[0].name(), coins[2].name()}
+    assert run(storage.unspent_for_coin_name(coins[1].name())).confirmed_block_index == 1
+
+    # blocks after a rollback are synced again
+    run(storage.rollback_to_block(1))
+    assert run(storage.unspent_for_coin_name(coins[2].name())) is None
+    assert run(storage.hash_preimage(hash=coins[1].name())) == bytes(coins[1])
+    assert run(storage.sync()) == 2
+    assert run(storage.hash_preimage(hash=coins[2].name())) == bytes(coins[2])
+
+
 def input_for(strings):
     def my_input(*args):
         nonlocal strings
@@ -165,7 +494,7 @@ def test_ui_process():
     PATH = Path(tempfile.mktemp())
     remote = make_client_server()
 
-    storage = Storage("junk path", remote)
+    storage = Storage(pathlib.Path(tempfile.mkdtemp(), "coins"), remote)
 
     # create the wallet
 
@@ -213,6 +542,7 @@ def test_ui_process():
         "",
         "42cd0487d583c348229d1de188e8523ab814a808435bf61e1f27f81775197339d72117d870bc421d64244ac5c0440105076a40c385907a920fae054b683874a81d5adcc64cb4d70afc27f4b4ab83e4830597d5a272cf9f9056d9d19357d5bc8c",
         "4917f65ce8d46c3b14fb32ae9d1202b48b12770ab52d0dda33c896f9442cc8c26c978c257a354667c0bcd7160f7b5b24117a7a3b102f0ccb1d06a2069d28474e1ead4eae0c86d449ff95404241a413d893f97fe7e6a745f1078dc1516634f916",
+        "",
         "y",
         "q",
     ]
@@ -0,0 +1,29 @@
+from os import urandom
+
+from chiasim.hashable import Program, ProgramHash
+
+from puzzles import p2_conditions
+
+
+def conditions_cases():
+    yield []
+    yield [[51, urandom(32), 1000]]
+    yield [[51, urandom(32), 1000], [51, urandom(32), 0], [50, urandom(48), urandom(32)]]
+    yield Program.to([[51, urandom(32), 12345678]])
+
+
+def test_matches_contract():
+    for conditions in conditions_cases():
+        puzzle = p2_conditions.puzzle_for_contract(p2_conditions.CONTRACT, conditions)
+        solution = p2_conditions.solution_for_contract(p2_conditions.CONTRACT, conditions, [])
+        assert bytes(p2_conditions.puzzle_for_conditions(conditions)) == bytes(puzzle)
+        assert ProgramHash(p2_conditions.puzzle_for_conditions(conditions)) == ProgramHash(puzzle)
+        assert bytes(p2_conditions.solution_for_conditions(conditions)) == bytes(Program.to(solution))
+
+
+def test_batch():
+    conditions_list = list(conditions_cases())
+    puzzles = p2_conditions.puzzles_for_conditions(conditions_list)
+    solutions = p2_conditions.solutions_for_conditions(conditions_list)
+    assert [bytes(_) for _ in puzzles] == [bytes(p2_conditions.puzzle_for_conditions(_)) for _ in conditions_list]
+    assert [bytes(_) for _ in solutions] == [bytes(p2_conditions.solution_for_conditions(_)) for _ in conditions_list]
@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+import os
+import pathlib
+import tempfile
+
+from utilities.preimage_cache import CachedLedgerAPI, PreimageCache
+
+
+def make_blobs(count, size=100):
+    blobs = [os.urandom(size) for _ in range(count)]
+    return [(hashlib.sha256(_).digest(), _) for _ in blobs]
+
+
+def cache_path():
+    return pathlib.Path(tempfile.mkdtemp(), "preimages")
+
+
+def test_put_get():
+    cache = PreimageCache(cache_path())
+    blobs = make_blobs(10)
+    for hash, blob in blobs:
+        assert cache.put(hash, blob)
+    for hash, blob in blobs:
+        assert cache.get(hash) == blob
+    assert cache.get(bytes(32)) is None
+    assert not cache.put(bytes(32), b"not the preimage")
+    assert bytes(32) not in cache
+
+
+def test_shared_between_instances():
+    path = cache_path()
+    cache_a = PreimageCache(path)
+    cache_b = PreimageCache(path)
+    blobs = make_blobs(10)
+    for hash, blob in blobs:
+        cache_a.put(hash, blob)
+    for hash, blob in blobs:
+        assert cache_b.get(hash) == blob
+    assert len(PreimageCache(path)) == 10
+
+
+def test_eviction():
+    path = cache_path()
+    cache = PreimageCache(path, max_size=10000)
+    blobs = make_blobs(200)
+    for hash, blob in blobs:
+        cache.put(hash, blob)
+    assert os.path.getsize(path) <= 10000
+    assert cache.get(blobs[0][0]) is None
+    assert cache.get(blobs[-1][0]) == blobs[-1][1]
+
+
+def test_damaged_records():
+    path = cache_path()
+    cache = PreimageCache(path)
+    blobs = make_blobs(3)
+    for hash, blob in blobs:
+        cache.put(hash, blob)
+    with open(path, "r+b") as f:
+        f.seek(40)
+        f.write(b"\0\0\0\0")
+    with open(path, "ab") as f:
+        f.write(b"\1" * 50)
+    cache = PreimageCache(path)
+    assert cache.get(blobs[0][0]) is None
+    assert cache.get(blobs[1][0]) == blobs[1][1]
+    hash, blob = make_blobs(1)[0]
+    assert cache.put(hash, blob)
+    assert PreimageCache(path).get(hash) == blob
+
+
+def test_cached_ledger_api():
+    blobs = dict(make_blobs(5))
+
+    class LedgerAPI:
+        calls = 0
+
+        async def hash_preimage(self, hash):
+            self.calls += 1
+            return blobs.get(hash)
+
+    run = asyncio.get_event_loop().run_until_complete
+    ledger_api = LedgerAPI()
+    cached = CachedLedgerAPI(ledger_api, PreimageCache(cache_path()))
+    for _ in range(3):
+        for hash, blob in blobs.items():
+            assert run(cached.hash_preimage(hash=hash)) == blob
+    assert run(cached.hash_preimage(hash=bytes(32))) is None
+    assert ledger_api.calls == 6
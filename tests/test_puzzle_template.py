@@ -0,0 +1,64 @@
+from os import urandom
+
+import pytest
+
+from chiasim.hashable import ProgramHash
+from chiasim.puzzles import p2_delegated_puzzle as chiasim_p2_delegated_puzzle
+
+from atomic_swaps.as_wallet import AS_TEMPLATE, as_puzzle_parameters
+from authorised_payees.ap_wallet_a_functions import AP_TEMPLATE
+from custody_wallet.custody_wallet import CPWallet
+from puzzles import p2_delegated_conditions, p2_delegated_puzzle, p2_m_of_n_delegate_direct, p2_puzzle_hash
+from puzzles.puzzle_template import PuzzleTemplate
+from rate_limit.rl_wallet import RLWallet
+from recoverable_wallet.recoverable_wallet import DurationType, ESCROW_TEMPLATES, PUZZLE_TEMPLATE
+
+
+def check_template(template, **values):
+    puzzle = template.puzzle(**values)
+    assembled = template.assemble(**values)
+    assert bytes(puzzle) == bytes(assembled)
+    assert template.puzzle_hash(**values) == ProgramHash(assembled)
+
+
+def test_p2_puzzles():
+    for _ in range(5):
+        public_key = urandom(48)
+        check_template(p2_delegated_puzzle.TEMPLATE, public_key=public_key)
+        check_template(p2_delegated_conditions.TEMPLATE, public_key=public_key)
+        check_template(p2_puzzle_hash.TEMPLATE, puzzle_hash=urandom(32))
+        assert p2_delegated_puzzle.puzzle_hash_for_pk(public_key) == ProgramHash(
+            chiasim_p2_delegated_puzzle.puzzle_for_pk(public_key))
+
+
+def test_wallet_puzzles():
+    check_template(AP_TEMPLATE, a_pubkey=urandom(48), b_pubkey=urandom(48))
+    check_template(CPWallet().cp_puzzle_template(), pubkey_my=urandom(48), pubkey_permission=urandom(48).hex(),
+                   unlock_time=1577836800000)
+    check_template(RLWallet().rl_puzzle_template(), pubkey=urandom(48), rate_amount=10, interval_time=5,
+                   origin_id=urandom(32), clawback_pk=urandom(48))
+    check_template(AS_TEMPLATE, **as_puzzle_parameters(
+        urandom(48), urandom(48), 1000, 20, "0x%s" % urandom(32).hex()))
+    for duration_type in DurationType:
+        check_template(ESCROW_TEMPLATES[duration_type], recovery_pubkey=urandom(48), pubkey=urandom(48),
+                       duration=100)
+    check_template(PUZZLE_TEMPLATE, pubkey=urandom(48), escrow_puzzlehash=urandom(32),
+                   stake_factor_numerator=11, stake_factor_denominator=10)
+
+
+def test_m_of_n_puzzle():
+    public_keys = [urandom(48) for _ in range(5)]
+    check_template(p2_m_of_n_delegate_direct.TEMPLATE, m=3, public_key_list=public_keys)
+    assert p2_m_of_n_delegate_direct.puzzle_hash_for_m_of_public_key_list(3, public_keys) == ProgramHash(
+        p2_m_of_n_delegate_direct.puzzle_for_m_of_public_key_list(3, public_keys))
+
+
+def test_atoms():
+    template = PuzzleTemplate("(c (q {a}) (c (q {b}) (q {a})))")
+    assert template.parameters() == ["a", "b"]
+    for a in (0, 1, 127, 128, 255, 256, 10 ** 12, b"\x01", b"\x80", urandom(100)):
+        check_template(template, a=a, b="0xcafe")
+    with pytest.raises(TypeError):
+        template.puzzle(a=1)
+    with pytest.raises(ValueError):
+        PuzzleTemplate('(q "{a}")').puzzle(a=1)
@@ -0,0 +1,51 @@
+from standard_wallet.seen_coins import SeenCoins
+
+
+def test_duplicates_rejected():
+    seen = SeenCoins(window=10)
+    assert seen.add(b"a", 1)
+    assert not seen.add(b"a", 1)
+    assert not seen.add(b"a", 5)
+    assert b"a" in seen
+    assert b"b" not in seen
+
+
+def test_window_is_bounded():
+    seen = SeenCoins(window=10)
+    for height in range(1000):
+        for _ in range(5):
+            assert seen.add(b"%d-%d" % (height, _), height)
+    assert len(seen) <= 11 * 5
+    assert seen.tip() == 999
+    assert seen.watermark() == 989
+    assert b"999-0" in seen
+    assert b"0-0" not in seen
+
+
+def test_watermark():
+    seen = SeenCoins(window=10)
+    seen.add(b"a", 100)
+    assert not seen.add(b"b", 90)
+    assert seen.add(b"b", 91)
+    assert b"b" in seen
+
+
+def test_kept_coins_outlive_window():
+    seen = SeenCoins(window=10)
+    assert seen.add(b"mine", 1, keep=True)
+    assert seen.add(b"theirs", 1)
+    for height in range(2, 100):
+        seen.add(b"%d" % height, height)
+    assert b"mine" in seen
+    assert b"theirs" not in seen
+    assert not seen.add(b"mine", 100)
+    assert seen.add(b"theirs", 100)
+
+
+def test_default_height_is_tip():
+    seen = SeenCoins(window=10)
+    assert seen.add(b"a")
+    assert seen.tip() == 0
+    seen.add(b"b", 50)
+    assert seen.add(b"c")
+    assert seen.tip() == 50
@@ -2,14 +2,17 @@ import asyncio
 import pathlib
 import tempfile
 import clvm
+import pytest
 from aiter import map_aiter
 from standard_wallet.wallet import Wallet
+from standard_wallet.wallet_store import WalletStore
+from utilities.block_sync import BlockSync
 from chiasim.utils.log import init_logging
 from chiasim.remote.api_server import api_server
 from chiasim.remote.client import request_response_proxy
 from chiasim.clients import ledger_sim
 from chiasim.ledger import ledger_api
-from chiasim.hashable import Coin
+from chiasim.hashable import Coin, HeaderHash
 from chiasim.storage import RAM_DB
 from chiasim.utils.server import start_unix_server_aiter
 from chiasim.wallet.deltas import additions_for_body, removals_for_body
@@ -178,6 +181,243 @@ def test_spend_failure():
     assert wallet_a.temp_balance == 1000
 
 
+def test_batch_spend():
+    remote = make_client_server()
+    run = asyncio.get_event_loop().run_until_complete
+    wallet_a = Wallet()
+    recipients = [Wallet() for _ in range(5)]
+    wallets = [wallet_a] + recipients
+    commit_and_notify(remote, wallets, wallet_a)
+
+    payments = [(wallet.get_new_puzzlehash(), 1000 * (_ + 1)) for _, wallet in enumerate(recipients)]
+    spend_bundle = wallet_a.generate_signed_batch_transaction(payments)
+    assert len(spend_bundle.coin_solutions) == 1
+    _ = run(remote.push_tx(tx=spend_bundle))
+    assert wallet_a.temp_balance == 1000000000 - 15000
+
+    commit_and_notify(remote, wallets, Wallet())
+    assert wallet_a.current_balance == 1000000000 - 15000
+    for _, wallet in enumerate(recipients):
+        assert wallet.current_balance == 1000 * (_ + 1)
+        assert len(wallet.my_utxos) == 1
+
+
+def test_invalid_batch_payments():
+    remote = make_client_server()
+    wallet_a = Wallet()
+    commit_and_notify(remote, [wallet_a], wallet_a)
+    puzzlehash = Wallet().get_new_puzzlehash()
+    for payments in [[], [(puzzlehash, 0)], [(puzzlehash, 1000), (puzzlehash, -500)],
+                     [(puzzlehash, 1000), (puzzlehash, 1000)]]:
+        assert wallet_a.generate_unsigned_batch_transaction(payments) is None
+    assert wallet_a.temp_balance == wallet_a.current_balance
+    assert wallet_a.generate_signed_transaction(0, puzzlehash) is None
+
+
+def test_read_payments_csv():
+    from standard_wallet.wallet_runnable import read_payments_csv
+
+    puzzlehashes = [Wallet().get_new_puzzlehash() for _ in range(2)]
+    path = pathlib.Path(tempfile.mkdtemp(), "payments.csv")
+    path.write_text("# puzzlehash,amount\n%s,100\n\n%s,100\n%s,200\n" % (
+        puzzlehashes[0], puzzlehashes[1], puzzlehashes[0]))
+    assert read_payments_csv(path) == [(puzzlehashes[0], 100), (puzzlehashes[1], 100), (puzzlehashes[0], 200)]
+
+    with open(path, "a") as f:
+        f.write("%s,100\n" % puzzlehashes[1])
+    with pytest.raises(ValueError):
+        read_payments_csv(path)
+
+
+def test_parallel_signing():
+    remote = make_client_server()
+    wallet_a = Wallet()
+    wallet_b = Wallet()
+    wallets = [wallet_a, wallet_b]
+    for _ in range(3):
+        commit_and_notify(remote, wallets, wallet_a)
+
+    payments = [(wallet_b.get_new_puzzlehash(), 2500000000)]
+    transaction = wallet_a.generate_unsigned_batch_transaction(payments)
+    assert len(transaction) == 3
+    serial_bundle = wallet_a.sign_transaction(transaction)
+    wallet_a.enable_parallel_signing(pool_size=2, serial_threshold=1)
+    parallel_bundle = wallet_a.sign_transaction(transaction)
+    wallet_a.signing_pool.close()
+    assert parallel_bundle.aggregated_signature == serial_bundle.aggregated_signature
+
+
+def test_wallet_store():
+    remote = make_client_server()
+    run = asyncio.get_event_loop().run_until_complete
+    wallet_a = Wallet()
+    wallet_b = Wallet()
+    wallets = [wallet_a, wallet_b]
+    commit_and_notify(remote, wallets, wallet_a)
+    commit_and_notify(remote, wallets, wallet_a)
+
+    path = pathlib.Path(tempfile.mkdtemp(), "wallet.db")
+    store = WalletStore(path)
+    assert store.load(wallet_a.seed) is None
+    store.checkpoint(wallet_a, bytes(32))
+
+    spend_bundle = wallet_a.generate_signed_transaction(5000, wallet_b.get_new_puzzlehash())
+    _ = run(remote.push_tx(tx=spend_bundle))
+    commit_and_notify(remote, wallets, Wallet())
+    store.checkpoint(wallet_a, bytes(32))
+    store.close()
+    # the seed isn't written anywhere
+    assert wallet_a.seed not in path.read_bytes()
+
+    store = WalletStore(path)
+    with pytest.raises(ValueError):
+        store.load(wallet_b.seed)
+    restored = store.load(wallet_a.seed)
+    assert bytes(store.last_header()) == bytes(32)
+    assert restored.next_address == wallet_a.next_address
+    assert restored.current_balance == wallet_a.current_balance
+    assert restored.my_utxos == wallet_a.my_utxos
+    for solution in spend_bundle.coin_solutions:
+        assert solution.coin.name() in restored.seen_deletions
+
+    spend_bundle = restored.generate_signed_transaction(1000, wallet_b.get_new_puzzlehash())
+    _ = run(remote.push_tx(tx=spend_bundle))
+    commit_and_notify(remote, [restored, wallet_b], Wallet())
+    assert restored.current_balance == wallet_a.current_balance - 1000
+    assert wallet_b.current_balance == 6000
+    store.close()
+
+    # spent coins are only kept for the window
+    store = WalletStore(path, spent_window=1)
+    store.checkpoint(restored)
+    assert store._db.execute("SELECT COUNT(*) FROM spent").fetchone()[0] > 0
+    commit_and_notify(remote, [restored], Wallet())
+    commit_and_notify(remote, [restored], Wallet())
+    store.checkpoint(restored)
+    assert store._db.execute("SELECT COUNT(*) FROM spent").fetchone()[0] == 0
+    reloaded = store.load(restored.seed)
+    assert reloaded.my_utxos == restored.my_utxos
+    assert reloaded.seen_additions.tip() == restored.seen_additions.tip()
+    store.close()
+
+
+def test_duplicate_notify():
+    wallet = Wallet()
+    coin = Coin(bytes(32), wallet.get_new_puzzlehash(), 1000)
+    wallet.notify([coin], [])
+    wallet.notify([coin], [])
+    assert wallet.current_balance == 1000
+    wallet.notify([], [coin])
+    wallet.notify([coin], [coin])
+    assert wallet.current_balance == 0
+    assert len(wallet.my_utxos) == 0
+
+
+def test_block_sync():
+    remote = make_client_server()
+    run = asyncio.get_event_loop().run_until_complete
+    wallet_a = Wallet()
+    wallet_b = Wallet()
+    for _ in range(40):
+        commit_and_notify(remote, [wallet_a], wallet_a)
+    spend_bundle = wallet_a.generate_signed_transaction(5000, wallet_b.get_new_puzzlehash())
+    _ = run(remote.push_tx(tx=spend_bundle))
+    commit_and_notify(remote, [wallet_a], wallet_a)
+
+    tip = run(remote.get_tip())
+
+    async def sync(block_sync):
+        return [_ async for _ in block_sync.new_blocks()]
+
+    block_sync = BlockSync(remote, window=8)
+    blocks = run(sync(block_sync))
+    assert len(blocks) == 41
+    assert block_sync.checkpoint() == tip["tip_hash"]
+    previous_hash = tip["genesis_hash"]
+    for index, header, additions, removals in blocks:
+        assert header.previous_hash == previous_hash
+        previous_hash = HeaderHash(header)
+    assert [_[0] for _ in blocks] == list(range(tip["tip_index"] - 40, tip["tip_index"] + 1))
+    removed = [coin for index, header, additions, removals in blocks for coin in removals]
+    assert set(removed) == set(_.coin for _ in spend_bundle.coin_solutions)
+    assert run(sync(block_sync)) == []
+
+    for window in (1, 100):
+        assert [_[1] for _ in run(sync(BlockSync(remote, window=window)))] == [_[1] for _ in blocks]
+
+    for index, header, additions, removals in blocks:
+        wallet_b.notify(additions, removals, index)
+    assert wallet_b.current_balance == 5000
+
+    commit_and_notify(remote, [wallet_a], wallet_a)
+    new_blocks = run(sync(block_sync))
+    assert len(new_blocks) == 1
+    assert new_blocks[0][0] == tip["tip_index"] + 1
+
+    # a checkpoint that's no longer on the chain is reported, then the chain is synced again from genesis
+    reorgs = []
+
+    def on_reorg():
+        reorgs.append(block_sync.checkpoint())
+        wallet_b.clear_coins()
+
+    block_sync = BlockSync(remote, checkpoint=bytes(32), on_reorg=on_reorg)
+    synced = run(sync(block_sync))
+    assert reorgs == [bytes(32)]
+    assert [_[1] for _ in synced][:41] == [_[1] for _ in blocks]
+    assert synced[0][0] == blocks[0][0]
+    for index, header, additions, removals in synced:
+        wallet_b.notify(additions, removals, index)
+    assert wallet_b.current_balance == 5000
+    assert run(sync(block_sync)) == []
+    assert reorgs == [bytes(32)]
+
+    class CountingLedgerAPI:
+        def __init__(self):
+            self.preimages = []
+
+        async def hash_preimage(self, hash):
+            self.preimages.append(hash)
+            return await remote.hash_preimage(hash=hash)
+
+        def __getattr__(self, attr):
+            return getattr(remote, attr)
+
+    # the spent coins were added in synced blocks, so they're never looked up
+    counting = CountingLedgerAPI()
+    assert [_[3] for _ in run(sync(BlockSync(counting, window=8)))][:41] == [_[3] for _ in blocks]
+    assert not set(_.name() for _ in removed) & set(counting.preimages)
+
+    # unless the sync starts after they were added
+    counting = CountingLedgerAPI()
+    block_sync = BlockSync(counting, checkpoint=blocks[-2][1].previous_hash)
+    assert [_[3] for _ in run(sync(block_sync))][1] == blocks[-1][3]
+    assert set(_.name() for _ in removed) <= set(counting.preimages)
+
+    # the index of unspent coins is bounded, and only takes coins that pass the filter
+    block_sync = BlockSync(remote, coin_cache_size=10)
+    assert [_[3] for _ in run(sync(block_sync))][:41] == [_[3] for _ in blocks]
+    assert len(block_sync._coins) == 10
+    counting = CountingLedgerAPI()
+    block_sync = BlockSync(counting, puzzle_hash_filter=lambda puzzle_hash: False)
+    assert [_[3] for _ in run(sync(block_sync))][:41] == [_[3] for _ in blocks]
+    assert len(block_sync._coins) == 0
+    assert set(_.name() for _ in removed) <= set(counting.preimages)
+
+
+def test_puzzle_hash_index():
+    wallet = Wallet()
+    puzzlehashes = [wallet.get_new_puzzlehash() for _ in range(20)]
+    for child, puzzlehash in enumerate(puzzlehashes):
+        assert wallet.can_generate_puzzle_hash(puzzlehash)
+        pubkey, secretkey = wallet.get_keys(puzzlehash)
+        assert pubkey == wallet.extended_secret_key.public_child(child)
+        assert secretkey.public_key() == pubkey
+    assert wallet.indexed_address == wallet.next_address
+    assert not wallet.can_generate_puzzle_hash(Wallet().get_new_puzzlehash())
+    assert wallet.get_keys(bytes(32)) is None
+
+
 """
 Copyright 2018 Chia Network Inc
 Licensed under the Apache License, Version 2.0 (the "License");
@@ -0,0 +1,186 @@
+"""
+Block sync
+
+A BlockSync follows the ledger_sim chain for one client and yields
+(index, header, additions, removals) for every block after its checkpoint,
+oldest first, moving the checkpoint on as it goes.
+
+Headers can only be found one at a time, by walking back along
+previous_hash from the tip to the checkpoint. The bodies of those blocks
+and the preimages of the coins they remove are then fetched concurrently,
+`window` blocks at a time, while the caller processes the previous window.
+Removed coins are resolved from an index of the coins the sync has seen
+added and not yet seen spent, so only coins created before the checkpoint
+need to be looked up on the ledger. The index only takes the coins whose
+puzzle hash passes the sync's puzzle_hash_filter, if it has one, and keeps
+the COIN_CACHE_SIZE most recently added; coins that aren't in it are
+looked up too. Recently seen headers and bodies are
+cached, and the header and body returned by next_block can be added to the
+cache so syncing a block the client just farmed costs no round trips.
+
+If the checkpoint is no longer on the chain, the walk goes back to genesis
+and blocks are yielded again from index 1. The sync's on_reorg callback is
+called before the first of them, so a caller that keeps per block state
+can forget it instead of counting those blocks twice.
+"""
+
+import asyncio
+
+from collections import OrderedDict
+
+from chiasim.hashable import Body, Coin, Header, HeaderHash
+from chiasim.wallet.deltas import additions_for_body, removals_for_body
+
+
+# number of blocks fetched concurrently
+FETCH_WINDOW = 16
+
+# number of headers and bodies kept in the cache
+CACHE_SIZE = 256
+
+# number of unspent coins kept in the index
+COIN_CACHE_SIZE = 65536
+
+
+class BlockSync:
+    """
+    ledger_api is a ledger_sim proxy. If removal_coins is False, removals
+    are yielded as coin names and their preimages aren't fetched.
+    puzzle_hash_filter(puzzle_hash) says whether to index an added coin, for
+    callers that only care about the spends of some coins. on_reorg() is
+    called when the checkpoint is no longer on the chain, before blocks are
+    yielded again from genesis.
+    """
+
+    def __init__(self, ledger_api, checkpoint=None, window=FETCH_WINDOW, removal_coins=True,
+                 puzzle_hash_filter=None, coin_cache_size=COIN_CACHE_SIZE, on_reorg=None):
+        self._ledger_api = ledger_api
+        self._checkpoint = checkpoint
+        self._window = window
+        self._removal_coins = removal_coins
+        self._puzzle_hash_filter = puzzle_hash_filter
+        self._coin_cache_size = coin_cache_size
+        self._on_reorg = on_reorg
+        self._headers = OrderedDict()  # {header_hash: header}
+        self._bodies = OrderedDict()  # {body_hash: body}
+        self._coins = OrderedDict()  # {coin name: coin} for coins seen as additions and not yet spent
+
+    def ledger_api(self):
+        return self._ledger_api
+
+    def checkpoint(self):
+        """
+        Return the hash of the last header yielded, or the one the sync was
+        started from.
+        """
+        return self._checkpoint
+
+    def _cache(self, cache, key, value, size=CACHE_SIZE):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > size:
+            cache.popitem(last=False)
+
+    def add_block(self, header, body=None):
+        """
+        Cache a header and its body, such as the ones next_block returns.
+        """
+        self._cache(self._headers, HeaderHash(header), header)
+        if body is not None:
+            self._cache(self._bodies, header.body_hash, body)
+
+    async def header(self, header_hash):
+        header = self._headers.get(header_hash)
+        if header is None:
+            header = Header.from_bytes(await self._ledger_api.hash_preimage(hash=header_hash))
+            self._cache(self._headers, header_hash, header)
+        return header
+
+    async def body(self, header):
+        body = self._bodies.get(header.body_hash)
+        if body is None:
+            body = Body.from_bytes(await self._ledger_api.hash_preimage(hash=header.body_hash))
+            self._cache(self._bodies, header.body_hash, body)
+        return body
+
+    async def headers_since(self, last_known_header, header_hash, genesis_hash=None):
+        """
+        Return the headers after last_known_header up to and including the
+        one with hash header_hash, oldest first. The walk also stops at
+        genesis_hash.
+        """
+        headers = []
+        while header_hash != last_known_header and header_hash != genesis_hash:
+            header = await self.header(header_hash)
+            headers.append(header)
+            header_hash = header.previous_hash
+        headers.reverse()
+        return headers
+
+    async def fetch_window(self, headers):
+        """
+        Return [(header, additions, removals)] for the blocks with the given
+        consecutive headers.
+        """
+        bodies = await asyncio.gather(*[self.body(_) for _ in headers])
+        additions = [list(additions_for_body(_)) for _ in bodies]
+        removals = [list(removals_for_body(_)) for _ in bodies]
+        if self._removal_coins:
+            for coins in additions:
+                for coin in coins:
+                    if self._puzzle_hash_filter is None or self._puzzle_hash_filter(coin.puzzle_hash):
+                        self._cache(self._coins, coin.name(), coin, self._coin_cache_size)
+            removals = await self.resolve_coins(removals)
+        return list(zip(headers, additions, removals))
+
+    async def resolve_coins(self, coin_name_lists):
+        """
+        Replace each list of coin names with a list of the coins, which are
+        then forgotten since they can only be spent once. Coins that weren't
+        seen as additions are looked up on the ledger, all at the same time.
+        """
+        unknown = set(name for names in coin_name_lists for name in names if name not in self._coins)
+        if unknown:
+            unknown = list(unknown)
+            preimages = await asyncio.gather(*[self._ledger_api.hash_preimage(hash=_) for _ in unknown])
+            for name, preimage in zip(unknown, preimages):
+                self._coins[name] = Coin.from_bytes(preimage)
+        return [[self._coins.pop(name) for name in names] for names in coin_name_lists]
+
+    async def fetch_blocks(self, headers):
+        """
+        Yield (header, additions, removals) for each header, in order, with
+        the next window of blocks being fetched while the current one is
+        processed.
+        """
+        def fetch_window(start):
+            return asyncio.ensure_future(self.fetch_window(headers[start:start + self._window]))
+
+        pending = fetch_window(0) if headers else None
+        for start in range(0, len(headers), self._window):
+            blocks = await pending
+            if start + self._window < len(headers):
+                pending = fetch_window(start + self._window)
+            for block in blocks:
+                yield block
+
+    async def new_blocks(self):
+        """
+        Yield (index, header, additions, removals) for each block after the
+        checkpoint up to the current tip.
+        """
+        tip = await self._ledger_api.get_tip()
+        if tip["tip_hash"] == self._checkpoint:
+            return
+        headers = await self.headers_since(self._checkpoint, tip["tip_hash"], tip["genesis_hash"])
+        first_previous_hash = headers[0].previous_hash if headers else tip["tip_hash"]
+        if self._checkpoint is not None and first_previous_hash != self._checkpoint:
+            # the walk went back to genesis without finding the checkpoint
+            if self._on_reorg is not None:
+                self._on_reorg()
+            self._checkpoint = first_previous_hash
+        index = tip["tip_index"] - len(headers) + 1
+        async for header, additions, removals in self.fetch_blocks(headers):
+            yield index, header, additions, removals
+            self._checkpoint = HeaderHash(header)
+            index += 1
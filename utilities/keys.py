@@ -1,4 +1,4 @@
-from chiasim.hashable import BLSSignature, CoinSolution, ProgramHash, SpendBundle
+from chiasim.hashable import BLSSignature, CoinSolution, SpendBundle
 from chiasim.puzzles import p2_delegated_puzzle
 from chiasim.validation.consensus import conditions_for_solution, hash_key_pairs_for_conditions_dict
 from chiasim.validation.Conditions import conditions_by_opcode, make_create_coin_condition
@@ -29,7 +29,7 @@ def puzzle_program_for_index(index):
 
 
 def puzzle_hash_for_index(index):
-    return ProgramHash(puzzle_program_for_index(index))
+    return p2_delegated_puzzle.puzzle_hash_for_pk(public_key_bytes_for_index(index))
 
 
 def conditions_for_payment(puzzle_hash_amount_pairs):
@@ -0,0 +1,226 @@
+"""
+Local cache of ledger_sim preimages
+
+Headers, bodies and coins are all addressed by the sha256 of their
+serialization, so they can be cached locally and checked on the way out.
+A PreimageCache keeps them in one append-only file of records
+
+    hash (32 bytes) | length (4 bytes, big endian) | preimage
+
+with an in-memory index of record offsets, built by scanning the file, and
+reads served from an mmap of it. Any number of processes can share a cache
+file: appends are made under an exclusive lock, and a process picks up
+records appended by the others when it misses.
+
+When the file grows past max_size it is compacted: the most recently used
+records that fit in half of max_size are copied to a new file, which
+replaces the old one. Other processes notice the replacement and re-index.
+
+CachedLedgerAPI puts a cache in front of a ledger_sim proxy's hash_preimage.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+
+from collections import OrderedDict
+from pathlib import Path
+
+
+DEFAULT_PATH = Path.home() / ".chia_wallets" / "preimages"
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+RECORD_HEADER_SIZE = 36
+
+
+class PreimageCache:
+    def __init__(self, path=DEFAULT_PATH, max_size=DEFAULT_MAX_SIZE):
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+        self._file = None
+        self._mmap = None
+        self._open()
+
+    def _open(self):
+        if self._file is not None:
+            self._close_file()
+        self._file = open(self._path, "a+b")
+        self._index = OrderedDict()  # {hash: (offset, length)}, least recently used first
+        self._scanned = 0
+        self._refresh()
+
+    def _close_file(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._close_file()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, hash):
+        return bytes(hash) in self._index
+
+    def _replaced(self):
+        try:
+            return os.stat(self._path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _refresh(self):
+        """
+        Index any records appended since the last scan, by this process or
+        another one.
+        """
+        if self._replaced():
+            self._open()
+            return
+        if os.fstat(self._file.fileno()).st_size <= self._scanned:
+            return
+        fcntl.flock(self._file, fcntl.LOCK_SH)
+        try:
+            self._index_tail()
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _index_tail(self):
+        """
+        Index the complete records after the last scan. The caller holds a
+        lock on the file.
+        """
+        self._file.seek(self._scanned)
+        data = self._file.read()
+        offset = 0
+        while offset + RECORD_HEADER_SIZE <= len(data):
+            hash = data[offset:offset + 32]
+            length = int.from_bytes(data[offset + 32:offset + RECORD_HEADER_SIZE], "big")
+            if offset + RECORD_HEADER_SIZE + length > len(data):
+                break
+            self._index[hash] = (self._scanned + offset + RECORD_HEADER_SIZE, length)
+            self._index.move_to_end(hash)
+            offset += RECORD_HEADER_SIZE + length
+        self._scanned += offset
+        return len(data) - offset
+
+    def _read(self, offset, length):
+        if self._mmap is None or offset + length > len(self._mmap):
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap[offset:offset + length]
+
+    def get(self, hash):
+        """
+        Return the preimage of hash, or None if it isn't cached.
+        """
+        hash = bytes(hash)
+        if hash not in self._index:
+            self._refresh()
+            if hash not in self._index:
+                return None
+        offset, length = self._index[hash]
+        blob = self._read(offset, length)
+        if hashlib.sha256(blob).digest() != hash:
+            # a damaged record is treated as missing
+            del self._index[hash]
+            return None
+        self._index.move_to_end(hash)
+        return blob
+
+    def put(self, hash, blob):
+        """
+        Cache blob as the preimage of hash. Returns False, and caches
+        nothing, if it isn't.
+        """
+        hash = bytes(hash)
+        blob = bytes(blob)
+        if hashlib.sha256(blob).digest() != hash:
+            return False
+        self._lock_for_append()
+        try:
+            if hash not in self._index:
+                self._file.seek(0, os.SEEK_END)
+                self._file.write(hash + len(blob).to_bytes(4, "big") + blob)
+                self._file.flush()
+                self._index[hash] = (self._scanned + RECORD_HEADER_SIZE, len(blob))
+                self._scanned += RECORD_HEADER_SIZE + len(blob)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        if self._scanned > self._max_size:
+            self.compact()
+        return True
+
+    def _lock_for_append(self):
+        """
+        Take the exclusive lock on the current file, with every complete
+        record in it indexed and any partial record left by a crashed
+        writer removed.
+        """
+        while True:
+            if self._replaced():
+                self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            if not self._replaced():
+                break
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        if self._index_tail() > 0:
+            self._file.truncate(self._scanned)
+
+    def compact(self, target_size=None):
+        """
+        Rewrite the file with the most recently used records that fit in
+        target_size (half of max_size by default).
+        """
+        if target_size is None:
+            target_size = self._max_size // 2
+        temp_path = self._path.with_name(self._path.name + ".compact")
+        self._lock_for_append()
+        try:
+            keep = []
+            size = 0
+            for hash in reversed(self._index):
+                length = self._index[hash][1]
+                if size + RECORD_HEADER_SIZE + length > target_size:
+                    break
+                keep.append(hash)
+                size += RECORD_HEADER_SIZE + length
+            with open(temp_path, "wb") as f:
+                for hash in reversed(keep):
+                    offset, length = self._index[hash]
+                    f.write(hash + length.to_bytes(4, "big") + self._read(offset, length))
+            os.replace(temp_path, self._path)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._open()
+
+
+class CachedLedgerAPI:
+    """
+    A ledger_sim proxy whose hash_preimage calls are served from a
+    PreimageCache when possible. Everything else goes to ledger_api.
+    """
+
+    def __init__(self, ledger_api, cache):
+        self._ledger_api = ledger_api
+        self._cache = cache
+
+    def preimage_cache(self):
+        return self._cache
+
+    async def hash_preimage(self, hash):
+        blob = self._cache.get(hash)
+        if blob is None:
+            blob = await self._ledger_api.hash_preimage(hash=hash)
+            if blob is not None:
+                self._cache.put(hash, blob)
+        return blob
+
+    def __getattr__(self, attr):
+        return getattr(self._ledger_api, attr)
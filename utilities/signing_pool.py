@@ -0,0 +1,140 @@
+"""
+Signing engine shared by the wallets.
+
+A signing job is a tuple (mode, puzzle, solution, child) where child is the
+index of the key under the wallet's BLSPrivateHDKey that signs the spend:
+
+    SIGN_CONDITIONS      run the puzzle with the solution and sign every
+                         AGG_SIG message hash it outputs
+    SIGN_SOLUTION_HASH   sign the ProgramHash of the solution
+
+Small batches are signed in process. Batches of at least serial_threshold
+jobs are serialized and spread over a process pool, where each worker
+evaluates the conditions and signs, and only the signatures come back to
+be aggregated by the caller.
+"""
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import clvm
+
+from chiasim.hashable import BLSSignature, Program, ProgramHash
+from chiasim.validation.Conditions import conditions_by_opcode
+from chiasim.validation.consensus import (
+    conditions_for_solution, hash_key_pairs_for_conditions_dict
+)
+
+from .BLSHDKey import BLSPrivateHDKey
+
+
+SIGN_CONDITIONS = "conditions"
+SIGN_SOLUTION_HASH = "solution_hash"
+
+SERIAL_THRESHOLD = 16
+
+
+def signatures_for_spend(secretkey, mode, puzzle, solution):
+    """
+    Return the list of signatures secretkey contributes to the spend.
+    """
+    if mode == SIGN_SOLUTION_HASH:
+        return [secretkey.sign(ProgramHash(Program(solution)))]
+    sexp = clvm.to_sexp_f([puzzle, solution])
+    conditions_dict = conditions_by_opcode(conditions_for_solution(sexp))
+    return [secretkey.sign(_.message_hash)
+            for _ in hash_key_pairs_for_conditions_dict(conditions_dict)]
+
+
+class ChildKeyCache:
+    """
+    Derive each child private key from the root once.
+    """
+
+    def __init__(self, extended_secret_key):
+        self._extended_secret_key = extended_secret_key
+        self._private_keys = {}
+
+    def private_child(self, child):
+        if child not in self._private_keys:
+            self._private_keys[child] = self._extended_secret_key.private_child(child)
+        return self._private_keys[child]
+
+
+# state of a worker process in the pool
+_worker_keys = None
+
+
+def _init_worker(extended_secret_key_blob):
+    global _worker_keys
+    _worker_keys = ChildKeyCache(BLSPrivateHDKey.from_bytes(extended_secret_key_blob))
+
+
+def _sign_serialized_job(job):
+    mode, puzzle_blob, solution_blob, child = job
+    secretkey = _worker_keys.private_child(child)
+    signatures = signatures_for_spend(
+        secretkey, mode, Program.from_bytes(puzzle_blob), Program.from_bytes(solution_blob))
+    return [bytes(_) for _ in signatures]
+
+
+class SigningPool:
+    """
+    Sign jobs for the children of one BLSPrivateHDKey.
+
+    pool_size is the number of worker processes (None means one per cpu,
+    0 means always sign in process). Batches smaller than serial_threshold
+    are always signed in process, since shipping them to workers costs
+    more than it saves.
+    """
+
+    def __init__(self, extended_secret_key, pool_size=None, serial_threshold=SERIAL_THRESHOLD):
+        if pool_size is None:
+            pool_size = os.cpu_count() or 1
+        self._extended_secret_key = extended_secret_key
+        self._keys = ChildKeyCache(extended_secret_key)
+        self._pool_size = pool_size
+        self._serial_threshold = serial_threshold
+        self._executor = None
+
+    def pool_size(self):
+        return self._pool_size
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._pool_size,
+                initializer=_init_worker,
+                initargs=(bytes(self._extended_secret_key),))
+        return self._executor
+
+    def sign_serial(self, jobs):
+        sigs = []
+        for mode, puzzle, solution, child in jobs:
+            sigs.extend(signatures_for_spend(self._keys.private_child(child), mode, puzzle, solution))
+        return sigs
+
+    def sign_parallel(self, jobs):
+        serialized_jobs = [
+            (mode, bytes(Program(puzzle)), bytes(Program(solution)), child)
+            for mode, puzzle, solution, child in jobs]
+        chunksize = max(1, len(serialized_jobs) // (self._pool_size * 4))
+        sigs = []
+        for blobs in self._get_executor().map(_sign_serialized_job, serialized_jobs, chunksize=chunksize):
+            sigs.extend(BLSSignature.from_bytes(_) for _ in blobs)
+        return sigs
+
+    def sign(self, jobs):
+        """
+        Return the list of signatures for all the jobs, in job order.
+        """
+        jobs = list(jobs)
+        if self._pool_size < 2 or len(jobs) < self._serial_threshold:
+            return self.sign_serial(jobs)
+        return self.sign_parallel(jobs)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None